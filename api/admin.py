@@ -2,8 +2,10 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .models import (
     CustomUser, UserProfile, Hechizo, Pocion, CompraHechizo, CompraPocion,
-    CartaTarot, TipoTirada, TiradaRealizada, CartaEnTirada
+    CartaTarot, TipoTirada, TiradaRealizada, CartaEnTirada, GemTransaction, WebhookEvent,
+    LoteInterpretacion
 )
+from .interpretation_queue import marcar_para_regenerar
 
 
 class CustomUserAdmin(UserAdmin):
@@ -68,14 +70,42 @@ class CartaEnTiradaInline(admin.TabularInline):
     
 @admin.register(TiradaRealizada)
 class TiradaRealizadaAdmin(admin.ModelAdmin):
-    list_display = ['user', 'tipo_tirada', 'fecha', 'pregunta_truncada']
-    list_filter = ['tipo_tirada', 'fecha']
+    list_display = ['user', 'tipo_tirada', 'fecha', 'estado', 'urgente', 'regenerar', 'pregunta_truncada']
+    list_filter = ['tipo_tirada', 'estado', 'urgente', 'regenerar', 'fecha']
     search_fields = ['user__email', 'pregunta', 'interpretacion']
     inlines = [CartaEnTiradaInline]
+    actions = ['regenerar_interpretaciones']
     
     def pregunta_truncada(self, obj):
         return obj.pregunta[:50] + '...' if len(obj.pregunta) > 50 else obj.pregunta
     pregunta_truncada.short_description = 'Pregunta'
 
+    @admin.action(description='Regenerar interpretaciones (por lotes)')
+    def regenerar_interpretaciones(self, request, queryset):
+        marcadas = marcar_para_regenerar(queryset)
+        self.message_user(request, f"{marcadas} tiradas se regenerarán en el próximo lote")
+
+@admin.register(GemTransaction)
+class GemTransactionAdmin(admin.ModelAdmin):
+    list_display = ['user', 'amount', 'reason', 'reference', 'applied', 'created_at']
+    list_filter = ['reason', 'applied', 'created_at']
+    search_fields = ['user__email', 'reference']
+    # El libro es de solo inserciones: los ajustes se registran como nuevos movimientos
+    readonly_fields = ['user', 'amount', 'reason', 'reference', 'applied', 'created_at']
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['provider', 'event_type', 'event_id', 'estado', 'intentos', 'recibido', 'procesado']
+    list_filter = ['provider', 'estado', 'event_type']
+    search_fields = ['event_id']
+    readonly_fields = ['provider', 'event_id', 'event_type', 'payload', 'recibido', 'procesado']
+
+@admin.register(LoteInterpretacion)
+class LoteInterpretacionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'backend', 'lote_id', 'estado', 'creado', 'finalizado']
+    list_filter = ['backend', 'estado']
+    search_fields = ['lote_id']
+    readonly_fields = ['backend', 'lote_id', 'estado', 'creado', 'finalizado']
+
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(UserProfile)
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+Authentication module for TarotNautica
+
+JWTClaimsAuthentication evita cargar el usuario en cada petición: el token
+firmado ya trae `user_id` y `email` (ver custom_token.py), así
+que request.user se construye a partir de esos claims como una instancia de
+CustomUser con el resto de campos diferidos. Solo el acceso a un campo que no
+viene en el token (p. ej. is_staff en IsAdminUser) hace una consulta.
+
+Los tokens emitidos sin estos claims se resuelven como siempre, cargando el
+usuario de la base de datos. Un usuario desactivado o eliminado conserva el
+acceso hasta que caduque su access token (ACCESS_TOKEN_LIFETIME).
+"""
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .models import CustomUser
+
+# Claims que CustomTokenObtainPairSerializer añade al token
+CLAIMS_USUARIO = ('email',)
+
+
+def usuario_desde_claims(validated_token):
+    """CustomUser con id y email tomados del token y los demás campos diferidos"""
+    return CustomUser.from_db(
+        DEFAULT_DB_ALIAS,
+        ['id', 'email', 'is_active'],
+        [validated_token[api_settings.USER_ID_CLAIM], validated_token['email'], True]
+    )
+
+
+class JWTClaimsAuthentication(JWTAuthentication):
+    """JWTAuthentication que confía en los claims del token en lugar de consultar el usuario"""
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken("El token no contiene identificación de usuario")
+        if not all(claim in validated_token for claim in CLAIMS_USUARIO):
+            # Token emitido antes de añadir los claims
+            return super().get_user(validated_token)
+        return usuario_desde_claims(validated_token)
@@ -0,0 +1,79 @@
+"""
+Catalog cache module for TarotNautica
+
+Hechizos, pociones, cartas y tipos de tirada solo cambian cuando un admin los
+edita. Cada catálogo tiene un contador de versión en la caché por defecto que
+las señales post_save/post_delete incrementan (ver signals.py). Las respuestas
+ya serializadas se guardan por (catálogo, variante, versión) junto con un ETag
+fuerte calculado sobre el cuerpo, de modo que:
+
+- una versión ya servida no vuelve a consultar la base ni a serializar, y
+- un cliente que envía If-None-Match con el ETag vigente recibe un 304 vacío.
+
+El contador solo es común a todos los procesos si la caché por defecto es
+compartida (CACHE_URL, ver core/settings.py). Con la LocMemCache de cada
+proceso una edición solo invalida el proceso que la hizo; los demás sirven la
+versión anterior hasta reiniciarse.
+
+Solo el contador es permanente. Las respuestas caducan tras CACHE_CATALOGO_TTL
+para que las de versiones ya sustituidas no se acumulen en la caché.
+"""
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+CATALOGOS = ('hechizos', 'pociones', 'cartas', 'tipos_tirada')
+
+
+def clave_version(catalogo):
+    return f'catalogo_version:{catalogo}'
+
+
+def version_catalogo(catalogo):
+    """Versión vigente del catálogo en la caché por defecto"""
+    # Si la caché descarta el contador, el nuevo arranca por encima de las versiones ya usadas
+    return cache.get_or_set(clave_version(catalogo), time.time_ns(), timeout=None)
+
+
+def invalidar_catalogo(catalogo):
+    """Marca como obsoletas las respuestas cacheadas del catálogo"""
+    try:
+        cache.incr(clave_version(catalogo))
+    except ValueError:
+        cache.set(clave_version(catalogo), time.time_ns(), timeout=None)
+
+
+def obtener_catalogo(catalogo, construir, variante=''):
+    """
+    Retorna (etag, cuerpo JSON) de la versión vigente del catálogo.
+
+    Args:
+        catalogo: Uno de CATALOGOS
+        construir: Función sin argumentos que devuelve los datos serializados
+        variante: Distingue respuestas del mismo catálogo (p. ej. la categoría)
+    """
+    clave = f'catalogo:{catalogo}:{variante}:{version_catalogo(catalogo)}'
+    entrada = cache.get(clave)
+    if entrada is None:
+        cuerpo = JSONRenderer().render(construir())
+        entrada = ('"' + hashlib.sha256(cuerpo).hexdigest()[:32] + '"', cuerpo)
+        cache.set(clave, entrada, timeout=settings.CACHE_CATALOGO_TTL)
+    return entrada
+
+
+def respuesta_catalogo(request, catalogo, construir, variante=''):
+    """Respuesta JSON del catálogo con ETag, o 304 si el cliente ya tiene esa versión"""
+    etag, cuerpo = obtener_catalogo(catalogo, construir, variante)
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(cuerpo, content_type='application/json')
+    response['ETag'] = etag
+    # Datos de usuarios autenticados: solo caché del cliente, revalidando siempre
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,165 @@
+"""
+Catalog sync module for TarotNautica
+
+Sincroniza cartas, tipos de tirada, hechizos y pociones con un catálogo
+versionado en JSON o YAML (catalogo.json en la raíz del proyecto):
+
+    {"version": 1, "cartas": [...], "tipos_tirada": [...], "hechizos": [...], "pociones": [...]}
+
+Cada sección se identifica por su clave natural (ver SECCIONES). El diff lee
+cada modelo con una sola consulta y los cambios se aplican con
+bulk_create/bulk_update en una transacción. Una sección ausente del archivo
+no se toca. Los hechizos y pociones que ya no están en su sección se
+desactivan; las cartas y los tipos de tirada sobrantes solo se informan,
+porque las tiradas guardadas los referencian.
+
+Los INSERT/UPDATE masivos no emiten post_save: tras la transacción se
+invalidan a mano las cachés de los catálogos modificados y el mazo en memoria.
+Esa invalidación pasa por la caché por defecto: solo llega a los workers de la
+aplicación si es compartida (CACHE_URL, ver core/settings.py). Con la
+LocMemCache de cada proceso el comando solo invalida su propia caché, y la
+aplicación debe reiniciarse para servir el catálogo nuevo.
+"""
+import json
+from pathlib import Path
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from .catalog import invalidar_catalogo
+from .models import CartaTarot, Hechizo, Pocion, TipoTirada
+from .tarot_deck import invalidar_mazo
+
+# Versiones del formato del catálogo que se saben leer
+VERSIONES_SOPORTADAS = {1}
+
+# Filas por INSERT/UPDATE masivo
+TAMANO_LOTE = 500
+
+# Sección -> (modelo, clave natural, campos sincronizados, desactivar los sobrantes)
+SECCIONES = {
+    'cartas': (CartaTarot, 'numero', ['nombre', 'imagen_nombre', 'significado_normal', 'significado_invertido'], False),
+    'tipos_tirada': (TipoTirada, 'tipo', ['nombre', 'num_cartas', 'descripcion', 'costo_gemas', 'limite_mensual', 'layout_descripcion'], False),
+    'hechizos': (Hechizo, 'titulo', ['descripcion', 'precio_gemas', 'activo', 'categoria'], True),
+    'pociones': (Pocion, 'titulo', ['descripcion', 'precio_gemas', 'activo', 'categoria'], True),
+}
+
+
+def leer_catalogo(ruta):
+    """
+    Lee y valida el archivo del catálogo (JSON, o YAML si la extensión es .yaml/.yml).
+
+    Raises:
+        ValueError: Si el archivo no tiene un formato válido
+    """
+    ruta = Path(ruta)
+    texto = ruta.read_text(encoding='utf-8')
+    if ruta.suffix in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("Leer catálogos YAML requiere PyYAML (pip install pyyaml)")
+        datos = yaml.safe_load(texto)
+    else:
+        datos = json.loads(texto)
+
+    if not isinstance(datos, dict) or datos.get('version') not in VERSIONES_SOPORTADAS:
+        raise ValueError(f"Versión de catálogo no soportada: {datos.get('version') if isinstance(datos, dict) else None}")
+    desconocidas = set(datos) - {'version', *SECCIONES}
+    if desconocidas:
+        raise ValueError(f"Secciones desconocidas: {', '.join(sorted(desconocidas))}")
+    return datos
+
+
+def _normalizar(seccion, entrada):
+    """Valores de la entrada convertidos y validados con los campos del modelo"""
+    modelo, clave, campos, _ = SECCIONES[seccion]
+    desconocidos = set(entrada) - {clave, *campos}
+    if clave not in entrada or desconocidos:
+        raise ValueError(f"{seccion}: entrada inválida {entrada.get(clave)!r} (falta '{clave}' o campos desconocidos)")
+
+    valores = {}
+    for nombre, valor in entrada.items():
+        try:
+            valores[nombre] = modelo._meta.get_field(nombre).clean(valor, None)
+        except ValidationError as e:
+            raise ValueError(f"{seccion} {entrada[clave]!r}, campo '{nombre}': {'; '.join(e.messages)}")
+    return valores
+
+
+def diferencias(seccion, entradas):
+    """
+    Compara una sección del catálogo con la base en una consulta.
+
+    Returns:
+        dict: 'crear' (instancias nuevas), 'actualizar' (lista de (instancia,
+        campos cambiados)) y 'sobrantes' (instancias que ya no están en el catálogo)
+    """
+    modelo, clave, campos, desactivar = SECCIONES[seccion]
+    catalogo = {}
+    for entrada in entradas:
+        valores = _normalizar(seccion, entrada)
+        if valores[clave] in catalogo:
+            raise ValueError(f"{seccion}: '{clave}' repetido: {valores[clave]!r}")
+        catalogo[valores[clave]] = valores
+
+    existentes = {}
+    for fila in modelo.objects.only('id', clave, *campos).order_by():
+        if getattr(fila, clave) in existentes:
+            raise ValueError(f"{seccion}: '{clave}' repetido en la base: {getattr(fila, clave)!r}")
+        existentes[getattr(fila, clave)] = fila
+
+    crear = [modelo(**valores) for valor_clave, valores in catalogo.items() if valor_clave not in existentes]
+    actualizar = []
+    sobrantes = []
+    for valor_clave, fila in existentes.items():
+        valores = catalogo.get(valor_clave)
+        if valores is None:
+            sobrantes.append(fila)
+            if desactivar and fila.activo:
+                fila.activo = False
+                actualizar.append((fila, ['activo']))
+            continue
+        cambiados = [campo for campo in campos if campo in valores and getattr(fila, campo) != valores[campo]]
+        if cambiados:
+            for campo in cambiados:
+                setattr(fila, campo, valores[campo])
+            actualizar.append((fila, cambiados))
+
+    return {'crear': crear, 'actualizar': actualizar, 'sobrantes': sobrantes}
+
+
+def sincronizar(datos, aplicar=True):
+    """
+    Calcula el diff de cada sección presente en `datos` y, si `aplicar`, lo
+    guarda en una transacción.
+
+    Returns:
+        dict: Sección -> diff (ver `diferencias`)
+    """
+    # El diff y los cambios en la misma transacción
+    with transaction.atomic():
+        resultado = {seccion: diferencias(seccion, datos[seccion]) for seccion in SECCIONES if seccion in datos}
+        if not aplicar:
+            return resultado
+
+        modificadas = [seccion for seccion, diff in resultado.items() if diff['crear'] or diff['actualizar']]
+        for seccion in modificadas:
+            modelo = SECCIONES[seccion][0]
+            diff = resultado[seccion]
+            modelo.objects.bulk_create(diff['crear'], batch_size=TAMANO_LOTE)
+            if diff['actualizar']:
+                campos = sorted({campo for _, cambiados in diff['actualizar'] for campo in cambiados})
+                modelo.objects.bulk_update([fila for fila, _ in diff['actualizar']], campos, batch_size=TAMANO_LOTE)
+
+    for seccion in modificadas:
+        invalidar_catalogo(seccion)
+    if 'cartas' in modificadas:
+        invalidar_mazo()
+    return resultado
+
+
+def exportar():
+    """Catálogo actual de la base en el formato que lee `leer_catalogo`"""
+    datos = {'version': max(VERSIONES_SOPORTADAS)}
+    for seccion, (modelo, clave, campos, _) in SECCIONES.items():
+        datos[seccion] = list(modelo.objects.order_by(clave, 'id').values(clave, *campos))
+    return datos
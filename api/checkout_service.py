@@ -0,0 +1,115 @@
+"""
+Checkout service module for TarotNautica
+
+Compra de varios hechizos y pociones en una sola operación: valida todos los
+items de una vez, cobra el total con un único débito condicional y registra
+las compras con un INSERT masivo por tipo, todo en una transacción.
+"""
+from django.db import IntegrityError, transaction
+from . import ledger, owned_items, profile_cache
+from .models import Hechizo, Pocion, CompraHechizo, CompraPocion
+
+# Tipo de item del carrito -> (modelo, modelo de compra, campo de la compra, tipo en owned_items)
+TIPOS_ITEM = {
+    'hechizo': (Hechizo, CompraHechizo, 'hechizo_id', 'hechizos'),
+    'pocion': (Pocion, CompraPocion, 'pocion_id', 'pociones'),
+}
+
+
+def evaluar_items(user, items):
+    """
+    Clasifica cada item del carrito.
+
+    Returns:
+        (resultados, comprables): resultados es una lista de dicts por item con
+        su 'resultado' provisional; comprables, los dicts que se pueden cobrar
+        con su 'precio_gemas'.
+    """
+    ids_por_tipo = {tipo: set() for tipo in TIPOS_ITEM}
+    for item in items:
+        ids_por_tipo[item['tipo']].add(item['id'])
+
+    catalogo = {}
+    for tipo, ids in ids_por_tipo.items():
+        if ids:
+            modelo = TIPOS_ITEM[tipo][0]
+            for item_id, precio in modelo.objects.filter(id__in=ids, activo=True).values_list('id', 'precio_gemas'):
+                catalogo[(tipo, item_id)] = precio
+
+    # Items poseídos y perfil cargados una vez por carrito, no por item
+    poseidos = {
+        tipo: set(owned_items.ids_poseidos(TIPOS_ITEM[tipo][3], user.id)) for tipo, ids in ids_por_tipo.items() if ids
+    }
+    suscrito = bool(ids_por_tipo['pocion']) and profile_cache.obtener_perfil(user.id).tiene_suscripcion
+
+    resultados = []
+    comprables = []
+    vistos = set()
+    for item in items:
+        clave = (item['tipo'], item['id'])
+        resultado = {'tipo': item['tipo'], 'id': item['id']}
+        resultados.append(resultado)
+
+        if clave in vistos:
+            resultado['resultado'] = 'duplicado'
+        elif clave not in catalogo:
+            resultado['resultado'] = 'no_encontrado'
+        elif item['id'] in poseidos[item['tipo']]:
+            resultado['resultado'] = 'ya_comprado'
+        elif item['tipo'] == 'pocion' and not suscrito:
+            resultado['resultado'] = 'requiere_suscripcion'
+        else:
+            resultado['precio_gemas'] = catalogo[clave]
+            comprables.append(resultado)
+        vistos.add(clave)
+
+    return resultados, comprables
+
+
+def procesar_checkout(user, items):
+    """
+    Compra los items del carrito que el usuario puede comprar.
+
+    Args:
+        items: Lista de {'tipo': 'hechizo'|'pocion', 'id': int}
+
+    Returns:
+        (resultados, total_gemas): el resultado de cada item, en el orden
+        recibido, y las gemas cobradas.
+    """
+    for _ in range(2):
+        resultados, comprables = evaluar_items(user, items)
+        total = sum(item['precio_gemas'] for item in comprables)
+        if not comprables:
+            return resultados, 0
+
+        try:
+            with transaction.atomic():
+                referencia = ','.join(f"{item['tipo'][0]}{item['id']}" for item in comprables)[:100]
+                if not ledger.debitar_gemas(user.id, total, 'carrito', referencia):
+                    for item in comprables:
+                        item['resultado'] = 'gemas_insuficientes'
+                    return resultados, 0
+
+                for tipo, (_, modelo_compra, campo, _) in TIPOS_ITEM.items():
+                    compras = [modelo_compra(user=user, **{campo: item['id']}) for item in comprables if item['tipo'] == tipo]
+                    if compras:
+                        modelo_compra.objects.bulk_create(compras)
+        except IntegrityError:
+            # Compra simultánea de algún item: la caché de items poseídos estaba
+            # desactualizada. Se revirtió el cobro; reevaluar contra la base.
+            for _, _, _, tipo_poseido in TIPOS_ITEM.values():
+                owned_items.invalidar(tipo_poseido, user.id)
+            continue
+
+        for tipo, (_, _, _, tipo_poseido) in TIPOS_ITEM.items():
+            if any(item['tipo'] == tipo for item in comprables):
+                owned_items.invalidar(tipo_poseido, user.id)
+        for item in comprables:
+            item['resultado'] = 'comprado'
+        return resultados, total
+
+    # Dos carreras seguidas: informar sin cobrar nada
+    for item in comprables:
+        item['resultado'] = 'reintentar'
+    return resultados, 0
@@ -4,7 +4,8 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
-        # Puedes agregar más datos si quieres:
+        # Claims con los que JWTClaimsAuthentication construye request.user sin consultar la base.
+        # La suscripción no viaja en el token: cambia antes de que caduque y se lee del perfil
         token['email'] = user.email
         return token
 
@@ -0,0 +1,156 @@
+"""
+Outbound HTTP client module for TarotNautica
+
+Todas las llamadas salientes (Anthropic, PayPal, Stripe) comparten una sesión
+de requests con pools de conexiones keep-alive por host, de modo que el
+handshake TCP+TLS se paga una vez por conexión y no en cada petición.
+
+Configuración (core/settings.py):
+    HTTP_POOL_CONNECTIONS: número de hosts con pool propio
+    HTTP_POOL_MAXSIZE: conexiones reutilizables por host
+    HTTP_TIMEOUT: timeout por defecto en segundos
+    HTTP_MAX_RETRIES / HTTP_RETRY_BACKOFF: reintentos ante fallos de conexión
+        y respuestas 502/503/504 (los POST solo se reintentan si no llegaron a enviarse)
+"""
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class MetricasHTTP:
+    """Contadores de latencia y errores por host, seguros entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, host):
+        return self._hosts.setdefault(host, {
+            'solicitudes': 0,
+            'errores': 0,
+            'en_curso': 0,
+            'max_en_curso': 0,
+            'latencia_total_ms': 0.0,
+            'latencia_max_ms': 0.0,
+        })
+
+    def iniciar(self, host):
+        with self._lock:
+            datos = self._host(host)
+            datos['en_curso'] += 1
+            datos['max_en_curso'] = max(datos['max_en_curso'], datos['en_curso'])
+
+    def finalizar(self, host, duracion_ms, error=False):
+        with self._lock:
+            datos = self._host(host)
+            datos['en_curso'] -= 1
+            datos['solicitudes'] += 1
+            datos['latencia_total_ms'] += duracion_ms
+            datos['latencia_max_ms'] = max(datos['latencia_max_ms'], duracion_ms)
+            if error:
+                datos['errores'] += 1
+
+    def resumen(self):
+        with self._lock:
+            resumen = {}
+            for host, datos in self._hosts.items():
+                promedio = datos['latencia_total_ms'] / datos['solicitudes'] if datos['solicitudes'] else 0.0
+                resumen[host] = {**datos, 'latencia_promedio_ms': round(promedio, 2)}
+            return resumen
+
+    def reiniciar(self):
+        with self._lock:
+            self._hosts = {}
+
+
+metricas = MetricasHTTP()
+
+
+class AdaptadorMedido(HTTPAdapter):
+    """HTTPAdapter que registra la latencia de cada petición en `metricas`"""
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).hostname
+        metricas.iniciar(host)
+        inicio = time.monotonic()
+        error = True
+        try:
+            response = super().send(request, **kwargs)
+            error = response.status_code >= 500
+            return response
+        finally:
+            metricas.finalizar(host, (time.monotonic() - inicio) * 1000, error=error)
+
+
+_sesion = None
+_sesion_lock = threading.Lock()
+
+
+def crear_sesion():
+    """Crea una sesión con pools keep-alive según la configuración"""
+    reintentos = Retry(
+        total=settings.HTTP_MAX_RETRIES,
+        read=0,
+        status_forcelist=(502, 503, 504),
+        backoff_factor=settings.HTTP_RETRY_BACKOFF,
+        raise_on_status=False,
+    )
+    adaptador = AdaptadorMedido(
+        pool_connections=settings.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+        max_retries=reintentos,
+    )
+    sesion = requests.Session()
+    sesion.mount('https://', adaptador)
+    sesion.mount('http://', adaptador)
+    return sesion
+
+
+def obtener_sesion():
+    """Devuelve la sesión compartida del proceso, creándola la primera vez"""
+    global _sesion
+    if _sesion is None:
+        with _sesion_lock:
+            if _sesion is None:
+                _sesion = crear_sesion()
+    return _sesion
+
+
+def request(method, url, **kwargs):
+    """Equivalente a requests.request usando los pools compartidos"""
+    kwargs.setdefault('timeout', settings.HTTP_TIMEOUT)
+    return obtener_sesion().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def obtener_metricas():
+    """
+    Latencia por host y uso de los pools de conexiones.
+
+    `conexiones_abiertas` frente a `solicitudes_pool` indica cuántas peticiones
+    reutilizaron una conexión existente.
+    """
+    resumen = metricas.resumen()
+    if _sesion is None:
+        return resumen
+
+    adaptador = _sesion.get_adapter('https://')
+    for clave in list(adaptador.poolmanager.pools.keys()):
+        pool = adaptador.poolmanager.pools.get(clave)
+        if pool is None:
+            continue
+        datos = resumen.setdefault(pool.host, {})
+        datos['conexiones_abiertas'] = pool.num_connections
+        datos['solicitudes_pool'] = pool.num_requests
+    return resumen
@@ -0,0 +1,267 @@
+"""
+Interpretation backends module for TarotNautica
+
+Las interpretaciones se generan a través de un InterpretationBackend
+intercambiable (INTERPRETACION_BACKEND en core/settings.py):
+
+- 'messages': Messages API de Anthropic, una petición por tirada.
+- 'lotes': Message Batches API; las tiradas no urgentes (tiradas programadas)
+  y las regeneraciones pedidas desde el admin se envían agrupadas a menor
+  coste y los resultados se recogen más tarde. Las tiradas interactivas siguen usando la
+  Messages API.
+- 'local': texto determinista generado a partir de las cartas, sin red; para
+  desarrollo y tests.
+- 'fallback': la interpretación genérica de respaldo.
+
+Todos los backends exponen `interpretar` (una tirada, síncrono) y
+`enviar_lote`/`consultar_lote` (varias tiradas). Los backends sin API de lotes
+resuelven el lote en el acto llamando a `interpretar` por cada tirada.
+"""
+import hashlib
+import json
+import logging
+import os
+from django.conf import settings
+from . import http_client, llm_guard, prompt_builder
+from .tarot_deck import obtener_carta
+
+logger = logging.getLogger(__name__)
+
+
+def construir_solicitud_interpretacion(tirada, cartas_en_tirada):
+    """
+    Construye el cuerpo de la petición a la Messages API para interpretar una tirada
+    (ver prompt_builder.py)
+    """
+    return prompt_builder.construir_solicitud(tirada, cartas_en_tirada)
+
+
+def generar_interpretacion_fallback(tirada):
+    """
+    Genera una interpretación de respaldo cuando hay problemas con la API.
+    Esta función proporciona una respuesta mística general que parece una interpretación real.
+
+    Args:
+        tirada: Objeto TiradaRealizada
+
+    Returns:
+        str: Interpretación de respaldo
+    """
+    nombre_tirada = tirada.tipo_tirada.nombre if hasattr(tirada, 'tipo_tirada') and tirada.tipo_tirada else "del tarot"
+    pregunta = tirada.pregunta if tirada.pregunta else "tu consulta"
+
+    interpretacion = f"""
+    Al contemplar tu tirada {nombre_tirada} sobre "{pregunta}",
+    percibo energías entrelazadas que revelan aspectos importantes de tu situación actual.
+
+    Las cartas han acudido a ti en este momento específico por una razón. No es casualidad,
+    sino causalidad mística que conecta tu esencia con los arquetipos universales representados en el tarot.
+
+    La disposición actual sugiere que te encuentras en un punto de transición, donde el pasado
+    ejerce su influencia sobre tu presente, mientras que el futuro se despliega según las energías
+    que estás cultivando ahora.
+
+    Veo un patrón de elementos contrastantes: luces y sombras, desafíos y oportunidades,
+    que te invitan a encontrar el equilibrio en medio de las polaridades de la existencia.
+
+    Las cartas revelan que parte de la respuesta que buscas ya está en tu interior,
+    pero quizás no has reconocido plenamente su presencia o significado.
+    La sabiduría del tarot te anima a conectar con tu intuición y escuchar esa voz interior.
+
+    El consejo principal que emerge de esta tirada es permanecer centrado mientras
+    navegas por los cambios que se presentan. La adaptabilidad y la consciencia
+    serán tus mejores aliadas en el camino que se despliega ante ti.
+
+    Recuerda que las cartas no determinan un destino inmutable, sino que iluminan
+    potenciales y tendencias energéticas que pueden ser transformadas mediante
+    tus decisiones y tu nivel de consciencia.
+
+    Este es un momento para confiar en el proceso de la vida, sabiendo que cada experiencia,
+    sea desafiante o placentera, contribuye a tu crecimiento y evolución espiritual.
+    """
+
+    return interpretacion
+
+
+def cabeceras_anthropic():
+    """Cabeceras de la API de Anthropic, o None si no hay API key"""
+    api_key = os.environ.get('ANTHROPIC_API_KEY')
+    if not api_key:
+        return None
+    return {
+        "x-api-key": api_key,
+        "content-type": "application/json",
+        "anthropic-version": "2023-06-01"
+    }
+
+
+def texto_mensaje(mensaje):
+    """Texto del primer bloque de contenido de una respuesta de la Messages API"""
+    return (mensaje.get("content") or [{}])[0].get("text", "")
+
+
+class InterpretationBackend:
+    """
+    Interfaz de los generadores de interpretaciones.
+
+    `interpretar` devuelve el texto o None si no se pudo generar; quien llama
+    decide entonces el respaldo.
+    """
+    nombre = ''
+    # Solo los textos generados por el modelo se guardan en la caché de interpretaciones
+    cacheable = True
+
+    def interpretar(self, tirada, cartas_en_tirada):
+        raise NotImplementedError
+
+    def enviar_lote(self, tiradas):
+        """
+        Envía varias tiradas (con sus cartas precargadas).
+
+        Returns:
+            (lote_id, resultados): resultados es {tirada_id: texto o None} si el
+            lote se resolvió en el acto, o None si hay que consultarlo después
+            con `consultar_lote(lote_id)`.
+        """
+        return '', {tirada.id: self.interpretar(tirada, list(tirada.cartas.all())) for tirada in tiradas}
+
+    def consultar_lote(self, lote_id):
+        """Resultados {tirada_id: texto o None} de un lote terminado, o None si sigue en curso"""
+        return {}
+
+
+class MessagesAPIBackend(InterpretationBackend):
+    """Una petición a la Messages API por tirada, protegida por llm_guard"""
+    nombre = 'messages'
+
+    def interpretar(self, tirada, cartas_en_tirada):
+        headers = cabeceras_anthropic()
+        if headers is None:
+            logger.error("API key no encontrada en variables de entorno")
+            return None
+
+        # Usar HTTP directo para mayor control (más estable que el SDK en algunos entornos)
+        solicitud = construir_solicitud_interpretacion(tirada, cartas_en_tirada)
+        response = llm_guard.ejecutar(lambda: http_client.post(
+            f"{settings.ANTHROPIC_API_URL}/v1/messages",
+            headers=headers,
+            json=solicitud,
+            timeout=30  # 30 segundos de timeout
+        ))
+        if response is None:
+            # Circuito abierto o sin hueco en el limitador: directamente al respaldo
+            return None
+        if response.status_code == 200:
+            resultado = response.json()
+            prompt_builder.metricas.registrar_uso(resultado.get("usage", {}), tirada.id)
+            interpretacion = texto_mensaje(resultado)
+            if interpretacion:
+                return interpretacion
+
+        logger.error(f"Error API Anthropic: {response.status_code} - {response.text}")
+        return None
+
+
+class MessageBatchesBackend(MessagesAPIBackend):
+    """
+    Message Batches API: un único envío para todo el lote, a mitad de precio,
+    con resultados disponibles en minutos u horas.
+    """
+    nombre = 'lotes'
+
+    @staticmethod
+    def custom_id(tirada_id):
+        return f"tirada-{tirada_id}"
+
+    def enviar_lote(self, tiradas):
+        headers = cabeceras_anthropic()
+        if headers is None:
+            raise ValueError("API key no encontrada en variables de entorno")
+
+        response = http_client.post(
+            f"{settings.ANTHROPIC_API_URL}/v1/messages/batches",
+            headers=headers,
+            json={"requests": [
+                {
+                    "custom_id": self.custom_id(tirada.id),
+                    "params": construir_solicitud_interpretacion(tirada, list(tirada.cartas.all()))
+                }
+                for tirada in tiradas
+            ]}
+        )
+        if response.status_code != 200:
+            raise ValueError(f"Error API Anthropic (lotes): {response.status_code} - {response.text}")
+        return response.json()["id"], None
+
+    def consultar_lote(self, lote_id):
+        headers = cabeceras_anthropic()
+        if headers is None:
+            raise ValueError("API key no encontrada en variables de entorno")
+
+        response = http_client.get(f"{settings.ANTHROPIC_API_URL}/v1/messages/batches/{lote_id}", headers=headers)
+        if response.status_code != 200:
+            raise ValueError(f"Error API Anthropic (lotes): {response.status_code} - {response.text}")
+        lote = response.json()
+        if lote.get("processing_status") != "ended":
+            return None
+
+        # Resultados en JSONL, una línea por solicitud y sin orden garantizado
+        response = http_client.get(lote["results_url"], headers=headers)
+        if response.status_code != 200:
+            raise ValueError(f"Error API Anthropic (lotes): {response.status_code} - {response.text}")
+
+        resultados = {}
+        for linea in response.text.splitlines():
+            if not linea.strip():
+                continue
+            entrada = json.loads(linea)
+            tirada_id = int(entrada["custom_id"].split("-", 1)[1])
+            resultado = entrada.get("result", {})
+            if resultado.get("type") == "succeeded":
+                prompt_builder.metricas.registrar_uso(resultado["message"].get("usage", {}), tirada_id)
+                resultados[tirada_id] = texto_mensaje(resultado["message"]) or None
+            else:
+                logger.error(f"Tirada {tirada_id} sin interpretación en el lote {lote_id}: {resultado.get('type')}")
+                resultados[tirada_id] = None
+        return resultados
+
+
+class LocalBackend(InterpretationBackend):
+    """Interpretación determinista a partir de las cartas, sin llamadas externas"""
+    nombre = 'local'
+    cacheable = False
+
+    def interpretar(self, tirada, cartas_en_tirada):
+        lineas = []
+        for carta in sorted(cartas_en_tirada, key=lambda c: c.posicion):
+            registro = obtener_carta(carta.carta_id)
+            significado = registro.significado_invertido if carta.invertida else registro.significado_normal
+            estado = "invertida" if carta.invertida else "normal"
+            lineas.append(f"{carta.posicion}. {registro.nombre} ({estado}): {significado}")
+        semilla = hashlib.sha256(tirada.pregunta.encode()).hexdigest()[:8]
+        return f"Tirada {tirada.tipo_tirada.nombre} sobre \"{tirada.pregunta}\" [{semilla}]\n" + "\n".join(lineas)
+
+
+class FallbackBackend(InterpretationBackend):
+    """La interpretación genérica de respaldo"""
+    nombre = 'fallback'
+    cacheable = False
+
+    def interpretar(self, tirada, cartas_en_tirada):
+        return generar_interpretacion_fallback(tirada)
+
+
+BACKENDS = {
+    backend.nombre: backend
+    for backend in (MessagesAPIBackend, MessageBatchesBackend, LocalBackend, FallbackBackend)
+}
+
+
+def obtener_backend(nombre=None):
+    """Backend configurado (INTERPRETACION_BACKEND) o el indicado por nombre"""
+    return BACKENDS[nombre or settings.INTERPRETACION_BACKEND]()
+
+
+def obtener_backend_lotes():
+    """Backend de las tiradas no urgentes (INTERPRETACION_BACKEND_LOTES)"""
+    return obtener_backend(settings.INTERPRETACION_BACKEND_LOTES)
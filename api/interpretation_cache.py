@@ -0,0 +1,79 @@
+"""
+Interpretation cache module for TarotNautica
+
+Reutiliza interpretaciones ya generadas para tiradas con la misma composición:
+mismo tipo de tirada, mismas cartas en las mismas posiciones y orientación, y
+una pregunta equivalente tras normalizarla ("¿Me ama?" == "me ama"). La
+clave incluye la versión del mazo: al editar una carta, las interpretaciones
+generadas con sus significados anteriores dejan de reutilizarse.
+
+Las entradas viven en el alias de caché 'interpretaciones' (ver CACHES en
+core/settings.py), que define el TTL y el máximo de entradas; LocMemCache
+descarta las menos usadas recientemente al llenarse.
+"""
+import hashlib
+import re
+import threading
+import unicodedata
+from django.core.cache import caches
+from .tarot_deck import obtener_mazo
+
+CACHE_ALIAS = 'interpretaciones'
+
+
+class MetricasCache:
+    """Contadores de aciertos y fallos de la caché, seguros entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def registrar(self, evento):
+        with self._lock:
+            self._contadores[evento] += 1
+
+    def resumen(self):
+        with self._lock:
+            consultas = self._contadores['aciertos'] + self._contadores['fallos']
+            tasa = self._contadores['aciertos'] / consultas if consultas else 0.0
+            return {**self._contadores, 'tasa_aciertos': round(tasa, 4)}
+
+    def reiniciar(self):
+        self._contadores = {'aciertos': 0, 'fallos': 0, 'escrituras': 0}
+
+
+metricas = MetricasCache()
+
+
+def normalizar_pregunta(pregunta):
+    """Minúsculas, sin tildes, sin signos de puntuación y con espacios colapsados"""
+    texto = unicodedata.normalize('NFKD', pregunta.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'[^\w\s]', ' ', texto)
+    return ' '.join(texto.split())
+
+
+def clave_interpretacion(tirada, cartas_en_tirada):
+    """
+    Clave de contenido: versión del mazo + tipo de tirada + (carta, posición, invertida)
+    ordenadas + pregunta normalizada
+    """
+    cartas = ','.join(
+        f"{carta.carta_id}:{carta.posicion}:{int(carta.invertida)}"
+        for carta in sorted(cartas_en_tirada, key=lambda c: c.posicion)
+    )
+    contenido = f"{obtener_mazo().version}|{tirada.tipo_tirada_id}|{cartas}|{normalizar_pregunta(tirada.pregunta)}"
+    return 'interpretacion:' + hashlib.sha256(contenido.encode()).hexdigest()
+
+
+def obtener_interpretacion_cacheada(tirada, cartas_en_tirada):
+    """Retorna la interpretación cacheada o None"""
+    interpretacion = caches[CACHE_ALIAS].get(clave_interpretacion(tirada, cartas_en_tirada))
+    metricas.registrar('aciertos' if interpretacion else 'fallos')
+    return interpretacion
+
+
+def guardar_interpretacion(tirada, cartas_en_tirada, interpretacion):
+    """Guarda una interpretación generada por la API (nunca las de respaldo)"""
+    caches[CACHE_ALIAS].set(clave_interpretacion(tirada, cartas_en_tirada), interpretacion)
+    metricas.registrar('escrituras')
@@ -0,0 +1,228 @@
+"""
+Interpretation queue module for TarotNautica
+
+Las tiradas creadas en modo asíncrono se guardan con estado 'pendiente'.
+Este módulo actúa como cola local respaldada por la base de datos: un worker
+(`python manage.py procesar_interpretaciones`) reclama cada tirada pendiente,
+genera su interpretación y la marca como 'completada'.
+
+Cada tirada en 'procesando' guarda cuándo fue reclamada, ya sea por el worker
+o por la petición síncrona o de streaming que la creó. Si el proceso muere
+antes de terminarla, el reclamo vence a los INTERPRETACION_RECLAMO_SEGUNDOS y
+el worker la devuelve a la cola.
+
+Las tiradas no urgentes (urgente=False) no pasan por ese worker: se agrupan en
+un LoteInterpretacion que se envía de una vez al backend de lotes
+(`python manage.py procesar_lotes_interpretacion`), y sus resultados se
+escriben con un UPDATE masivo cuando el lote termina. Los mismos lotes
+regeneran las tiradas completadas marcadas con regenerar=True; esas siguen
+'completada', con su interpretación actual, hasta que el lote escribe la nueva.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from . import interpretation_cache
+from .interpretation_backends import generar_interpretacion_fallback, obtener_backend, obtener_backend_lotes
+from .models import LoteInterpretacion, TiradaRealizada
+from .tirada_service import guardar_interpretacion_tirada
+
+logger = logging.getLogger(__name__)
+
+
+def reclamar_tirada(tirada_id):
+    """
+    Marca una tirada pendiente como 'procesando'.
+    El UPDATE condicional garantiza que solo un worker la reclame.
+
+    Returns:
+        bool: True si este worker obtuvo la tirada
+    """
+    actualizadas = TiradaRealizada.objects.filter(
+        id=tirada_id, estado='pendiente'
+    ).update(estado='procesando', reclamada=timezone.now())
+    return actualizadas == 1
+
+
+def reencolar_vencidas():
+    """
+    Devuelve a la cola las tiradas 'procesando' cuyo reclamo venció (worker o
+    petición caídos a mitad). Las tiradas de un lote siguen el ciclo del lote.
+
+    Returns:
+        int: Número de tiradas reencoladas
+    """
+    vencimiento = timezone.now() - timedelta(seconds=settings.INTERPRETACION_RECLAMO_SEGUNDOS)
+    return TiradaRealizada.objects.filter(
+        Q(reclamada__lt=vencimiento) | Q(reclamada__isnull=True),
+        estado='procesando', lote__isnull=True
+    ).update(estado='pendiente', reclamada=None)
+
+
+def procesar_tirada(tirada):
+    """
+    Genera y guarda la interpretación de una tirada ya reclamada.
+
+    Args:
+        tirada: TiradaRealizada en estado 'procesando'
+    """
+    from .views import obtener_interpretacion_tirada
+
+    cartas_en_tirada = list(tirada.cartas.all())
+    # La caché ya se consultó al encolar (o el usuario pidió una interpretación nueva)
+    interpretacion = obtener_interpretacion_tirada(tirada, cartas_en_tirada, usar_cache=False)
+
+    guardar_interpretacion_tirada(tirada, interpretacion)
+    return tirada
+
+
+def procesar_pendientes(limite=10):
+    """
+    Procesa hasta `limite` tiradas pendientes, de la más antigua a la más reciente.
+
+    Returns:
+        int: Número de tiradas interpretadas
+    """
+    reencoladas = reencolar_vencidas()
+    if reencoladas:
+        logger.warning(f"Tiradas con el reclamo vencido devueltas a la cola: {reencoladas}")
+
+    pendientes = TiradaRealizada.objects.filter(estado='pendiente', urgente=True).order_by('fecha', 'id')
+    tirada_ids = list(pendientes.values_list('id', flat=True)[:limite])
+
+    procesadas = 0
+    for tirada_id in tirada_ids:
+        if not reclamar_tirada(tirada_id):
+            continue
+
+        tirada = TiradaRealizada.objects.select_related('tipo_tirada').get(id=tirada_id)
+        try:
+            procesar_tirada(tirada)
+            procesadas += 1
+        except Exception as e:
+            # Devolver la tirada a la cola para que otro ciclo la reintente
+            logger.error(f"Error procesando tirada {tirada_id}: {str(e)}")
+            TiradaRealizada.objects.filter(id=tirada_id).update(estado='pendiente', reclamada=None)
+
+    return procesadas
+
+
+def marcar_para_regenerar(tiradas):
+    """
+    Marca las tiradas completadas para regenerar su interpretación en el próximo
+    lote. Siguen 'completada' con la interpretación actual hasta entonces; las
+    pendientes o en proceso, y las que ya van en un lote sin terminar, se omiten.
+
+    Returns:
+        int: Número de tiradas marcadas
+    """
+    return tiradas.filter(estado='completada').exclude(
+        lote__estado__in=['preparando', 'en_curso']
+    ).update(regenerar=True, lote=None)
+
+
+def escribir_resultados(lote, tiradas, resultados, backend):
+    """
+    Guarda las interpretaciones de un lote con un UPDATE masivo.
+    Las tiradas pendientes sin resultado reciben la interpretación de respaldo;
+    una regeneración sin resultado conserva su interpretación y la marca
+    regenerar, para que el admin pueda volver a pedirla.
+    """
+    fallidas = 0
+    for tirada in tiradas:
+        interpretacion = resultados.get(tirada.id)
+        if interpretacion and backend.cacheable:
+            interpretation_cache.guardar_interpretacion(tirada, list(tirada.cartas.all()), interpretacion)
+        if interpretacion:
+            tirada.interpretacion = interpretacion
+            tirada.regenerar = False
+        elif tirada.regenerar:
+            fallidas += 1
+        else:
+            tirada.interpretacion = generar_interpretacion_fallback(tirada)
+        tirada.estado = 'completada'
+
+    if fallidas:
+        logger.warning(f"Regeneraciones sin resultado en el lote {lote.lote_id or lote.id}: {fallidas}")
+
+    TiradaRealizada.objects.bulk_update(tiradas, ['interpretacion', 'estado', 'regenerar'], batch_size=500)
+    lote.estado = 'finalizado'
+    lote.finalizado = timezone.now()
+    lote.save(update_fields=['estado', 'finalizado'])
+
+
+def tiradas_del_lote(lote):
+    return list(lote.tiradas.select_related('tipo_tirada').prefetch_related('cartas').order_by('id'))
+
+
+def enviar_lote(limite=None):
+    """
+    Reclama hasta `limite` tiradas no urgentes pendientes, y después tiradas
+    marcadas para regenerar, y las envía como un lote. Los UPDATE que las asignan
+    al lote son condicionales, así que dos workers nunca envían la misma tirada.
+
+    Returns:
+        int: Número de tiradas enviadas
+    """
+    limite = limite or settings.INTERPRETACION_LOTE_MAXIMO
+    pendientes = TiradaRealizada.objects.filter(estado='pendiente', urgente=False).order_by('fecha', 'id')
+    pendiente_ids = list(pendientes.values_list('id', flat=True)[:limite])
+    regeneraciones = TiradaRealizada.objects.filter(regenerar=True, lote__isnull=True).order_by('fecha', 'id')
+    regenerar_ids = list(regeneraciones.values_list('id', flat=True)[:limite - len(pendiente_ids)])
+    if not pendiente_ids and not regenerar_ids:
+        return 0
+
+    backend = obtener_backend_lotes()
+    lote = LoteInterpretacion.objects.create(backend=backend.nombre)
+    reclamadas = TiradaRealizada.objects.filter(
+        id__in=pendiente_ids, estado='pendiente'
+    ).update(estado='procesando', lote=lote)
+    reclamadas += TiradaRealizada.objects.filter(
+        id__in=regenerar_ids, regenerar=True, lote__isnull=True
+    ).update(lote=lote)
+    if not reclamadas:
+        lote.delete()
+        return 0
+
+    tiradas = tiradas_del_lote(lote)
+    try:
+        lote.lote_id, resultados = backend.enviar_lote(tiradas)
+    except Exception as e:
+        # Devolver las tiradas a la cola para que otro ciclo las reintente
+        logger.error(f"Error enviando lote de interpretaciones: {str(e)}")
+        lote.tiradas.filter(estado='procesando').update(estado='pendiente')
+        lote.tiradas.update(lote=None)
+        lote.delete()
+        return 0
+
+    lote.estado = 'en_curso'
+    lote.save(update_fields=['lote_id', 'estado'])
+    if resultados is not None:
+        escribir_resultados(lote, tiradas, resultados, backend)
+    return len(tiradas)
+
+
+def recoger_lotes():
+    """
+    Consulta los lotes en curso y guarda los resultados de los que terminaron.
+
+    Returns:
+        int: Número de tiradas interpretadas
+    """
+    completadas = 0
+    for lote in LoteInterpretacion.objects.filter(estado='en_curso').order_by('id'):
+        backend = obtener_backend(lote.backend)
+        try:
+            resultados = backend.consultar_lote(lote.lote_id)
+        except Exception as e:
+            logger.error(f"Error consultando lote {lote.lote_id}: {str(e)}")
+            continue
+        if resultados is None:
+            continue
+
+        tiradas = tiradas_del_lote(lote)
+        escribir_resultados(lote, tiradas, resultados, backend)
+        completadas += len(tiradas)
+
+    return completadas
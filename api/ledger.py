@@ -0,0 +1,299 @@
+"""
+Gem and quota ledger module for TarotNautica
+
+Todas las modificaciones de gemas y contadores de tiradas de UserProfile pasan
+por aquí. Cada movimiento de gemas queda registrado en GemTransaction, un libro
+de solo inserciones:
+
+- Los créditos (compras, pagos) son un INSERT pendiente (applied=False) y no
+  tocan la fila del perfil, así que los webhooks no compiten por ella.
+- UserProfile.gemas es el saldo materializado: la suma de los movimientos ya
+  aplicados. compactar_saldo() incorpora los créditos pendientes; se ejecuta
+  periódicamente (manage.py compactar_gemas) y bajo demanda cuando un débito
+  no alcanza con el saldo materializado.
+- Los débitos son un UPDATE condicional con expresiones F(), de modo que las
+  peticiones concurrentes no gastan dos veces las mismas gemas:
+
+    UPDATE api_userprofile SET gemas = gemas - n WHERE user_id = ? AND gemas >= n
+
+El saldo real es UserProfile.gemas más los créditos pendientes (saldo_gemas).
+
+Los contadores de tiradas del cupo mensual llevan al lado su periodo de
+facturación (periodo_tiradas). Un periodo anterior se lee como cero sin
+escribir nada; la primera tirada del periodo nuevo reinicia los contadores en
+el mismo UPDATE que la consume, y `manage.py reiniciar_cupos` los pone al día
+en lotes al cambiar de mes.
+
+Cada función que modifica el perfil o sus créditos invalida la instantánea
+cacheada del usuario (ver profile_cache.py).
+"""
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import UserProfile, GemTransaction
+from .profile_cache import invalidar
+
+# Gemas de regalo al activar una suscripción
+BONO_SUSCRIPCION = 30
+
+CAMPOS_TIRADAS = {
+    'basica': 'tiradas_basicas_usadas',
+    'claridad': 'tiradas_claridad_usadas',
+    'profunda': 'tiradas_profundas_usadas',
+}
+
+
+def compactar_saldo(user_id):
+    """
+    Incorpora los créditos pendientes del usuario a UserProfile.gemas.
+
+    Returns:
+        int: Gemas incorporadas
+    """
+    with transaction.atomic():
+        pendientes = list(
+            GemTransaction.objects.select_for_update()
+            .filter(user_id=user_id, applied=False)
+            .values_list('id', 'amount')
+        )
+        if not pendientes:
+            return 0
+
+        total = sum(amount for _, amount in pendientes)
+        marcadas = GemTransaction.objects.filter(
+            id__in=[tx_id for tx_id, _ in pendientes], applied=False
+        ).update(applied=True)
+        if marcadas != len(pendientes):
+            # Otro proceso compactó parte de estos movimientos: no aplicar nada dos veces
+            transaction.set_rollback(True)
+            return 0
+        UserProfile.objects.filter(user_id=user_id).update(gemas=F('gemas') + total)
+        invalidar(user_id)
+        return total
+
+
+def compactar_pendientes(limite=500):
+    """
+    Compacta los créditos pendientes de hasta `limite` usuarios.
+
+    Returns:
+        int: Número de usuarios compactados
+    """
+    user_ids = list(
+        GemTransaction.objects.filter(applied=False)
+        .values_list('user_id', flat=True).distinct()[:limite]
+    )
+    for user_id in user_ids:
+        compactar_saldo(user_id)
+    return len(user_ids)
+
+
+def descuadres():
+    """
+    Perfiles cuyo saldo materializado no coincide con la suma de sus movimientos aplicados.
+
+    Returns:
+        list: Tuplas (user_id, gemas, suma_aplicada)
+    """
+    aplicados = GemTransaction.objects.filter(
+        user_id=OuterRef('user_id'), applied=True
+    ).values('user_id').annotate(total=Sum('amount')).values('total')
+
+    perfiles = UserProfile.objects.annotate(
+        suma_aplicada=Coalesce(Subquery(aplicados, output_field=IntegerField()), Value(0))
+    ).exclude(gemas=F('suma_aplicada'))
+    return list(perfiles.values_list('user_id', 'gemas', 'suma_aplicada'))
+
+
+def corregir_descuadre(user_id, gemas, suma_aplicada):
+    """Registra un ajuste aplicado para que el libro vuelva a cuadrar con UserProfile.gemas"""
+    GemTransaction.objects.create(
+        user_id=user_id, amount=gemas - suma_aplicada, reason='ajuste',
+        reference='reconciliacion', applied=True
+    )
+
+
+def _debitar_materializado(user_id, cantidad):
+    actualizadas = UserProfile.objects.filter(
+        user_id=user_id, gemas__gte=cantidad
+    ).update(gemas=F('gemas') - cantidad)
+    return actualizadas == 1
+
+
+def debitar_gemas(user_id, cantidad, reason, reference=''):
+    """
+    Descuenta gemas solo si el saldo alcanza.
+
+    Returns:
+        bool: True si se descontaron
+    """
+    if cantidad <= 0:
+        return True
+
+    # Sin savepoint: el cobro suele ir dentro de la transacción de la compra o la tirada
+    with transaction.atomic(savepoint=False):
+        if not _debitar_materializado(user_id, cantidad):
+            # El saldo materializado no alcanza: incorporar créditos pendientes y reintentar
+            compactar_saldo(user_id)
+            if not _debitar_materializado(user_id, cantidad):
+                return False
+
+        GemTransaction.objects.create(
+            user_id=user_id, amount=-cantidad, reason=reason,
+            reference=str(reference), applied=True
+        )
+        invalidar(user_id)
+    return True
+
+
+def acreditar_gemas(user_id, cantidad, reason, reference=''):
+    """Registra un crédito de gemas sin tocar la fila del perfil"""
+    if cantidad <= 0:
+        return
+    GemTransaction.objects.create(
+        user_id=user_id, amount=cantidad, reason=reason, reference=str(reference)
+    )
+    invalidar(user_id)
+
+
+def _creditos_pendientes(user_id):
+    return GemTransaction.objects.filter(
+        user_id=user_id, applied=False
+    ).aggregate(total=Coalesce(Sum('amount'), 0))['total']
+
+
+def saldo_gemas(user_id):
+    """Saldo actual de gemas: saldo materializado más créditos pendientes, en una consulta"""
+    pendientes = GemTransaction.objects.filter(
+        user_id=OuterRef('user_id'), applied=False
+    ).values('user_id').annotate(total=Sum('amount')).values('total')
+
+    return UserProfile.objects.filter(user_id=user_id).annotate(
+        saldo=F('gemas') + Coalesce(Subquery(pendientes, output_field=IntegerField()), Value(0))
+    ).values_list('saldo', flat=True).get()
+
+
+def saldo_perfil(profile):
+    """Saldo actual de un perfil ya cargado; usa sus créditos pendientes si vienen anotados"""
+    pendientes = getattr(profile, 'creditos_pendientes', None)
+    if pendientes is None:
+        pendientes = _creditos_pendientes(profile.user_id)
+    return profile.gemas + pendientes
+
+
+def historial_gemas(user_id):
+    """Movimientos del usuario, del más reciente al más antiguo"""
+    return GemTransaction.objects.filter(user_id=user_id).order_by('-created_at', '-id')
+
+
+def periodo_actual():
+    """Periodo de facturación vigente (AAAAMM) según la zona horaria del proyecto"""
+    hoy = timezone.localdate()
+    return hoy.year * 100 + hoy.month
+
+
+def _contadores_reiniciados(periodo):
+    return {
+        'periodo_tiradas': periodo,
+        'fecha_reset': timezone.localdate(),
+        **{campo: 0 for campo in CAMPOS_TIRADAS.values()},
+    }
+
+
+def tiradas_usadas(profile, tipo, periodo=None):
+    """Tiradas del cupo usadas en el periodo vigente; un periodo anterior cuenta como cero"""
+    if profile.periodo_tiradas != (periodo or periodo_actual()):
+        return 0
+    return getattr(profile, CAMPOS_TIRADAS[tipo])
+
+
+def consumir_tirada_incluida(user_id, tipo, limite):
+    """
+    Consume una tirada del cupo mensual de la suscripción si queda cupo.
+
+    Returns:
+        bool: True si la tirada quedó cubierta por la suscripción
+    """
+    campo = CAMPOS_TIRADAS[tipo]
+    periodo = periodo_actual()
+    suscritos = UserProfile.objects.filter(user_id=user_id, tiene_suscripcion=True)
+
+    def consumir_en_periodo():
+        return suscritos.filter(
+            periodo_tiradas=periodo, **{f'{campo}__lt': limite}
+        ).update(**{campo: F(campo) + 1}) == 1
+
+    if consumir_en_periodo():
+        invalidar(user_id)
+        return True
+    if limite < 1:
+        return False
+
+    # Contadores de un periodo anterior: esta tirada abre el periodo nuevo
+    if suscritos.filter(periodo_tiradas__lt=periodo).update(
+        **{**_contadores_reiniciados(periodo), campo: 1}
+    ):
+        invalidar(user_id)
+        return True
+
+    # Otra petición abrió el periodo a la vez
+    if consumir_en_periodo():
+        invalidar(user_id)
+        return True
+    return False
+
+
+def reiniciar_periodos(lote=1000):
+    """
+    Pone a cero los contadores de los perfiles con un periodo anterior, en lotes.
+    No invalida las instantáneas cacheadas: un periodo anterior ya se lee como cero.
+
+    Returns:
+        int: Número de perfiles reiniciados
+    """
+    periodo = periodo_actual()
+    pendientes = UserProfile.objects.filter(periodo_tiradas__lt=periodo)
+    total = 0
+    while True:
+        ids = list(pendientes.values_list('id', flat=True)[:lote])
+        if not ids:
+            return total
+        total += UserProfile.objects.filter(
+            id__in=ids, periodo_tiradas__lt=periodo
+        ).update(**_contadores_reiniciados(periodo))
+
+
+def activar_suscripcion(user_id):
+    """
+    Activa la suscripción. Solo la primera activación reinicia los contadores
+    de tiradas y suma el bono de gemas, aunque lleguen peticiones simultáneas.
+
+    Returns:
+        bool: True si el usuario no tenía suscripción
+    """
+    with transaction.atomic():
+        nueva = UserProfile.objects.filter(user_id=user_id, tiene_suscripcion=False).update(
+            tiene_suscripcion=True,
+            gemas=F('gemas') + BONO_SUSCRIPCION,
+            **_contadores_reiniciados(periodo_actual())
+        )
+        if nueva:
+            GemTransaction.objects.create(
+                user_id=user_id, amount=BONO_SUSCRIPCION, reason='suscripcion', applied=True
+            )
+            invalidar(user_id)
+    return nueva == 1
+
+
+def renovar_suscripcion(user_id, reference=''):
+    """Marca la suscripción como activa y acredita el bono de gemas del periodo pagado"""
+    UserProfile.objects.filter(user_id=user_id).update(tiene_suscripcion=True)
+    # acreditar_gemas invalida la instantánea
+    acreditar_gemas(user_id, BONO_SUSCRIPCION, 'suscripcion', reference)
+
+
+def cancelar_suscripcion(user_id):
+    """Quita la suscripción sin tocar el resto del perfil"""
+    UserProfile.objects.filter(user_id=user_id).update(tiene_suscripcion=False)
+    invalidar(user_id)
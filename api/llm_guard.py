@@ -0,0 +1,211 @@
+"""
+LLM guard module for TarotNautica
+
+Protege las llamadas a la API de Anthropic para que una API degradada no
+ocupe todos los workers esperando el timeout:
+
+- CircuitBreaker: su estado vive en la caché por defecto. Con una caché
+  compartida (CACHE_URL, ver core/settings.py) lo comparten todos los procesos;
+  con la LocMemCache cada proceso tiene su propio circuito, que solo ve sus
+  llamadas y se abre por separado (resumen() lo indica en 'compartido').
+  Cuenta llamadas, errores y llamadas lentas en ventanas fijas de
+  LLM_CIRCUITO_VENTANA segundos; con al menos LLM_CIRCUITO_MIN_SOLICITUDES
+  llamadas y una tasa de errores o de lentitud por encima del umbral se abre
+  durante LLM_CIRCUITO_APERTURA segundos, en los que las interpretaciones van
+  directamente al respaldo. Después deja pasar una única llamada de prueba
+  (semiabierto): si va bien se cierra, si no vuelve a abrirse.
+- LimitadorConcurrencia: limita las llamadas en curso del proceso con un
+  límite AIMD que sube de a poco mientras la latencia observada está por
+  debajo de LLM_LATENCIA_OBJETIVO y se reduce multiplicativamente cuando la
+  supera o hay errores. Si no hay hueco en LLM_CONCURRENCIA_ESPERA segundos,
+  la llamada se rechaza y se usa el respaldo.
+"""
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Factor de reducción del límite de concurrencia ante latencia alta o errores
+FACTOR_REDUCCION = 0.9
+
+
+class CircuitBreaker:
+    """Circuito con su estado en la caché por defecto (de cada proceso si no es compartida)"""
+
+    def __init__(self, nombre, reloj=time.time):
+        self.nombre = nombre
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self.reiniciar_metricas()
+
+    def _clave(self, sufijo):
+        return f'circuito:{self.nombre}:{sufijo}'
+
+    def _ventana(self, ahora):
+        return int(ahora // settings.LLM_CIRCUITO_VENTANA)
+
+    def _contar(self, clave):
+        cache.add(clave, 0, timeout=settings.LLM_CIRCUITO_VENTANA * 2)
+        try:
+            return cache.incr(clave)
+        except ValueError:
+            # La entrada caducó entre add e incr
+            cache.set(clave, 1, timeout=settings.LLM_CIRCUITO_VENTANA * 2)
+            return 1
+
+    def _registrar(self, evento):
+        with self._lock:
+            self._contadores[evento] += 1
+
+    def resumen(self):
+        with self._lock:
+            return {**self._contadores, 'estado': self.estado(), 'compartido': settings.CACHE_COMPARTIDA}
+
+    def reiniciar_metricas(self):
+        self._contadores = {'rechazos': 0, 'aperturas': 0, 'sondas': 0}
+
+    def estado(self):
+        abierto_hasta = cache.get(self._clave('abierto_hasta'))
+        if abierto_hasta is None:
+            return 'cerrado'
+        return 'abierto' if self.reloj() < abierto_hasta else 'semiabierto'
+
+    def permitir(self):
+        """
+        Indica si se puede llamar a la API. En semiabierto solo una llamada
+        (la sonda) obtiene permiso hasta que registre su resultado.
+        """
+        abierto_hasta = cache.get(self._clave('abierto_hasta'))
+        if abierto_hasta is None:
+            return True
+        if self.reloj() < abierto_hasta or not cache.add(self._clave('sonda'), 1, timeout=settings.LLM_CIRCUITO_APERTURA):
+            self._registrar('rechazos')
+            return False
+        self._registrar('sondas')
+        return True
+
+    def abrir(self):
+        cache.set(self._clave('abierto_hasta'), self.reloj() + settings.LLM_CIRCUITO_APERTURA, timeout=None)
+        cache.delete(self._clave('sonda'))
+        self._registrar('aperturas')
+        logger.error(f"Circuito {self.nombre} abierto durante {settings.LLM_CIRCUITO_APERTURA}s")
+
+    def liberar_sonda(self):
+        """Devuelve el permiso de sonda si la llamada no llegó a hacerse"""
+        cache.delete(self._clave('sonda'))
+
+    def cerrar(self):
+        ventana = self._ventana(self.reloj())
+        cache.delete_many([
+            self._clave('abierto_hasta'), self._clave('sonda'),
+            self._clave(f'{ventana}:total'), self._clave(f'{ventana}:errores'), self._clave(f'{ventana}:lentas'),
+        ])
+
+    def registrar(self, duracion, error=False):
+        """Resultado de una llamada permitida: duración en segundos y si falló"""
+        lenta = duracion >= settings.LLM_CIRCUITO_LATENCIA_LENTA
+        if cache.get(self._clave('abierto_hasta')) is not None:
+            # Resultado de la sonda del estado semiabierto
+            if error or lenta:
+                self.abrir()
+            else:
+                self.cerrar()
+            return
+
+        ventana = self._ventana(self.reloj())
+        total = self._contar(self._clave(f'{ventana}:total'))
+        errores = self._contar(self._clave(f'{ventana}:errores')) if error else cache.get(self._clave(f'{ventana}:errores'), 0)
+        lentas = self._contar(self._clave(f'{ventana}:lentas')) if lenta else cache.get(self._clave(f'{ventana}:lentas'), 0)
+
+        if total < settings.LLM_CIRCUITO_MIN_SOLICITUDES:
+            return
+        if errores / total >= settings.LLM_CIRCUITO_UMBRAL_ERRORES or lentas / total >= settings.LLM_CIRCUITO_UMBRAL_LENTAS:
+            self.abrir()
+
+
+class LimitadorConcurrencia:
+    """Límite adaptativo (AIMD) de llamadas en curso en este proceso"""
+
+    def __init__(self):
+        self._condicion = threading.Condition()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._condicion:
+            self.limite = float(settings.LLM_CONCURRENCIA_INICIAL)
+            self.en_curso = 0
+            self._contadores = {'rechazos': 0, 'aumentos': 0, 'reducciones': 0}
+
+    def resumen(self):
+        with self._condicion:
+            return {**self._contadores, 'limite': int(self.limite), 'en_curso': self.en_curso}
+
+    def adquirir(self, espera=None):
+        """
+        Reserva un hueco esperando como máximo `espera` segundos.
+
+        Returns:
+            bool: False si no hubo hueco a tiempo
+        """
+        espera = settings.LLM_CONCURRENCIA_ESPERA if espera is None else espera
+        with self._condicion:
+            if not self._condicion.wait_for(lambda: self.en_curso < int(self.limite), timeout=espera):
+                self._contadores['rechazos'] += 1
+                return False
+            self.en_curso += 1
+            return True
+
+    def liberar(self, duracion, error=False):
+        """Libera el hueco y ajusta el límite según la latencia observada"""
+        with self._condicion:
+            self.en_curso -= 1
+            if error or duracion > settings.LLM_LATENCIA_OBJETIVO:
+                self.limite = max(settings.LLM_CONCURRENCIA_MINIMA, self.limite * FACTOR_REDUCCION)
+                self._contadores['reducciones'] += 1
+            elif self.en_curso + 1 >= int(self.limite):
+                # Solo crece si el límite llegó a usarse
+                self.limite = min(settings.LLM_CONCURRENCIA_MAXIMA, self.limite + 1 / self.limite)
+                self._contadores['aumentos'] += 1
+            self._condicion.notify_all()
+
+
+breaker = CircuitBreaker('anthropic')
+limitador = LimitadorConcurrencia()
+
+
+def es_error(response):
+    """Respuestas que indican una API degradada (no los errores de la petición)"""
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def ejecutar(llamada):
+    """
+    Ejecuta `llamada()` (que devuelve la respuesta HTTP) bajo el circuito y el limitador.
+
+    Returns:
+        La respuesta, o None si el circuito está abierto o no hubo hueco
+    """
+    if not breaker.permitir():
+        return None
+    if not limitador.adquirir():
+        # Si era la sonda del semiabierto, que la haga otra llamada
+        breaker.liberar_sonda()
+        return None
+
+    inicio = time.monotonic()
+    error = True
+    try:
+        response = llamada()
+        error = es_error(response)
+        return response
+    finally:
+        duracion = time.monotonic() - inicio
+        limitador.liberar(duracion, error=error)
+        breaker.registrar(duracion, error=error)
+
+
+def metricas():
+    return {'circuito': breaker.resumen(), 'concurrencia': limitador.resumen()}
@@ -0,0 +1,58 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.catalog_sync import SECCIONES, exportar, leer_catalogo, sincronizar
+
+
+class Command(BaseCommand):
+    help = 'Sincroniza el catálogo (cartas, tipos de tirada, hechizos y pociones) con un archivo JSON/YAML versionado, o lo exporta'
+
+    def add_arguments(self, parser):
+        acciones = parser.add_subparsers(dest='accion', required=True)
+
+        sync = acciones.add_parser('sync', help='Aplica el catálogo del archivo a la base')
+        sync.add_argument('ruta', nargs='?', default=str(settings.BASE_DIR / 'catalogo.json'),
+                          help='Archivo del catálogo (por defecto catalogo.json)')
+        sync.add_argument('--dry-run', action='store_true',
+                          help='Muestra las diferencias sin guardar nada')
+
+        export = acciones.add_parser('export', help='Escribe el catálogo de la base en formato JSON')
+        export.add_argument('ruta', nargs='?', help='Archivo de salida (por defecto, la salida estándar)')
+
+    def handle(self, *args, **options):
+        if options['accion'] == 'export':
+            return self.exportar(options['ruta'])
+
+        try:
+            resultado = sincronizar(leer_catalogo(options['ruta']), aplicar=not options['dry_run'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for seccion, diff in resultado.items():
+            clave = SECCIONES[seccion][1]
+            for fila in diff['crear']:
+                self.stdout.write(f"+ {seccion} {getattr(fila, clave)!r}")
+            for fila, cambiados in diff['actualizar']:
+                self.stdout.write(f"~ {seccion} {getattr(fila, clave)!r}: {', '.join(cambiados)}")
+            for fila in diff['sobrantes']:
+                self.stdout.write(f"- {seccion} {getattr(fila, clave)!r} (fuera del catálogo)")
+            self.stdout.write(
+                f"{seccion}: {len(diff['crear'])} nuevos, {len(diff['actualizar'])} modificados, "
+                f"{len(diff['sobrantes'])} fuera del catálogo"
+            )
+        if options['dry_run']:
+            self.stdout.write("Dry run: no se guardó ningún cambio")
+        elif not settings.CACHE_COMPARTIDA and any(diff['crear'] or diff['actualizar'] for diff in resultado.values()):
+            # La invalidación solo llega a la caché local de este proceso
+            self.stdout.write(self.style.WARNING(
+                "La caché no es compartida (CACHE_URL): reinicia la aplicación para que sirva el catálogo nuevo"
+            ))
+
+    def exportar(self, ruta):
+        contenido = json.dumps(exportar(), ensure_ascii=False, indent=2) + '\n'
+        if ruta is None:
+            self.stdout.write(contenido, ending='')
+            return
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            archivo.write(contenido)
+        self.stdout.write(f"Catálogo exportado a {ruta}")
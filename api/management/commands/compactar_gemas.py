@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from api.ledger import compactar_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Incorpora los créditos de gemas pendientes al saldo materializado de cada perfil'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=500,
+                            help='Máximo de usuarios a compactar por ciclo')
+        parser.add_argument('--loop', action='store_true',
+                            help='Seguir compactando indefinidamente')
+        parser.add_argument('--intervalo', type=float, default=60.0,
+                            help='Segundos de espera entre ciclos')
+
+    def handle(self, *args, **options):
+        while True:
+            compactados = compactar_pendientes(limite=options['limite'])
+            if compactados:
+                self.stdout.write(f"Usuarios compactados: {compactados}")
+
+            if not options['loop']:
+                break
+            if compactados < options['limite']:
+                time.sleep(options['intervalo'])
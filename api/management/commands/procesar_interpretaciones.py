@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from api.interpretation_queue import procesar_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Genera las interpretaciones de las tiradas asíncronas pendientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=10,
+                            help='Máximo de tiradas a procesar por ciclo')
+        parser.add_argument('--loop', action='store_true',
+                            help='Seguir procesando la cola indefinidamente')
+        parser.add_argument('--intervalo', type=float, default=1.0,
+                            help='Segundos de espera cuando la cola está vacía')
+
+    def handle(self, *args, **options):
+        while True:
+            procesadas = procesar_pendientes(limite=options['limite'])
+            if procesadas:
+                self.stdout.write(f"Tiradas interpretadas: {procesadas}")
+
+            if not options['loop']:
+                break
+            if not procesadas:
+                time.sleep(options['intervalo'])
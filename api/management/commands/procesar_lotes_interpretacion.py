@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from api.interpretation_queue import enviar_lote, recoger_lotes
+
+
+class Command(BaseCommand):
+    help = 'Envía por lotes las tiradas no urgentes pendientes y las regeneraciones, y recoge los lotes terminados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=None,
+                            help='Máximo de tiradas por lote (por defecto INTERPRETACION_LOTE_MAXIMO)')
+        parser.add_argument('--loop', action='store_true',
+                            help='Seguir procesando indefinidamente')
+        parser.add_argument('--intervalo', type=float, default=60.0,
+                            help='Segundos de espera entre ciclos sin trabajo')
+
+    def handle(self, *args, **options):
+        while True:
+            completadas = recoger_lotes()
+            if completadas:
+                self.stdout.write(f"Tiradas interpretadas por lotes: {completadas}")
+
+            enviadas = enviar_lote(limite=options['limite'])
+            if enviadas:
+                self.stdout.write(f"Tiradas enviadas en un lote: {enviadas}")
+
+            if not options['loop']:
+                break
+            if not completadas and not enviadas:
+                time.sleep(options['intervalo'])
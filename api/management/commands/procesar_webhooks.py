@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from api.webhook_inbox import procesar_eventos
+
+
+class Command(BaseCommand):
+    help = 'Aplica los eventos de webhooks de Stripe y PayPal pendientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=50,
+                            help='Máximo de eventos a procesar por ciclo')
+        parser.add_argument('--loop', action='store_true',
+                            help='Seguir procesando la bandeja indefinidamente')
+        parser.add_argument('--intervalo', type=float, default=1.0,
+                            help='Segundos de espera cuando no hay eventos')
+
+    def handle(self, *args, **options):
+        while True:
+            procesados = procesar_eventos(limite=options['limite'])
+            if procesados:
+                self.stdout.write(f"Eventos aplicados: {procesados}")
+
+            if not options['loop']:
+                break
+            if not procesados:
+                time.sleep(options['intervalo'])
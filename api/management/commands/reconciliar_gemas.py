@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from api.ledger import corregir_descuadre, descuadres
+
+
+class Command(BaseCommand):
+    help = 'Comprueba que UserProfile.gemas coincide con la suma de los movimientos aplicados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corregir', action='store_true',
+                            help='Registrar un ajuste por cada descuadre encontrado')
+
+    def handle(self, *args, **options):
+        encontrados = descuadres()
+        for user_id, gemas, suma_aplicada in encontrados:
+            self.stdout.write(
+                f"Usuario {user_id}: gemas={gemas} movimientos={suma_aplicada} "
+                f"diferencia={gemas - suma_aplicada}"
+            )
+            if options['corregir']:
+                corregir_descuadre(user_id, gemas, suma_aplicada)
+
+        if not encontrados:
+            self.stdout.write(self.style.SUCCESS("El libro de gemas cuadra"))
+        elif options['corregir']:
+            self.stdout.write(self.style.WARNING(f"Ajustes registrados: {len(encontrados)}"))
+        else:
+            self.stdout.write(self.style.WARNING(f"Descuadres: {len(encontrados)}"))
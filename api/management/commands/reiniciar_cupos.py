@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from api.ledger import periodo_actual, reiniciar_periodos
+
+
+class Command(BaseCommand):
+    help = 'Reinicia en lotes los contadores de tiradas de los perfiles con un periodo de facturación anterior'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000,
+                            help='Perfiles actualizados por UPDATE')
+
+    def handle(self, *args, **options):
+        reiniciados = reiniciar_periodos(lote=options['lote'])
+        self.stdout.write(f"Perfiles reiniciados al periodo {periodo_actual()}: {reiniciados}")
@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-18 16:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def crear_saldos_iniciales(apps, schema_editor):
+    """Registra el saldo actual de cada perfil como primer movimiento del libro"""
+    UserProfile = apps.get_model('api', 'UserProfile')
+    GemTransaction = apps.get_model('api', 'GemTransaction')
+    perfiles = UserProfile.objects.filter(gemas__gt=0).values_list('user_id', 'gemas')
+    GemTransaction.objects.bulk_create([
+        GemTransaction(user_id=user_id, amount=gemas, reason='saldo_inicial', applied=True)
+        for user_id, gemas in perfiles.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_tiradarealizada_estado_paypalpayment_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GemTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField()),
+                ('reason', models.CharField(choices=[('saldo_inicial', 'Saldo inicial'), ('compra_gemas', 'Compra de gemas'), ('suscripcion', 'Bono de suscripción'), ('tirada', 'Tirada'), ('hechizo', 'Compra de hechizo'), ('pocion', 'Compra de poción'), ('ajuste', 'Ajuste')], max_length=20)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('applied', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gem_transactions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'applied'], name='gemtx_user_applied_idx'), models.Index(fields=['user', '-created_at'], name='gemtx_user_created_idx')],
+            },
+        ),
+        migrations.RunPython(crear_saldos_iniciales, migrations.RunPython.noop),
+    ]
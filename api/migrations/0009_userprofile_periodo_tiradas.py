@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 16:13
+
+from django.db import migrations, models
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def periodo_desde_fecha_reset(apps, schema_editor):
+    """Los contadores actuales pertenecen al mes de su último reinicio"""
+    UserProfile = apps.get_model('api', 'UserProfile')
+    UserProfile.objects.update(
+        periodo_tiradas=ExtractYear('fecha_reset') * 100 + ExtractMonth('fecha_reset')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_gemtransaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='periodo_tiradas',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(periodo_desde_fecha_reset, migrations.RunPython.noop),
+    ]
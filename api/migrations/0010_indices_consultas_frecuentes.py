@@ -0,0 +1,44 @@
+# Generated by Django 5.2 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_userprofile_periodo_tiradas'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stripepayment',
+            name='stripe_payment_intent_id',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stripesubscription',
+            name='stripe_subscription_id',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='tipotirada',
+            name='tipo',
+            field=models.CharField(choices=[('basica', 'Tirada Básica'), ('claridad', 'Tirada de Claridad'), ('profunda', 'Tirada Profunda')], max_length=10, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='hechizo',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['categoria'], name='hechizo_activo_categoria_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pocion',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['categoria'], name='pocion_activo_categoria_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tiradarealizada',
+            index=models.Index(fields=['user', '-fecha', '-id'], name='tirada_user_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tiradarealizada',
+            index=models.Index(fields=['estado', 'fecha'], name='tirada_estado_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_indices_consultas_frecuentes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gemtransaction',
+            name='reason',
+            field=models.CharField(choices=[('saldo_inicial', 'Saldo inicial'), ('compra_gemas', 'Compra de gemas'), ('suscripcion', 'Bono de suscripción'), ('tirada', 'Tirada'), ('hechizo', 'Compra de hechizo'), ('pocion', 'Compra de poción'), ('carrito', 'Compra de carrito'), ('ajuste', 'Ajuste')], max_length=20),
+        ),
+    ]
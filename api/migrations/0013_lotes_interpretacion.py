@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 16:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_webhookevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoteInterpretacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('backend', models.CharField(max_length=20)),
+                ('lote_id', models.CharField(blank=True, max_length=100)),
+                ('estado', models.CharField(choices=[('preparando', 'Preparando'), ('en_curso', 'En curso'), ('finalizado', 'Finalizado')], db_index=True, default='preparando', max_length=12)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('finalizado', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='tiradarealizada',
+            name='urgente',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='tiradarealizada',
+            name='lote',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tiradas', to='api.loteinterpretacion'),
+        ),
+    ]
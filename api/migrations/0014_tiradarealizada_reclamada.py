@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_lotes_interpretacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tiradarealizada',
+            name='reclamada',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_tiradarealizada_reclamada'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='reclamado',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
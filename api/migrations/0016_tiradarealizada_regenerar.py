@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_webhookevent_reclamado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tiradarealizada',
+            name='regenerar',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='tiradarealizada',
+            index=models.Index(fields=['regenerar', 'fecha'], name='tirada_regenerar_fecha_idx'),
+        ),
+    ]
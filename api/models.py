@@ -43,18 +43,40 @@ class UserProfile(models.Model):
     tiradas_claridad_usadas = models.PositiveIntegerField(default=0)
     tiradas_profundas_usadas = models.PositiveIntegerField(default=0)
     fecha_reset = models.DateField(auto_now_add=True)
+    # Periodo de facturación (AAAAMM) al que corresponden los contadores de tiradas.
+    # Si no es el vigente, los contadores cuentan como cero (ver ledger.tiradas_usadas)
+    periodo_tiradas = models.PositiveIntegerField(default=0, db_index=True)
+
+
+# Libro de movimientos de gemas (solo inserciones)
+class GemTransaction(models.Model):
+    REASON_CHOICES = [
+        ('saldo_inicial', 'Saldo inicial'),
+        ('compra_gemas', 'Compra de gemas'),
+        ('suscripcion', 'Bono de suscripción'),
+        ('tirada', 'Tirada'),
+        ('hechizo', 'Compra de hechizo'),
+        ('pocion', 'Compra de poción'),
+        ('carrito', 'Compra de carrito'),
+        ('ajuste', 'Ajuste'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='gem_transactions')
+    amount = models.IntegerField()  # Positivo para créditos, negativo para débitos
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    reference = models.CharField(max_length=100, blank=True)  # Id de pago, hechizo, tirada...
+    # True cuando el movimiento ya está incluido en UserProfile.gemas
+    applied = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
 
-    def reset_tiradas_mensuales(self):
-        from datetime import date
-        today = date.today()
-        if self.fecha_reset.month != today.month or self.fecha_reset.year != today.year:
-            self.tiradas_basicas_usadas = 0
-            self.tiradas_claridad_usadas = 0
-            self.tiradas_profundas_usadas = 0
-            self.fecha_reset = today
-            self.save()
-            
-            
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'applied'], name='gemtx_user_applied_idx'),
+            models.Index(fields=['user', '-created_at'], name='gemtx_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.reason} - {self.amount}"
 
 class Hechizo(models.Model):
     titulo = models.CharField(max_length=100)
@@ -68,6 +90,11 @@ class Hechizo(models.Model):
     )
     fecha_creacion = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Catálogo activo, opcionalmente por categoría. Índice parcial: SQLite compara
+        # los booleanos como `WHERE "activo"` y no usaría un índice compuesto (activo, categoria)
+        indexes = [models.Index(fields=['categoria'], condition=models.Q(activo=True), name='hechizo_activo_categoria_idx')]
+
     def __str__(self):
         return self.titulo
 
@@ -83,6 +110,11 @@ class Pocion(models.Model):
     )
     fecha_creacion = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Catálogo activo, opcionalmente por categoría. Índice parcial: SQLite compara
+        # los booleanos como `WHERE "activo"` y no usaría un índice compuesto (activo, categoria)
+        indexes = [models.Index(fields=['categoria'], condition=models.Q(activo=True), name='pocion_activo_categoria_idx')]
+
     def __str__(self):
         return self.titulo
 
@@ -134,7 +166,7 @@ class TipoTirada(models.Model):
     ]
     
     nombre = models.CharField(max_length=100)
-    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES)
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES, unique=True)
     num_cartas = models.IntegerField()
     descripcion = models.TextField()
     costo_gemas = models.PositiveIntegerField(default=1)
@@ -144,13 +176,55 @@ class TipoTirada(models.Model):
     def __str__(self):
         return self.nombre
 
+# Lote de tiradas no urgentes enviado a un backend de interpretaciones
+class LoteInterpretacion(models.Model):
+    ESTADO_CHOICES = [
+        ('preparando', 'Preparando'),
+        ('en_curso', 'En curso'),
+        ('finalizado', 'Finalizado')
+    ]
+
+    backend = models.CharField(max_length=20)
+    lote_id = models.CharField(max_length=100, blank=True)  # Identificador del proveedor
+    estado = models.CharField(max_length=12, choices=ESTADO_CHOICES, default='preparando', db_index=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    finalizado = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.backend} {self.lote_id or self.id} - {self.estado}"
+
 # Modelo para registrar las tiradas realizadas
 class TiradaRealizada(models.Model):
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('completada', 'Completada')
+    ]
+
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='tiradas')
     tipo_tirada = models.ForeignKey(TipoTirada, on_delete=models.CASCADE)
     fecha = models.DateTimeField(auto_now_add=True)
     pregunta = models.TextField()
     interpretacion = models.TextField()  # Respuesta de la API
+    # Las tiradas asíncronas quedan 'pendiente' hasta que el worker genera la interpretación
+    estado = models.CharField(max_length=12, choices=ESTADO_CHOICES, default='completada')
+    # Momento en que pasó a 'procesando'; un reclamo vencido vuelve a la cola
+    reclamada = models.DateTimeField(null=True, blank=True)
+    # Las tiradas no urgentes (tiradas programadas) se interpretan por lotes
+    urgente = models.BooleanField(default=True)
+    # Interpretación marcada para regenerarse en el próximo lote; la tirada sigue 'completada'
+    regenerar = models.BooleanField(default=False)
+    lote = models.ForeignKey(LoteInterpretacion, on_delete=models.SET_NULL, null=True, blank=True, related_name='tiradas')
+
+    class Meta:
+        indexes = [
+            # Historial paginado por (fecha, id) de cada usuario
+            models.Index(fields=['user', '-fecha', '-id'], name='tirada_user_fecha_idx'),
+            # Cola de interpretaciones pendientes
+            models.Index(fields=['estado', 'fecha'], name='tirada_estado_fecha_idx'),
+            # Regeneraciones pendientes de enviar en un lote
+            models.Index(fields=['regenerar', 'fecha'], name='tirada_regenerar_fecha_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.email} - {self.tipo_tirada.nombre} - {self.fecha.strftime('%d/%m/%Y')}"
@@ -190,7 +264,7 @@ class StripeSubscription(models.Model):
     ]
 
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
-    stripe_subscription_id = models.CharField(max_length=100)
+    stripe_subscription_id = models.CharField(max_length=100, unique=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES)
     current_period_end = models.DateTimeField()
     cancel_at_period_end = models.BooleanField(default=False)
@@ -214,7 +288,7 @@ class StripePayment(models.Model):
     ]
 
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
-    stripe_payment_intent_id = models.CharField(max_length=100)
+    stripe_payment_intent_id = models.CharField(max_length=100, unique=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, default='USD')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES)
@@ -246,4 +320,42 @@ class PayPalSubscription(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"PayPal Subscription {self.subscription_id} - {self.status}"
\ No newline at end of file
+        return f"PayPal Subscription {self.subscription_id} - {self.status}"
+
+# Bandeja de entrada de webhooks: cada evento se guarda una sola vez y un worker lo aplica
+class WebhookEvent(models.Model):
+    PROVIDER_CHOICES = [
+        ('stripe', 'Stripe'),
+        ('paypal', 'PayPal')
+    ]
+
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('procesado', 'Procesado'),
+        ('error', 'Error')
+    ]
+
+    provider = models.CharField(max_length=10, choices=PROVIDER_CHOICES)
+    event_id = models.CharField(max_length=255)  # Id del evento en el proveedor
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    estado = models.CharField(max_length=12, choices=ESTADO_CHOICES, default='pendiente')
+    intentos = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    recibido = models.DateTimeField(auto_now_add=True)
+    # Momento en que pasó a 'procesando'; un reclamo vencido se reintenta
+    reclamado = models.DateTimeField(null=True, blank=True)
+    procesado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # Los reintentos del proveedor no crean eventos nuevos
+            models.UniqueConstraint(fields=['provider', 'event_id'], name='webhook_provider_event_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['estado', 'id'], name='webhook_estado_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_type} {self.event_id} - {self.estado}"
@@ -0,0 +1,105 @@
+"""
+Owned items cache module for TarotNautica
+
+Los hechizos y pociones que compró cada usuario se guardan en la caché por
+defecto como un bitmap (el bit n indica que posee el item con id n),
+serializado en bytes. Con él se responden mis-hechizos/, mis-pociones/ y las
+comprobaciones de compra sin consultar la base. Si la caché no tiene el
+bitmap se reconstruye con una consulta.
+
+Una compra no modifica el bitmap en la caché (leerlo, activar el bit y
+escribirlo no es atómico, y dos compras simultáneas se pisarían): incrementa
+la versión del usuario, bajo la que se guardan los bitmaps, al escribir y
+otra vez al confirmar la transacción, igual que profile_cache.invalidar. La
+siguiente lectura lo reconstruye desde la base.
+
+Como el perfil (ver profile_cache.py), el bitmap solo se cachea si la caché
+por defecto es compartida (CACHE_COMPARTIDA): con una LocMemCache una compra
+registrada por otro proceso no llegaría a este. Sin caché compartida cada
+lectura consulta la base.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import CompraHechizo, CompraPocion
+
+# Tipo de item -> (modelo de compra, campo del item)
+TIPOS = {
+    'hechizos': (CompraHechizo, 'hechizo_id'),
+    'pociones': (CompraPocion, 'pocion_id'),
+}
+
+
+def clave_version(tipo, user_id):
+    return f'poseidos_version:{tipo}:{user_id}'
+
+
+def version_poseidos(tipo, user_id):
+    """Versión vigente del bitmap del usuario"""
+    # Si la caché descarta el contador, el nuevo arranca por encima de las versiones ya usadas
+    return cache.get_or_set(clave_version(tipo, user_id), time.time_ns(), timeout=None)
+
+
+def clave_poseidos(tipo, user_id):
+    return f'poseidos:{tipo}:{user_id}:{version_poseidos(tipo, user_id)}'
+
+
+def codificar(ids):
+    bitmap = 0
+    for item_id in ids:
+        bitmap |= 1 << item_id
+    return bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+
+
+def decodificar(datos):
+    bitmap = int.from_bytes(datos, 'little')
+    ids = []
+    item_id = 0
+    while bitmap:
+        if bitmap & 1:
+            ids.append(item_id)
+        bitmap >>= 1
+        item_id += 1
+    return ids
+
+
+def _cargar(tipo, user_id):
+    modelo, campo = TIPOS[tipo]
+    return codificar(modelo.objects.filter(user_id=user_id).values_list(campo, flat=True))
+
+
+def _bitmap(tipo, user_id):
+    if not settings.CACHE_COMPARTIDA:
+        return _cargar(tipo, user_id)
+
+    clave = clave_poseidos(tipo, user_id)
+    datos = cache.get(clave)
+    if datos is None:
+        datos = _cargar(tipo, user_id)
+        cache.set(clave, datos, timeout=settings.CACHE_POSEIDOS_TTL)
+    return datos
+
+
+def ids_poseidos(tipo, user_id):
+    """Ids de los items comprados por el usuario, ordenados"""
+    return decodificar(_bitmap(tipo, user_id))
+
+
+def posee(tipo, user_id, item_id):
+    """True si el usuario ya compró el item"""
+    return bool(int.from_bytes(_bitmap(tipo, user_id), 'little') >> item_id & 1)
+
+
+def _incrementar(tipo, user_id):
+    try:
+        cache.incr(clave_version(tipo, user_id))
+    except ValueError:
+        cache.set(clave_version(tipo, user_id), time.time_ns(), timeout=None)
+
+
+def invalidar(tipo, user_id):
+    """Marca como obsoleto el bitmap del usuario tras una compra; se reconstruye desde la base"""
+    _incrementar(tipo, user_id)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _incrementar(tipo, user_id))
@@ -0,0 +1,105 @@
+"""
+PayPal webhook signature module for TarotNautica
+
+Verifica localmente la firma de los webhooks de PayPal, sin llamar a
+/v1/notifications/verify-webhook-signature en cada evento. PayPal firma con
+RSA-SHA256 (SHA256withRSA) el texto:
+
+    <transmission_id>|<transmission_time>|<webhook_id>|<crc32 del cuerpo>
+
+con la clave del certificado indicado en PAYPAL-CERT-URL. El certificado solo
+se descarga de hosts permitidos (PAYPAL_CERT_HOSTS) y se guarda en la caché
+por defecto durante PAYPAL_CERT_CACHE_TTL, sin superar su fecha de caducidad.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import zlib
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from django.conf import settings
+from django.core.cache import cache
+from . import http_client
+
+logger = logging.getLogger(__name__)
+
+ALGORITMO = 'SHA256withRSA'
+
+
+def url_permitida(cert_url):
+    """Solo certificados servidos por HTTPS desde los hosts de PayPal configurados"""
+    url = urlparse(cert_url or '')
+    return url.scheme == 'https' and url.hostname in settings.PAYPAL_CERT_HOSTS
+
+
+def obtener_certificado(cert_url):
+    """
+    Certificado X.509 de la URL, desde la caché o descargándolo una vez.
+
+    Returns:
+        Certificate o None si la URL no está permitida o el certificado no es válido
+    """
+    if not url_permitida(cert_url):
+        logger.error(f"URL de certificado PayPal no permitida: {cert_url}")
+        return None
+
+    clave = 'paypal_cert:' + hashlib.sha256(cert_url.encode()).hexdigest()
+    pem = cache.get(clave)
+    if pem is None:
+        response = http_client.get(cert_url)
+        if response.status_code != 200:
+            logger.error(f"Error descargando certificado PayPal: {response.status_code}")
+            return None
+        pem = response.content
+        certificado = x509.load_pem_x509_certificate(pem)
+        restante = (certificado.not_valid_after_utc - datetime.now(timezone.utc)).total_seconds()
+        if restante <= 0:
+            logger.error(f"Certificado PayPal caducado: {cert_url}")
+            return None
+        cache.set(clave, pem, timeout=min(settings.PAYPAL_CERT_CACHE_TTL, int(restante)))
+        return certificado
+
+    return x509.load_pem_x509_certificate(pem)
+
+
+def mensaje_firmado(transmission_id, transmission_time, webhook_id, cuerpo):
+    """Texto que PayPal firma para cada transmisión"""
+    crc = zlib.crc32(cuerpo) & 0xffffffff
+    return f"{transmission_id}|{transmission_time}|{webhook_id}|{crc}".encode()
+
+
+def verificar_firma(headers, cuerpo, webhook_id):
+    """
+    Comprueba la firma de un webhook con las cabeceras PAYPAL-* y el cuerpo sin parsear.
+
+    Returns:
+        bool: True si la firma es válida
+    """
+    transmission_id = headers.get('PAYPAL-TRANSMISSION-ID')
+    transmission_time = headers.get('PAYPAL-TRANSMISSION-TIME')
+    firma = headers.get('PAYPAL-TRANSMISSION-SIG')
+    cert_url = headers.get('PAYPAL-CERT-URL')
+
+    if not all([transmission_id, transmission_time, firma, cert_url, webhook_id]):
+        return False
+    if headers.get('PAYPAL-AUTH-ALGO') != ALGORITMO:
+        return False
+
+    try:
+        certificado = obtener_certificado(cert_url)
+        if certificado is None:
+            return False
+        certificado.public_key().verify(
+            base64.b64decode(firma),
+            mensaje_firmado(transmission_id, transmission_time, webhook_id, cuerpo),
+            padding.PKCS1v15(),
+            hashes.SHA256()
+        )
+        return True
+    except (InvalidSignature, binascii.Error, ValueError):
+        return False
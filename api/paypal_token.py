@@ -0,0 +1,152 @@
+"""
+PayPal token module for TarotNautica
+
+Punto único para obtener el token OAuth de PayPal (client_credentials):
+
+- El token se guarda en la caché por defecto junto con su expiración real
+  (expires_in), compartido entre procesos.
+- Single-flight: si no hay token válido, solo la petición que consigue el
+  candado de la caché (cache.add) lo pide a PayPal; las demás esperan a que
+  aparezca en la caché en lugar de golpear el endpoint a la vez.
+- Refresco anticipado: dentro de los últimos PAYPAL_TOKEN_MARGEN_REFRESCO
+  segundos se sigue sirviendo el token vigente y un hilo en segundo plano
+  pide el siguiente.
+- Si la renovación anticipada falla se sigue usando el último token mientras
+  no caduque.
+"""
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from . import http_client
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'paypal_access_token'
+LOCK_KEY = 'paypal_access_token:lock'
+# Tiempo máximo que una petición espera a que otra obtenga el token
+ESPERA_MAXIMA = 10
+INTERVALO_ESPERA = 0.05
+
+
+def api_base():
+    return 'https://api-m.sandbox.paypal.com' if settings.DEBUG else 'https://api-m.paypal.com'
+
+
+def solicitar_token():
+    """
+    Pide un token nuevo a PayPal.
+
+    Returns:
+        (token, expires_in)
+    """
+    response = http_client.post(
+        f'{api_base()}/v1/oauth2/token',
+        headers={'Accept': 'application/json', 'Content-Type': 'application/x-www-form-urlencoded'},
+        data={'grant_type': 'client_credentials'},
+        auth=(settings.PAYPAL_CLIENT_ID, settings.PAYPAL_CLIENT_SECRET)
+    )
+    if response.status_code != 200:
+        raise Exception(f'Failed to get PayPal access token: {response.status_code}')
+
+    datos = response.json()
+    return datos['access_token'], int(datos.get('expires_in', 3600))
+
+
+class GestorTokenPayPal:
+    """Token OAuth de PayPal compartido, con renovación single-flight y anticipada"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ultimo = None  # Respaldo local si la caché pierde la entrada
+        self._refresco = None
+        self.reiniciar_metricas()
+
+    def _registrar(self, evento):
+        with self._lock:
+            self._contadores[evento] += 1
+
+    def resumen(self):
+        with self._lock:
+            return dict(self._contadores)
+
+    def reiniciar_metricas(self):
+        self._contadores = {
+            'aciertos': 0, 'solicitudes': 0, 'refrescos_anticipados': 0, 'esperas': 0, 'fallos': 0
+        }
+
+    def _entrada_vigente(self, ahora):
+        entrada = cache.get(CACHE_KEY) or self._ultimo
+        if entrada and ahora < entrada['expira']:
+            return entrada
+        return None
+
+    def _renovar(self):
+        """Pide un token nuevo y lo publica; llamar solo con el candado de la caché"""
+        self._registrar('solicitudes')
+        token, expires_in = solicitar_token()
+        entrada = {'token': token, 'expira': time.time() + expires_in}
+        cache.set(CACHE_KEY, entrada, timeout=expires_in)
+        self._ultimo = entrada
+        return entrada
+
+    def _renovar_con_candado(self):
+        if not cache.add(LOCK_KEY, 1, timeout=ESPERA_MAXIMA):
+            return None
+        try:
+            return self._renovar()
+        finally:
+            cache.delete(LOCK_KEY)
+
+    def _refrescar_en_segundo_plano(self):
+        def refrescar():
+            try:
+                if self._renovar_con_candado():
+                    self._registrar('refrescos_anticipados')
+            except Exception as e:
+                self._registrar('fallos')
+                logger.error(f"Error refrescando token PayPal: {str(e)}")
+
+        if self._refresco is None or not self._refresco.is_alive():
+            self._refresco = threading.Thread(target=refrescar, daemon=True)
+            self._refresco.start()
+
+    def obtener_token(self):
+        ahora = time.time()
+        entrada = self._entrada_vigente(ahora)
+        if entrada:
+            self._registrar('aciertos')
+            if ahora >= entrada['expira'] - settings.PAYPAL_TOKEN_MARGEN_REFRESCO:
+                self._refrescar_en_segundo_plano()
+            return entrada['token']
+
+        # Sin token válido: una sola petición lo pide, el resto espera
+        limite = ahora + ESPERA_MAXIMA
+        while True:
+            try:
+                entrada = self._renovar_con_candado()
+            except Exception as e:
+                self._registrar('fallos')
+                logger.error(f"Error obteniendo token PayPal: {str(e)}")
+                raise
+            if entrada:
+                return entrada['token']
+
+            self._registrar('esperas')
+            while time.time() < limite and cache.get(LOCK_KEY):
+                time.sleep(INTERVALO_ESPERA)
+            entrada = self._entrada_vigente(time.time())
+            if entrada:
+                return entrada['token']
+            if time.time() >= limite:
+                # Nadie publicó un token a tiempo: pedirlo directamente
+                return self._renovar()['token']
+
+
+gestor = GestorTokenPayPal()
+
+
+def obtener_token():
+    """Token OAuth de PayPal vigente"""
+    return gestor.obtener_token()
@@ -4,22 +4,13 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-import requests
-from .models import UserProfile, PayPalPayment, PayPalSubscription
+from . import http_client, ledger, paypal_token
+from .models import PayPalPayment, PayPalSubscription
 
-PAYPAL_BASE_URL = 'https://api-m.sandbox.paypal.com' if settings.DEBUG else 'https://api-m.paypal.com'
+PAYPAL_BASE_URL = paypal_token.api_base()
 
 def get_access_token():
-    auth_url = f"{PAYPAL_BASE_URL}/v1/oauth2/token"
-    headers = {
-        'Accept': 'application/json',
-        'Accept-Language': 'en_US'
-    }
-    data = {'grant_type': 'client_credentials'}
-    auth = (settings.PAYPAL_CLIENT_ID, settings.PAYPAL_CLIENT_SECRET)
-    
-    response = requests.post(auth_url, headers=headers, data=data, auth=auth)
-    return response.json()['access_token']
+    return paypal_token.obtener_token()
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -55,7 +46,7 @@ def crear_orden_paypal(request):
             }
         }
 
-        response = requests.post(
+        response = http_client.post(
             f"{PAYPAL_BASE_URL}/v2/checkout/orders",
             headers=headers,
             json=payload
@@ -102,7 +93,7 @@ def capturar_pago_paypal(request):
             'Authorization': f'Bearer {access_token}',
         }
 
-        response = requests.post(
+        response = http_client.post(
             f"{PAYPAL_BASE_URL}/v2/checkout/orders/{order_id}/capture",
             headers=headers
         )
@@ -117,9 +108,7 @@ def capturar_pago_paypal(request):
             
             # Acreditar gemas si es una compra de gemas
             if payment.payment_type == 'gems':
-                profile = UserProfile.objects.get(user=request.user)
-                profile.gemas += payment.gems_amount
-                profile.save()
+                ledger.acreditar_gemas(request.user.id, payment.gems_amount, 'compra_gemas', order_id)
             
             return Response(capture_data)
         else:
@@ -162,7 +151,7 @@ def crear_suscripcion_paypal(request):
             }
         }
 
-        response = requests.post(
+        response = http_client.post(
             f"{PAYPAL_BASE_URL}/v1/billing/subscriptions",
             headers=headers,
             json=payload
@@ -203,7 +192,7 @@ def cancelar_suscripcion_paypal(request):
             'Authorization': f'Bearer {access_token}',
         }
 
-        response = requests.post(
+        response = http_client.post(
             f"{PAYPAL_BASE_URL}/v1/billing/subscriptions/{subscription_id}/cancel",
             headers=headers
         )
@@ -215,9 +204,7 @@ def cancelar_suscripcion_paypal(request):
             subscription.save()
             
             # Actualizar el perfil del usuario
-            profile = UserProfile.objects.get(user=request.user)
-            profile.tiene_suscripcion = False
-            profile.save()
+            ledger.cancelar_suscripcion(request.user.id)
             
             return Response({'status': 'Subscription cancelled'})
         else:
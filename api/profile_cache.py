@@ -0,0 +1,95 @@
+"""
+Profile cache module for TarotNautica
+
+Instantánea del perfil de cada usuario (UserProfile más sus créditos de gemas
+pendientes) en la caché por defecto, para que perfil/, bootstrap/, las compras
+y la validación de tiradas no consulten la base en cada petición:
+
+- obtener_perfil() devuelve la instantánea de la versión vigente del usuario o
+  la construye con una consulta y la guarda.
+- Cada mutación del ledger y cada save/delete del perfil (ver signals.py)
+  llama a invalidar(), que incrementa la versión del usuario. Las instantáneas
+  se guardan bajo su versión: una lectura que empezó antes de la mutación deja
+  su copia bajo la versión anterior, que ya nadie lee, y nunca pisa una más
+  reciente.
+- Dentro de una transacción la versión se incrementa al escribir y otra vez al
+  confirmar, para que una lectura concurrente no deje cacheado el estado
+  previo al commit.
+
+La instantánea solo se usa si la caché por defecto es compartida
+(CACHE_COMPARTIDA, ver core/settings.py): con una LocMemCache cada proceso
+tendría su copia y un cambio hecho en otro worker, en un webhook o en un
+comando no la invalidaría. Sin caché compartida obtener_perfil() lee la base
+en cada llamada (una consulta, con los créditos pendientes anotados).
+
+Los cobros siguen siendo UPDATE condicionales (ver ledger.py): una instantánea
+desfasada puede cambiar el camino que se intenta primero, pero no permite
+gastar gemas o cupo que la base no tiene.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import GemTransaction, UserProfile
+
+CAMPOS = [campo.attname for campo in UserProfile._meta.concrete_fields]
+
+
+def clave_version(user_id):
+    return f'perfil_version:{user_id}'
+
+
+def version_perfil(user_id):
+    """Versión vigente de la instantánea del usuario, compartida entre procesos"""
+    # Si la caché descarta el contador, el nuevo arranca por encima de las versiones ya usadas
+    return cache.get_or_set(clave_version(user_id), time.time_ns(), timeout=None)
+
+
+def _incrementar(user_id):
+    try:
+        cache.incr(clave_version(user_id))
+    except ValueError:
+        cache.set(clave_version(user_id), time.time_ns(), timeout=None)
+
+
+def invalidar(user_id):
+    """Marca como obsoleta la instantánea del usuario"""
+    _incrementar(user_id)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _incrementar(user_id))
+
+
+def cargar_perfil(user_id):
+    """Perfil con sus créditos pendientes anotados (creditos_pendientes), en una consulta"""
+    pendientes = GemTransaction.objects.filter(
+        user_id=OuterRef('user_id'), applied=False
+    ).values('user_id').annotate(total=Sum('amount')).values('total')
+
+    return UserProfile.objects.annotate(
+        creditos_pendientes=Coalesce(Subquery(pendientes, output_field=IntegerField()), Value(0))
+    ).get(user_id=user_id)
+
+
+def obtener_perfil(user_id):
+    """
+    Perfil del usuario desde la instantánea cacheada, o desde la base si la
+    caché no es compartida. Es una copia de solo lectura: las modificaciones
+    pasan por ledger.py.
+    """
+    if not settings.CACHE_COMPARTIDA:
+        return cargar_perfil(user_id)
+
+    clave = f'perfil:{user_id}:{version_perfil(user_id)}'
+    instantanea = cache.get(clave)
+    if instantanea is None:
+        perfil = cargar_perfil(user_id)
+        instantanea = ([getattr(perfil, campo) for campo in CAMPOS], perfil.creditos_pendientes)
+        cache.set(clave, instantanea, timeout=settings.CACHE_PERFIL_TTL)
+        return perfil
+
+    valores, pendientes = instantanea
+    perfil = UserProfile.from_db(DEFAULT_DB_ALIAS, CAMPOS, valores)
+    perfil.creditos_pendientes = pendientes
+    return perfil
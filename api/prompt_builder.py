@@ -0,0 +1,177 @@
+"""
+Prompt builder module for TarotNautica
+
+Construye la petición de interpretación en segmentos, del más estable al más
+variable, para que la caché de prompts del proveedor pueda reutilizar el
+prefijo entre lecturas:
+
+1. Instrucciones del sistema (constantes).
+2. Segmento del tipo de tirada, renderizado una vez por contenido. Se marca
+   con cache_control solo si junto con las instrucciones llega a
+   MINIMO_TOKENS_CACHE tokens: el proveedor no cachea prefijos más cortos y
+   la marca solo añadiría el recargo de escritura.
+3. Mensaje del usuario: la pregunta y las cartas de la lectura. El texto de
+   cada carta se toma de un segmento del mazo renderizado una vez por versión
+   del mazo, con el significado recortado a PROMPT_TOKENS_POR_CARTA tokens.
+
+Los tokens se estiman a partir de los caracteres (PROMPT_CARACTERES_POR_TOKEN).
+Los tokens reales los informa la API en `usage`; `metricas` calcula el ahorro
+de cada lectura frente al mismo prompt sin caché (ver registrar_uso), lo
+registra en el log y lo acumula.
+"""
+import logging
+import math
+import threading
+from functools import lru_cache
+from django.conf import settings
+from .tarot_deck import obtener_mazo
+
+logger = logging.getLogger(__name__)
+
+# Tokens mínimos de un prefijo para que la caché de prompts lo guarde
+MINIMO_TOKENS_CACHE = 1024
+
+# Precio de los tokens leídos y escritos en la caché, relativo a un token de entrada normal
+PRECIO_LECTURA_CACHE = 0.1
+PRECIO_ESCRITURA_CACHE = 1.25
+
+SISTEMA = (
+    "Eres un experto tarotista que proporciona interpretaciones místicas pero prácticas. "
+    "Da una interpretación completa, esotérica y mística pero práctica, relacionando las cartas "
+    "entre sí y respondiendo a la pregunta. Usa género neutral para referirte al consultante "
+    "ya que no sabemos si es hombre o mujer."
+)
+
+
+def estimar_tokens(texto):
+    """Tokens aproximados de un texto"""
+    return math.ceil(len(texto) / settings.PROMPT_CARACTERES_POR_TOKEN) if texto else 0
+
+
+def recortar_a_tokens(texto, max_tokens):
+    """Recorta el texto por palabras completas hasta que quepa en `max_tokens`"""
+    if estimar_tokens(texto) <= max_tokens:
+        return texto
+    limite = int(max_tokens * settings.PROMPT_CARACTERES_POR_TOKEN) - 1
+    recortado = texto[:limite].rsplit(' ', 1)[0] if ' ' in texto[:limite] else texto[:limite]
+    return recortado.rstrip(' ,.;:') + '…'
+
+
+class MetricasPrompt:
+    """Tokens de entrada y tokens servidos desde la caché de prompts, seguros entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def registrar_uso(self, usage, tirada_id=None):
+        """
+        Acumula el `usage` de una respuesta de la API y registra el ahorro de la lectura.
+
+        El ahorro se mide frente al mismo prompt enviado sin caché, en tokens de
+        entrada equivalentes: las lecturas de caché cuestan PRECIO_LECTURA_CACHE
+        y las escrituras PRECIO_ESCRITURA_CACHE, así que una lectura que solo
+        escribe en la caché ahorra un valor negativo.
+
+        Returns:
+            float: Tokens de entrada equivalentes ahorrados en esta lectura
+        """
+        leidos = usage.get('cache_read_input_tokens') or 0
+        escritos = usage.get('cache_creation_input_tokens') or 0
+        entrada = usage.get('input_tokens') or 0
+        ahorrados = leidos * (1 - PRECIO_LECTURA_CACHE) - escritos * (PRECIO_ESCRITURA_CACHE - 1)
+        logger.info(
+            f"Tirada {tirada_id}: {entrada + leidos + escritos} tokens de entrada ({leidos} leídos de la caché, "
+            f"{escritos} escritos), ahorro frente al prompt sin caché: {ahorrados:.1f}"
+        )
+        with self._lock:
+            self._contadores['lecturas'] += 1
+            self._contadores['tokens_entrada'] += entrada + leidos + escritos
+            self._contadores['tokens_cache_leidos'] += leidos
+            self._contadores['tokens_cache_escritos'] += escritos
+            self._contadores['tokens_ahorrados'] += ahorrados
+        return ahorrados
+
+    def resumen(self):
+        with self._lock:
+            lecturas = self._contadores['lecturas']
+            promedio = self._contadores['tokens_ahorrados'] / lecturas if lecturas else 0.0
+            return {
+                **self._contadores,
+                'tokens_ahorrados': round(self._contadores['tokens_ahorrados'], 2),
+                'ahorro_promedio_por_lectura': round(promedio, 2),
+            }
+
+    def reiniciar(self):
+        self._contadores = {
+            'lecturas': 0, 'tokens_entrada': 0, 'tokens_cache_leidos': 0, 'tokens_cache_escritos': 0,
+            'tokens_ahorrados': 0.0,
+        }
+
+
+metricas = MetricasPrompt()
+
+_lock = threading.Lock()
+_segmentos_mazo = (None, None, {})
+
+
+def segmentos_mazo():
+    """Texto de cada (carta_id, invertida) para el mazo vigente"""
+    global _segmentos_mazo
+    mazo = obtener_mazo()
+    # Cada recarga del mazo crea una instancia nueva; el presupuesto también forma
+    # parte de la clave para no servir recortes de otra configuración
+    presupuesto = (settings.PROMPT_TOKENS_POR_CARTA, settings.PROMPT_CARACTERES_POR_TOKEN)
+    mazo_vigente, presupuesto_vigente, segmentos = _segmentos_mazo
+    if mazo_vigente is mazo and presupuesto_vigente == presupuesto:
+        return segmentos
+
+    segmentos = {}
+    for carta in mazo.cartas:
+        for invertida, significado in ((False, carta.significado_normal), (True, carta.significado_invertido)):
+            estado = "invertida" if invertida else "normal"
+            segmentos[(carta.id, invertida)] = (
+                f"{carta.nombre} ({estado}): {recortar_a_tokens(significado, settings.PROMPT_TOKENS_POR_CARTA)}"
+            )
+    with _lock:
+        _segmentos_mazo = (mazo, presupuesto, segmentos)
+    return segmentos
+
+
+@lru_cache(maxsize=64)
+def renderizar_tirada(nombre, num_cartas, descripcion, layout_descripcion):
+    return (
+        f"Tipo de tirada: {nombre} ({num_cartas} cartas)\n"
+        f"{descripcion}\n"
+        f"Disposición: {layout_descripcion}"
+    ).strip()
+
+
+def segmento_tirada(tipo_tirada):
+    """Descripción fija del tipo de tirada, renderizada una vez por contenido"""
+    return renderizar_tirada(
+        tipo_tirada.nombre, tipo_tirada.num_cartas, tipo_tirada.descripcion, tipo_tirada.layout_descripcion
+    )
+
+
+def construir_solicitud(tirada, cartas_en_tirada):
+    """Cuerpo de la petición a la Messages API, con el prefijo estable primero"""
+    segmentos = segmentos_mazo()
+    cartas = "\n".join(
+        f"{carta.posicion}. {segmentos[(carta.carta_id, carta.invertida)]}"
+        for carta in sorted(cartas_en_tirada, key=lambda c: c.posicion)
+    )
+    tirada_texto = segmento_tirada(tirada.tipo_tirada)
+    bloque_tirada = {"type": "text", "text": tirada_texto}
+    # Un prefijo por debajo del mínimo no se cachea y la marca solo añadiría el recargo de escritura
+    if estimar_tokens(SISTEMA) + estimar_tokens(tirada_texto) >= MINIMO_TOKENS_CACHE:
+        bloque_tirada["cache_control"] = {"type": "ephemeral"}
+    return {
+        "model": settings.ANTHROPIC_MODEL,
+        "max_tokens": 1000,
+        "temperature": 0.7,
+        "system": [{"type": "text", "text": SISTEMA}, bloque_tirada],
+        "messages": [
+            {"role": "user", "content": f"Pregunta: \"{tirada.pregunta}\"\n\nCartas:\n{cartas}"}
+        ]
+    }
@@ -0,0 +1,213 @@
+"""
+Rate limit module for TarotNautica
+
+Limita las peticiones de las clases de endpoints caras (tiradas con llamada
+al LLM, compras y pagos) con token buckets por usuario, por IP y globales
+(LIMITES_PETICIONES en core/settings.py). Cada bucket tiene una capacidad
+(ráfaga máxima) y se rellena a razón de capacidad/periodo tokens por segundo.
+
+Una petición consume un token de cada uno de sus buckets o de ninguno: si
+alguno está vacío se rechaza con 429 y Retry-After igual a la espera hasta
+que haya token en todos.
+
+Almacenes:
+- Redis (caché por defecto con RedisCache): un script Lua comprueba y
+  descuenta todos los buckets de forma atómica, compartido entre procesos.
+- Memoria local (cualquier otra caché, LocMemCache por defecto): lectura y
+  escritura de los buckets bajo un candado del proceso; con LocMemCache los
+  límites se aplican por proceso.
+"""
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.throttling import BaseThrottle
+
+SCRIPT_LUA = """
+local ahora = tonumber(ARGV[1])
+local tokens = {}
+local vacios = {}
+local espera = 0
+for i = 1, #KEYS do
+    local capacidad = tonumber(ARGV[2 * i])
+    local periodo = tonumber(ARGV[2 * i + 1])
+    local estado = redis.call('HMGET', KEYS[i], 'tokens', 'ultimo')
+    local disponibles = tonumber(estado[1]) or capacidad
+    local ultimo = tonumber(estado[2]) or ahora
+    disponibles = math.min(capacidad, disponibles + math.max(0, ahora - ultimo) * capacidad / periodo)
+    tokens[i] = disponibles
+    if disponibles < 1 then
+        espera = math.max(espera, (1 - disponibles) * periodo / capacidad)
+        table.insert(vacios, i - 1)
+    end
+end
+if espera > 0 then
+    return {0, tostring(espera), vacios}
+end
+for i = 1, #KEYS do
+    local periodo = tonumber(ARGV[2 * i + 1])
+    redis.call('HSET', KEYS[i], 'tokens', tostring(tokens[i] - 1), 'ultimo', tostring(ahora))
+    redis.call('EXPIRE', KEYS[i], math.ceil(periodo * 2))
+end
+return {1, '0', {}}
+"""
+
+
+def rellenar(disponibles, ultimo, capacidad, periodo, ahora):
+    """Tokens de un bucket tras rellenarlo hasta `ahora`"""
+    return min(capacidad, disponibles + max(0.0, ahora - ultimo) * capacidad / periodo)
+
+
+class AlmacenLocal:
+    """
+    Buckets en la caché por defecto, serializados con un candado del proceso.
+    Con LocMemCache la caché ya es local al proceso, así que el candado basta
+    para que la operación sea atómica.
+    """
+
+    def __init__(self, cache_local):
+        self.cache = cache_local
+        self._lock = threading.Lock()
+
+    def consumir(self, buckets, ahora):
+        """
+        Descuenta un token de cada bucket si todos tienen.
+
+        Args:
+            buckets: Lista de (clave, capacidad, periodo)
+
+        Returns:
+            (permitido, espera, vacios): espera en segundos hasta que haya token
+            en todos y posiciones de los buckets sin tokens
+        """
+        with self._lock:
+            estados = self.cache.get_many([clave for clave, _, _ in buckets])
+            disponibles = []
+            vacios = []
+            espera = 0.0
+            for i, (clave, capacidad, periodo) in enumerate(buckets):
+                tokens, ultimo = estados.get(clave, (capacidad, ahora))
+                tokens = rellenar(tokens, ultimo, capacidad, periodo, ahora)
+                disponibles.append(tokens)
+                if tokens < 1:
+                    espera = max(espera, (1 - tokens) * periodo / capacidad)
+                    vacios.append(i)
+            if espera > 0:
+                return False, espera, vacios
+
+            # Un bucket sin uso durante dos periodos está lleno: puede caducar
+            for (clave, capacidad, periodo), tokens in zip(buckets, disponibles):
+                self.cache.set(clave, (tokens - 1, ahora), timeout=math.ceil(periodo * 2))
+            return True, 0.0, []
+
+
+class AlmacenRedis:
+    """Buckets en Redis, actualizados de forma atómica con un script Lua"""
+
+    def __init__(self, cache_redis):
+        self.cache = cache_redis
+        self._script = None
+
+    def consumir(self, buckets, ahora):
+        if self._script is None:
+            cliente = self.cache._cache.get_client(write=True)
+            self._script = cliente.register_script(SCRIPT_LUA)
+
+        argumentos = [ahora]
+        for _, capacidad, periodo in buckets:
+            argumentos += [capacidad, periodo]
+        permitido, espera, vacios = self._script(
+            keys=[self.cache.make_key(clave) for clave, _, _ in buckets], args=argumentos
+        )
+        return bool(int(permitido)), float(espera), [int(i) for i in vacios]
+
+
+class MetricasLimites:
+    """Peticiones permitidas y rechazadas por clase de endpoint y ámbito, seguras entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def registrar(self, clase, permitido, ambitos=()):
+        with self._lock:
+            datos = self._clases.setdefault(clase, {'permitidas': 0, 'rechazadas': 0})
+            datos['permitidas' if permitido else 'rechazadas'] += 1
+            for ambito in ambitos:
+                datos[f'rechazadas_{ambito}'] = datos.get(f'rechazadas_{ambito}', 0) + 1
+
+    def resumen(self):
+        with self._lock:
+            return {clase: dict(datos) for clase, datos in self._clases.items()}
+
+    def reiniciar(self):
+        self._clases = {}
+
+
+class LimitadorPeticiones:
+    """Aplica los límites de LIMITES_PETICIONES a una petición"""
+
+    def __init__(self, reloj=time.time):
+        self.reloj = reloj
+        cache = caches['default']
+        self.almacen = AlmacenRedis(cache) if isinstance(cache, RedisCache) else AlmacenLocal(cache)
+        self.metricas = MetricasLimites()
+
+    def buckets(self, clase, user_id, ip):
+        limites = settings.LIMITES_PETICIONES[clase]
+        identificadores = {'usuario': user_id, 'ip': ip, 'global': ''}
+        return [
+            (f'limite:{clase}:{ambito}:{identificadores[ambito]}', capacidad, periodo, ambito)
+            for ambito, (capacidad, periodo) in limites.items()
+            if ambito == 'global' or identificadores[ambito]
+        ]
+
+    def consumir(self, clase, user_id=None, ip=None):
+        """
+        Returns:
+            (permitido, espera): espera en segundos si la petición se rechaza
+        """
+        if not settings.LIMITES_PETICIONES_ACTIVOS:
+            return True, 0.0
+
+        buckets = self.buckets(clase, user_id, ip)
+        permitido, espera, vacios = self.almacen.consumir([bucket[:3] for bucket in buckets], self.reloj())
+        # Ámbitos que motivaron el rechazo
+        self.metricas.registrar(clase, permitido, [buckets[i][3] for i in vacios])
+        return permitido, espera
+
+
+limitador = LimitadorPeticiones()
+
+
+def retry_after(espera):
+    """Valor de la cabecera Retry-After (segundos enteros, al menos 1)"""
+    return max(1, math.ceil(espera))
+
+
+def ip_cliente(request):
+    """IP del cliente según NUM_PROXIES de DRF (X-Forwarded-For o REMOTE_ADDR)"""
+    return BaseThrottle().get_ident(request)
+
+
+class LimiteTokenBucket(BaseThrottle):
+    """Throttle de DRF respaldado por `limitador`; responde 429 con Retry-After"""
+    clase = None
+
+    def allow_request(self, request, view):
+        user_id = request.user.id if request.user and request.user.is_authenticated else None
+        permitido, self.espera = limitador.consumir(self.clase, user_id, ip_cliente(request))
+        return permitido
+
+    def wait(self):
+        return retry_after(self.espera)
+
+
+class LimiteTiradas(LimiteTokenBucket):
+    clase = 'tiradas'
+
+
+class LimiteCompras(LimiteTokenBucket):
+    clase = 'compras'
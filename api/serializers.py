@@ -1,16 +1,37 @@
 from rest_framework import serializers
 from .models import (
-    UserProfile, Hechizo, Pocion, CompraHechizo, CompraPocion, CustomUser,
+    UserProfile, GemTransaction, Hechizo, Pocion, CompraHechizo, CompraPocion, CustomUser,
     CartaTarot, TipoTirada, TiradaRealizada, CartaEnTirada, PayPalPayment, PayPalSubscription
 )
+from .ledger import saldo_perfil, tiradas_usadas
+from .tarot_deck import obtener_carta
 from django.contrib.auth.password_validation import validate_password
 from rest_framework.validators import UniqueValidator
 
 class UserProfileSerializer(serializers.ModelSerializer):
+    # Saldo materializado más los créditos aún no compactados
+    gemas = serializers.SerializerMethodField()
+    # Contadores del periodo vigente (cero si son de un periodo anterior)
+    tiradas_basicas_usadas = serializers.SerializerMethodField()
+    tiradas_claridad_usadas = serializers.SerializerMethodField()
+    tiradas_profundas_usadas = serializers.SerializerMethodField()
+
     class Meta:
         model = UserProfile
         fields = ['user', 'gemas', 'tiene_suscripcion', 'tiradas_basicas_usadas', 'tiradas_claridad_usadas', 'tiradas_profundas_usadas']
 
+    def get_gemas(self, obj):
+        return saldo_perfil(obj)
+
+    def get_tiradas_basicas_usadas(self, obj):
+        return tiradas_usadas(obj, 'basica')
+
+    def get_tiradas_claridad_usadas(self, obj):
+        return tiradas_usadas(obj, 'claridad')
+
+    def get_tiradas_profundas_usadas(self, obj):
+        return tiradas_usadas(obj, 'profunda')
+
 class HechizoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Hechizo
@@ -32,6 +53,11 @@ class CompraPocionSerializer(serializers.ModelSerializer):
         model = CompraPocion
         fields = ['id', 'pocion', 'fecha_compra']
 
+class GemTransactionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GemTransaction
+        fields = ['id', 'amount', 'reason', 'reference', 'created_at']
+
 class UserSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(
         required=True,
@@ -77,18 +103,30 @@ class TipoTiradaSerializer(serializers.ModelSerializer):
         fields = ['id', 'nombre', 'tipo', 'num_cartas', 'descripcion', 'costo_gemas', 'limite_mensual', 'layout_descripcion']
 
 class CartaEnTiradaSerializer(serializers.ModelSerializer):
-    carta_nombre = serializers.CharField(source='carta.nombre', read_only=True)
-    carta_imagen = serializers.CharField(source='carta.imagen_nombre', read_only=True)
+    # Los datos de la carta salen del mazo en memoria, sin consultar CartaTarot
+    carta_nombre = serializers.SerializerMethodField()
+    carta_imagen = serializers.SerializerMethodField()
     significado = serializers.SerializerMethodField()
     
     class Meta:
         model = CartaEnTirada
         fields = ['id', 'carta', 'carta_nombre', 'carta_imagen', 'posicion', 'invertida', 'significado']
     
+    def carta(self, obj):
+        # Una carta creada en otro proceso puede no estar aún en este mazo
+        return obtener_carta(obj.carta_id) or obj.carta
+    
+    def get_carta_nombre(self, obj):
+        return self.carta(obj).nombre
+    
+    def get_carta_imagen(self, obj):
+        return self.carta(obj).imagen_nombre
+    
     def get_significado(self, obj):
+        carta = self.carta(obj)
         if obj.invertida:
-            return obj.carta.significado_invertido
-        return obj.carta.significado_normal
+            return carta.significado_invertido
+        return carta.significado_normal
 
 class TiradaRealizadaSerializer(serializers.ModelSerializer):
     cartas = CartaEnTiradaSerializer(many=True, read_only=True)
@@ -96,12 +134,38 @@ class TiradaRealizadaSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = TiradaRealizada
-        fields = ['id', 'user', 'tipo_tirada', 'tipo_tirada_nombre', 'fecha', 'pregunta', 'interpretacion', 'cartas']
+        fields = ['id', 'user', 'tipo_tirada', 'tipo_tirada_nombre', 'fecha', 'pregunta', 'interpretacion', 'estado', 'cartas']
+
+class HistorialTiradaSerializer(TiradaRealizadaSerializer):
+    """
+    Proyección del historial: por defecto solo el resumen de cada tirada.
+    `campos` añade los detalles pedidos (interpretacion, cartas).
+    """
+    CAMPOS_RESUMEN = ('id', 'tipo_tirada', 'tipo_tirada_nombre', 'fecha', 'pregunta', 'estado')
+    CAMPOS_DETALLE = ('interpretacion', 'cartas')
+
+    def __init__(self, *args, campos=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        visibles = set(self.CAMPOS_RESUMEN) | set(campos)
+        for nombre in list(self.fields):
+            if nombre not in visibles:
+                self.fields.pop(nombre)
 
 # Serializer para crear una nueva tirada
 class CrearTiradaSerializer(serializers.Serializer):
     tipo_tirada = serializers.PrimaryKeyRelatedField(queryset=TipoTirada.objects.all())
     pregunta = serializers.CharField(required=True)
+    asincrona = serializers.BooleanField(required=False, default=False)
+    # False fuerza una interpretación nueva aunque exista una equivalente en caché
+    usar_cache = serializers.BooleanField(required=False, default=True)
+
+class ItemCarritoSerializer(serializers.Serializer):
+    tipo = serializers.ChoiceField(choices=['hechizo', 'pocion'])
+    id = serializers.IntegerField(min_value=1)
+
+# Serializer para comprar varios hechizos y pociones a la vez
+class CheckoutSerializer(serializers.Serializer):
+    items = ItemCarritoSerializer(many=True, allow_empty=False, max_length=50)
 
 class PayPalPaymentSerializer(serializers.ModelSerializer):
     class Meta:
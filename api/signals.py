@@ -1,8 +1,37 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import CustomUser, UserProfile
+from .catalog import invalidar_catalogo
+from .models import CustomUser, UserProfile, CartaTarot, Hechizo, Pocion, TipoTirada
+from .profile_cache import invalidar
+from .tarot_deck import invalidar_mazo
 
 @receiver(post_save, sender=CustomUser)
 def crear_perfil_usuario(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidar_perfil_cacheado(sender, instance, **kwargs):
+    invalidar(instance.user_id)
+
+@receiver(post_save, sender=CartaTarot)
+@receiver(post_delete, sender=CartaTarot)
+def invalidar_mazo_tarot(sender, instance, **kwargs):
+    invalidar_mazo()
+    invalidar_catalogo('cartas')
+
+@receiver(post_save, sender=Hechizo)
+@receiver(post_delete, sender=Hechizo)
+def invalidar_catalogo_hechizos(sender, instance, **kwargs):
+    invalidar_catalogo('hechizos')
+
+@receiver(post_save, sender=Pocion)
+@receiver(post_delete, sender=Pocion)
+def invalidar_catalogo_pociones(sender, instance, **kwargs):
+    invalidar_catalogo('pociones')
+
+@receiver(post_save, sender=TipoTirada)
+@receiver(post_delete, sender=TipoTirada)
+def invalidar_catalogo_tipos_tirada(sender, instance, **kwargs):
+    invalidar_catalogo('tipos_tirada')
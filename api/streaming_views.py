@@ -0,0 +1,285 @@
+"""
+Streaming views for TarotNautica
+
+Vistas asíncronas de las tiradas; deben servirse con el servidor ASGI
+(core/asgi.py) para no ocupar un worker mientras esperan:
+
+- realizar_tirada_stream: variante de realizar_tirada que envía la
+  interpretación como Server-Sent Events a medida que la Messages API la genera.
+- obtener_tirada: estado de una tirada asíncrona, con long-poll opcional.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from . import interpretation_cache, llm_guard, prompt_builder, rate_limit
+from .authentication import JWTClaimsAuthentication
+from .models import TiradaRealizada
+from .serializers import CrearTiradaSerializer, TiradaRealizadaSerializer
+from .tirada_service import registrar_tirada
+from .interpretation_backends import construir_solicitud_interpretacion, generar_interpretacion_fallback
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorAnthropic(ValueError):
+    """Respuesta o evento de error de la Messages API"""
+
+    def __init__(self, mensaje, degradada=True):
+        super().__init__(mensaje)
+        # Solo los 5xx, los 429 y los eventos de error indican una API degradada (ver llm_guard.es_error)
+        self.degradada = degradada
+
+
+def evento_sse(evento, datos):
+    """Formatea un evento SSE con datos JSON"""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+async def stream_interpretacion(solicitud, tirada_id=None):
+    """
+    Llama a la Messages API en modo streaming y produce los fragmentos de texto
+
+    Args:
+        solicitud: Cuerpo generado por construir_solicitud_interpretacion
+        tirada_id: Tirada a la que se atribuye el uso de tokens en las métricas
+    """
+    api_key = os.environ.get('ANTHROPIC_API_KEY')
+    if not api_key:
+        raise ValueError("API key no encontrada en variables de entorno")
+
+    headers = {
+        "x-api-key": api_key,
+        "content-type": "application/json",
+        "anthropic-version": "2023-06-01"
+    }
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        async with client.stream(
+            'POST',
+            f"{settings.ANTHROPIC_API_URL}/v1/messages",
+            headers=headers,
+            json={**solicitud, "stream": True}
+        ) as response:
+            if response.status_code != 200:
+                cuerpo = await response.aread()
+                raise ErrorAnthropic(
+                    f"Error API Anthropic: {response.status_code} - {cuerpo.decode(errors='replace')}",
+                    degradada=llm_guard.es_error(response)
+                )
+
+            async for linea in response.aiter_lines():
+                if not linea.startswith('data:'):
+                    continue
+
+                evento = json.loads(linea[5:].strip())
+                tipo = evento.get('type')
+                if tipo == 'message_start':
+                    prompt_builder.metricas.registrar_uso(evento.get('message', {}).get('usage', {}), tirada_id)
+                elif tipo == 'content_block_delta' and evento['delta'].get('type') == 'text_delta':
+                    yield evento['delta']['text']
+                elif tipo == 'error':
+                    raise ErrorAnthropic(f"Error API Anthropic: {evento.get('error')}")
+                elif tipo == 'message_stop':
+                    break
+
+
+async def eventos_tirada(tirada, cartas_en_tirada, datos_tirada, solicitud, mensaje, costo,
+                         interpretacion_cacheada=None):
+    """
+    Genera los eventos SSE de una tirada: primero las cartas, luego los fragmentos
+    de la interpretación y finalmente 'fin' cuando el texto completo quedó guardado.
+    Si el stream se corta después de enviar fragmentos, el texto parcial se descarta,
+    se envía 'error' y la tirada vuelve a la cola de interpretaciones.
+    """
+    completada = False
+    interrumpida = False
+    try:
+        yield evento_sse('tirada', {
+            "mensaje": mensaje,
+            "costo_gemas": costo,
+            "tirada": datos_tirada
+        })
+
+        if interpretacion_cacheada:
+            interpretacion = interpretacion_cacheada
+            yield evento_sse('delta', {"texto": interpretacion})
+        else:
+            fragmentos = []
+            # Con el circuito abierto se va directamente al respaldo. El stream no
+            # ocupa un worker, así que no pasa por el limitador de concurrencia.
+            if await sync_to_async(llm_guard.breaker.permitir)():
+                inicio = time.monotonic()
+                # La latencia que cuenta es la del primer fragmento, no la del stream completo
+                latencia = None
+                # Solo cuentan para el circuito las respuestas de la API, los timeouts y
+                # los fallos de red. None: la llamada no terminó (el cliente cerró la
+                # conexión, se canceló la tarea) o falló antes de llegar a la API.
+                error = None
+                try:
+                    async for texto in stream_interpretacion(solicitud, tirada.id):
+                        if latencia is None:
+                            latencia = time.monotonic() - inicio
+                        fragmentos.append(texto)
+                        yield evento_sse('delta', {"texto": texto})
+                    error = False
+                    interpretacion = "".join(fragmentos)
+                    if interpretacion:
+                        await sync_to_async(interpretation_cache.guardar_interpretacion)(
+                            tirada, cartas_en_tirada, interpretacion
+                        )
+                except (ErrorAnthropic, httpx.HTTPError) as e:
+                    logger.error(f"Error en stream de interpretación: {str(e)}")
+                    error = getattr(e, 'degradada', True)
+                    interrumpida = bool(fragmentos)
+                    interpretacion = ""
+                except Exception as e:
+                    logger.error(f"Error en stream de interpretación: {str(e)}")
+                    interrumpida = bool(fragmentos)
+                    interpretacion = ""
+                finally:
+                    if error is None:
+                        # Si era la sonda del semiabierto, que la haga otra llamada
+                        await sync_to_async(llm_guard.breaker.liberar_sonda)()
+                    else:
+                        if latencia is None:
+                            latencia = time.monotonic() - inicio
+                        await sync_to_async(llm_guard.breaker.registrar)(latencia, error=error)
+            else:
+                interpretacion = ""
+
+        if interrumpida:
+            # El cliente ya mostró parte del texto: no se completa con el respaldo
+            yield evento_sse('error', {
+                "tirada_id": tirada.id,
+                "mensaje": "La interpretación se interrumpió, estará disponible en unos minutos"
+            })
+            return
+
+        if not interpretacion:
+            interpretacion = generar_interpretacion_fallback(tirada)
+            yield evento_sse('delta', {"texto": interpretacion})
+
+        await TiradaRealizada.objects.filter(id=tirada.id).aupdate(
+            interpretacion=interpretacion,
+            estado='completada'
+        )
+        completada = True
+        yield evento_sse('fin', {"tirada_id": tirada.id})
+    finally:
+        if not completada:
+            # El cliente cerró la conexión o el stream se cortó: la cola de
+            # interpretaciones terminará la tirada
+            await TiradaRealizada.objects.filter(
+                id=tirada.id, estado='procesando'
+            ).aupdate(estado='pendiente', reclamada=None)
+
+
+def autenticar(request):
+    """Retorna el usuario del token JWT o una JsonResponse 401"""
+    try:
+        autenticacion = JWTClaimsAuthentication().authenticate(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({"detail": e.detail}, status=401)
+
+    if autenticacion is None:
+        return JsonResponse({"detail": "Las credenciales de autenticación no se proveyeron."}, status=401)
+    return autenticacion[0]
+
+
+def preparar_tirada_stream(request, datos):
+    """
+    Autentica, valida y registra la tirada antes de abrir el stream.
+
+    Retorna una JsonResponse de error o la tupla de argumentos de eventos_tirada
+    """
+    user = autenticar(request)
+    if isinstance(user, JsonResponse):
+        return user
+
+    permitido, espera = rate_limit.limitador.consumir('tiradas', user.id, rate_limit.ip_cliente(request))
+    if not permitido:
+        response = JsonResponse({"detail": "Demasiadas peticiones. Inténtalo más tarde."}, status=429)
+        response['Retry-After'] = str(rate_limit.retry_after(espera))
+        return response
+
+    serializer = CrearTiradaSerializer(data=datos)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+
+    tipo_tirada = serializer.validated_data['tipo_tirada']
+    pregunta = serializer.validated_data['pregunta']
+
+    tirada, cartas_en_tirada, mensaje, costo = registrar_tirada(user, tipo_tirada, pregunta, estado='procesando')
+    if tirada is None:
+        return JsonResponse({"error": mensaje}, status=400)
+
+    interpretacion_cacheada = None
+    if serializer.validated_data['usar_cache']:
+        interpretacion_cacheada = interpretation_cache.obtener_interpretacion_cacheada(tirada, cartas_en_tirada)
+
+    datos_tirada = TiradaRealizadaSerializer(tirada).data
+    solicitud = construir_solicitud_interpretacion(tirada, cartas_en_tirada)
+    return tirada, cartas_en_tirada, datos_tirada, solicitud, mensaje, costo, interpretacion_cacheada
+
+
+@csrf_exempt
+@require_POST
+async def realizar_tirada_stream(request):
+    """Realizar una tirada y recibir la interpretación como Server-Sent Events"""
+    try:
+        datos = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({"error": "JSON inválido"}, status=400)
+
+    resultado = await sync_to_async(preparar_tirada_stream)(request, datos)
+    if isinstance(resultado, JsonResponse):
+        return resultado
+
+    response = StreamingHttpResponse(eventos_tirada(*resultado), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def datos_tirada_completa(tirada_id):
+    tirada = TiradaRealizada.objects.select_related('tipo_tirada').prefetch_related('cartas').get(id=tirada_id)
+    return tirada.estado, TiradaRealizadaSerializer(tirada).data
+
+
+@require_GET
+async def obtener_tirada(request, tirada_id):
+    """
+    Consultar el estado de una tirada asíncrona.
+    Con ?esperar=N espera hasta N segundos (long-poll) a que la interpretación esté lista.
+    """
+    user = await sync_to_async(autenticar)(request)
+    if isinstance(user, JsonResponse):
+        return user
+
+    try:
+        esperar = float(request.GET.get('esperar', 0))
+    except ValueError:
+        return JsonResponse({"error": "Parámetro esperar inválido"}, status=400)
+    esperar = max(0, min(esperar, settings.TIRADA_LONG_POLL_MAX_SEGUNDOS))
+
+    estados = TiradaRealizada.objects.filter(id=tirada_id, user_id=user.id).values_list('estado', flat=True)
+    estado = await estados.afirst()
+    if estado is None:
+        return JsonResponse({"error": "Tirada no encontrada"}, status=404)
+
+    limite = time.monotonic() + esperar
+    while estado != 'completada' and time.monotonic() < limite:
+        await asyncio.sleep(settings.TIRADA_LONG_POLL_INTERVALO)
+        estado = await estados.afirst()
+
+    estado, datos = await sync_to_async(datos_tirada_completa)(tirada_id)
+    return JsonResponse({"estado": estado, "tirada": datos}, status=200 if estado == 'completada' else 202)
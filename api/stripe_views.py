@@ -1,16 +1,25 @@
+import json
 import stripe
 from django.conf import settings
 from django.http import JsonResponse
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from .models import StripeCustomer, StripeSubscription, StripePayment, UserProfile
+from .models import StripeCustomer, StripeSubscription, StripePayment
+from . import http_client, ledger, webhook_inbox
+from .rate_limit import LimiteCompras
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
+# Las llamadas del SDK de Stripe reutilizan los pools keep-alive compartidos
+stripe.default_http_client = stripe.RequestsClient(
+    timeout=settings.HTTP_TIMEOUT,
+    session=http_client.obtener_sesion()
+)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LimiteCompras])
 def create_payment_intent(request):
     try:
         # Obtener el tipo de compra y cantidad
@@ -71,6 +80,7 @@ def create_payment_intent(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LimiteCompras])
 def create_subscription(request):
     try:
         # Crear o obtener el cliente de Stripe
@@ -165,47 +175,47 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError as e:
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
-    if event['type'] == 'payment_intent.succeeded':
-        payment_intent = event['data']['object']
-        handle_successful_payment(payment_intent)
-    elif event['type'] == 'invoice.paid':
-        invoice = event['data']['object']
-        handle_successful_subscription(invoice)
-    elif event['type'] == 'customer.subscription.deleted':
-        subscription = event['data']['object']
-        handle_subscription_cancelled(subscription)
-
+    # Se guarda una sola vez por id de evento; el worker lo aplica después
+    webhook_inbox.registrar_evento('stripe', event['id'], event['type'], json.loads(payload))
     return Response(status=status.HTTP_200_OK)
 
+def procesar_evento_stripe(event_type, event):
+    """Aplica un evento de Stripe guardado en la bandeja de webhooks"""
+    objeto = event['data']['object']
+    if event_type == 'payment_intent.succeeded':
+        handle_successful_payment(objeto)
+    elif event_type == 'invoice.paid':
+        handle_successful_subscription(objeto)
+    elif event_type == 'customer.subscription.deleted':
+        handle_subscription_cancelled(objeto)
+
 def handle_successful_payment(payment_intent):
     try:
         payment = StripePayment.objects.get(
-            stripe_payment_intent_id=payment_intent.id
+            stripe_payment_intent_id=payment_intent['id']
         )
         payment.status = 'completed'
         payment.save()
 
         if payment.payment_type == 'gems':
-            profile = UserProfile.objects.get(user=payment.user)
-            profile.gemas += payment.gems_amount
-            profile.save()
+            ledger.acreditar_gemas(
+                payment.user_id, payment.gems_amount, 'compra_gemas', payment.stripe_payment_intent_id
+            )
 
     except StripePayment.DoesNotExist:
         pass
 
 def handle_successful_subscription(invoice):
     try:
-        subscription_id = invoice.subscription
+        subscription_id = invoice['subscription']
         subscription = StripeSubscription.objects.get(
             stripe_subscription_id=subscription_id
         )
         subscription.status = 'active'
         subscription.save()
 
-        profile = UserProfile.objects.get(user=subscription.user)
-        profile.tiene_suscripcion = True
-        profile.gemas += 30  # Bonus de gemas por suscripción
-        profile.save()
+        # Bonus de gemas por suscripción en cada factura pagada
+        ledger.renovar_suscripcion(subscription.user_id, invoice['id'])
 
     except StripeSubscription.DoesNotExist:
         pass
@@ -213,14 +223,12 @@ def handle_successful_subscription(invoice):
 def handle_subscription_cancelled(subscription_data):
     try:
         subscription = StripeSubscription.objects.get(
-            stripe_subscription_id=subscription_data.id
+            stripe_subscription_id=subscription_data['id']
         )
         subscription.status = 'canceled'
         subscription.save()
 
-        profile = UserProfile.objects.get(user=subscription.user)
-        profile.tiene_suscripcion = False
-        profile.save()
+        ledger.cancelar_suscripcion(subscription.user_id)
 
     except StripeSubscription.DoesNotExist:
         pass 
\ No newline at end of file
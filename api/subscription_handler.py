@@ -1,29 +1,23 @@
 """
 Subscription handler module for TarotNautica
 """
-from django.utils import timezone
+from .ledger import activar_suscripcion
 
 def reset_subscription_benefits(user_profile):
     """
     Reset subscription benefits when a user subscribes.
-    This resets tirada counters and adds complimentary gemas (if applicable).
+    This activates the subscription, resets tirada counters and adds complimentary gemas.
+    The update is conditional, so concurrent activations only grant the benefits once.
     
     Args:
-        user_profile: UserProfile instance to update
-    """
-    # Reset tirada counters to 0
-    user_profile.tiradas_basicas_usadas = 0
-    user_profile.tiradas_claridad_usadas = 0
-    user_profile.tiradas_profundas_usadas = 0
-    
-    # Update reset date to today
-    user_profile.fecha_reset = timezone.now().date()
+        user_profile: UserProfile instance to update (refreshed in place)
     
-    # Add complimentary gemas for new/renewed subscriptions
-    # We're adding 20 complimentary gemas for subscription
-    user_profile.gemas += 30
+    Returns:
+        bool: True if the benefits were granted (the user was not subscribed yet)
+    """
+    granted = activar_suscripcion(user_profile.user_id)
     
-    # Save the profile changes
-    user_profile.save()
+    # Reload the values written by the conditional UPDATE
+    user_profile.refresh_from_db()
     
-    return user_profile
+    return granted
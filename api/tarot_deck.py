@@ -0,0 +1,79 @@
+"""
+Tarot deck registry module for TarotNautica
+
+Las 22 cartas de los Arcanos Mayores son datos estáticos. En lugar de
+consultarlas en cada tirada se mantienen en memoria como registros inmutables
+y compactos (tupla de CartaRegistro) junto con una versión.
+
+Las señales post_save/post_delete de CartaTarot incrementan la versión en la
+caché por defecto; cada proceso compara su versión local en cada acceso y
+recarga el mazo solo cuando cambió. Con una caché compartida (CACHE_URL, ver
+core/settings.py) el cambio llega a todos los procesos; con la LocMemCache de
+cada proceso solo al que lo hizo, y los demás necesitan reiniciarse.
+"""
+import threading
+import time
+from collections import namedtuple
+from django.core.cache import cache
+
+VERSION_CACHE_KEY = 'mazo_tarot_version'
+
+CartaRegistro = namedtuple('CartaRegistro', [
+    'id', 'nombre', 'numero', 'imagen_nombre', 'significado_normal', 'significado_invertido'
+])
+
+
+class Mazo:
+    """Instantánea inmutable del mazo en una versión concreta"""
+    __slots__ = ('version', 'cartas', 'por_id')
+
+    def __init__(self, version, cartas):
+        self.version = version
+        self.cartas = tuple(cartas)
+        self.por_id = {carta.id: carta for carta in self.cartas}
+
+
+_mazo = None
+_lock = threading.Lock()
+
+
+def version_actual():
+    """Versión vigente del mazo en la caché por defecto"""
+    # Si la caché descarta el contador, el nuevo arranca por encima de las versiones ya usadas
+    return cache.get_or_set(VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+
+
+def cargar_mazo(version):
+    from .models import CartaTarot
+
+    filas = CartaTarot.objects.order_by('numero').values_list(*CartaRegistro._fields)
+    return Mazo(version, (CartaRegistro(*fila) for fila in filas))
+
+
+def obtener_mazo():
+    """Devuelve el mazo vigente, recargándolo solo si su versión cambió"""
+    global _mazo
+    version = version_actual()
+    mazo = _mazo
+    if mazo is not None and mazo.version == version:
+        return mazo
+
+    with _lock:
+        if _mazo is None or _mazo.version != version:
+            _mazo = cargar_mazo(version)
+        return _mazo
+
+
+def obtener_carta(carta_id):
+    """Registro de una carta por id, o None si no existe"""
+    return obtener_mazo().por_id.get(carta_id)
+
+
+def invalidar_mazo():
+    """Marca el mazo como obsoleto en los procesos que comparten la caché"""
+    global _mazo
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+    _mazo = None
@@ -1,3 +1,1663 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import NameOID
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from . import (
+    catalog, catalog_sync, checkout_service, http_client, interpretation_cache, interpretation_queue, ledger,
+    llm_guard, owned_items, paypal_signature, paypal_token, profile_cache, prompt_builder, rate_limit, webhook_inbox
+)
+from .authentication import JWTClaimsAuthentication
+from .custom_token import CustomTokenObtainPairSerializer
+from .interpretation_backends import obtener_backend
+from .models import (
+    CustomUser, CartaTarot, CartaEnTirada, CompraHechizo, CompraPocion, GemTransaction, Hechizo,
+    LoteInterpretacion, PayPalSubscription, Pocion, StripePayment, StripeSubscription, TipoTirada,
+    TiradaRealizada, UserProfile, WebhookEvent
+)
+from .owned_items import clave_poseidos, codificar, decodificar
+from .serializers import CartaEnTiradaSerializer
+from .tarot_deck import VERSION_CACHE_KEY, obtener_carta, obtener_mazo
+from .streaming_views import eventos_tirada, preparar_tirada_stream
+from .views import obtener_interpretacion_tirada
 
-# Create your tests here.
+
+def crear_mazo(num_cartas=22):
+    for numero in range(num_cartas):
+        CartaTarot.objects.create(
+            nombre=f"Carta {numero}",
+            numero=numero,
+            imagen_nombre=f"carta_{numero}.jpg",
+            significado_normal=f"Significado normal {numero}",
+            significado_invertido=f"Significado invertido {numero}"
+        )
+
+
+class FakeAnthropicSSEHandler(BaseHTTPRequestHandler):
+    """Servidor local que imita el modo streaming de la Messages API"""
+    fragmentos = ["Las cartas ", "hablan ", "de cambio."]
+    error = None
+
+    def do_POST(self):
+        longitud = int(self.headers.get('Content-Length', 0))
+        self.server.solicitudes.append(json.loads(self.rfile.read(longitud)))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+
+        eventos = [('message_start', {"type": "message_start"})]
+        for texto in self.fragmentos:
+            eventos.append(('content_block_delta', {
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": texto}
+            }))
+        if self.error:
+            eventos.append(('error', {"type": "error", "error": self.error}))
+        eventos.append(('message_stop', {"type": "message_stop"}))
+
+        for evento, datos in eventos:
+            self.wfile.write(f"event: {evento}\ndata: {json.dumps(datos)}\n\n".encode())
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+class RealizarTiradaStreamTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = ThreadingHTTPServer(('127.0.0.1', 0), FakeAnthropicSSEHandler)
+        cls.servidor.solicitudes = []
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        crear_mazo()
+        self.tipo_tirada = TipoTirada.objects.create(
+            nombre="Tirada Básica", tipo="basica", num_cartas=3,
+            descripcion="", costo_gemas=3, layout_descripcion=""
+        )
+        self.user = CustomUser.objects.create_user(email="stream@test.com", password="clave-segura-123")
+        self.user.profile.gemas = 10
+        self.user.profile.save()
+        self.token = str(AccessToken.for_user(self.user))
+
+    async def test_stream_envia_fragmentos_y_guarda_interpretacion(self):
+        url_fake = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+        with override_settings(ANTHROPIC_API_URL=url_fake), \
+                mock.patch.dict('os.environ', {'ANTHROPIC_API_KEY': 'test-key'}):
+            response = await self.async_client.post(
+                '/api/realizar-tirada/stream/',
+                {'tipo_tirada': self.tipo_tirada.id, 'pregunta': '¿Me ama?'},
+                content_type='application/json',
+                headers={'Authorization': f'Bearer {self.token}'}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            cuerpo = b"".join([chunk async for chunk in response.streaming_content]).decode()
+
+        eventos = [bloque.split("\n") for bloque in cuerpo.strip().split("\n\n")]
+        nombres = [lineas[0][len("event: "):] for lineas in eventos]
+        self.assertEqual(nombres, ['tirada', 'delta', 'delta', 'delta', 'fin'])
+
+        datos_tirada = json.loads(eventos[0][1][len("data: "):])
+        self.assertEqual(len(datos_tirada['tirada']['cartas']), 3)
+        self.assertTrue(self.servidor.solicitudes[-1]['stream'])
+
+        tirada = await TiradaRealizada.objects.aget(id=datos_tirada['tirada']['id'])
+        self.assertEqual(tirada.interpretacion, "Las cartas hablan de cambio.")
+        self.assertEqual(tirada.estado, 'completada')
+
+    async def abrir_stream(self):
+        request = RequestFactory().post('/api/realizar-tirada/stream/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        argumentos = await sync_to_async(preparar_tirada_stream)(
+            request, {'tipo_tirada': self.tipo_tirada.id, 'pregunta': '¿Me ama?'}
+        )
+        return argumentos[0], eventos_tirada(*argumentos)
+
+    async def test_solo_los_fallos_de_la_api_cuentan_para_el_circuito(self):
+        url_fake = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+        with override_settings(ANTHROPIC_API_URL=url_fake), \
+                mock.patch.dict('os.environ', {'ANTHROPIC_API_KEY': 'test-key'}), \
+                mock.patch.object(llm_guard.breaker, 'registrar') as registrar, \
+                mock.patch.object(llm_guard.breaker, 'liberar_sonda') as liberar_sonda:
+            # El cliente cierra la conexión tras el primer fragmento
+            tirada, eventos = await self.abrir_stream()
+            await anext(eventos)
+            await anext(eventos)
+            await eventos.aclose()
+            registrar.assert_not_called()
+            liberar_sonda.assert_called_once()
+            self.assertEqual((await TiradaRealizada.objects.aget(id=tirada.id)).estado, 'pendiente')
+
+            # La API no responde: cuenta como error
+            with override_settings(ANTHROPIC_API_URL='http://127.0.0.1:1'):
+                _, eventos = await self.abrir_stream()
+                self.assertIn('event: fin', "".join([evento async for evento in eventos]))
+            registrar.assert_called_once()
+            self.assertTrue(registrar.call_args.kwargs['error'])
+
+    async def test_stream_cortado_no_guarda_el_texto_parcial(self):
+        url_fake = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+        with override_settings(ANTHROPIC_API_URL=url_fake), \
+                mock.patch.dict('os.environ', {'ANTHROPIC_API_KEY': 'test-key'}), \
+                mock.patch.object(FakeAnthropicSSEHandler, 'error', {"type": "overloaded_error"}), \
+                mock.patch.object(llm_guard.breaker, 'registrar'):
+            tirada, eventos = await self.abrir_stream()
+            cuerpo = "".join([evento async for evento in eventos])
+
+        self.assertIn('event: error', cuerpo)
+        self.assertNotIn('event: fin', cuerpo)
+        tirada = await TiradaRealizada.objects.aget(id=tirada.id)
+        self.assertEqual(tirada.estado, 'pendiente')
+        self.assertIsNone(tirada.reclamada)
+        self.assertEqual(tirada.interpretacion, "")
+
+    async def test_stream_requiere_autenticacion(self):
+        response = await self.async_client.post(
+            '/api/realizar-tirada/stream/',
+            {'tipo_tirada': self.tipo_tirada.id, 'pregunta': '¿Me ama?'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class FakeKeepAliveHandler(BaseHTTPRequestHandler):
+    """Servidor HTTP/1.1 que mantiene la conexión abierta y anota el puerto de cada cliente"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.clientes.append(self.client_address[1])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+class ClienteHTTPTests(TestCase):
+    """Las llamadas salientes comparten una sesión y reutilizan las conexiones keep-alive"""
+
+    def setUp(self):
+        self.servidor = ThreadingHTTPServer(('127.0.0.1', 0), FakeKeepAliveHandler)
+        self.servidor.clientes = []
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        self.addCleanup(self.servidor.server_close)
+        self.addCleanup(self.servidor.shutdown)
+
+    def test_sesion_compartida_y_conexion_reutilizada(self):
+        self.assertIs(http_client.obtener_sesion(), http_client.obtener_sesion())
+
+        url = f"http://127.0.0.1:{self.servidor.server_address[1]}/"
+        for _ in range(3):
+            self.assertEqual(http_client.get(url).status_code, 200)
+
+        # Las tres peticiones llegaron por la misma conexión TCP
+        self.assertEqual(len(self.servidor.clientes), 3)
+        self.assertEqual(len(set(self.servidor.clientes)), 1)
+
+
+class MazoTarotTests(TestCase):
+    """El mazo en memoria solo se recarga cuando cambia su versión"""
+
+    def setUp(self):
+        cache.clear()
+        crear_mazo()
+
+    def test_recarga_al_guardar_una_carta(self):
+        mazo = obtener_mazo()
+        with self.assertNumQueries(0):
+            self.assertIs(obtener_mazo(), mazo)
+
+        carta = CartaTarot.objects.get(numero=0)
+        carta.nombre = "El Loco"
+        carta.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(obtener_carta(carta.id).nombre, "El Loco")
+        self.assertGreater(obtener_mazo().version, mazo.version)
+
+    def test_carta_creada_tras_cargar_el_mazo(self):
+        obtener_mazo()
+        # bulk_create no envía post_save: el mazo en memoria no se entera
+        carta, = CartaTarot.objects.bulk_create([CartaTarot(
+            nombre="El Mundo", numero=22, imagen_nombre="mundo.jpg",
+            significado_normal="Plenitud", significado_invertido="Estancamiento"
+        )])
+        self.assertIsNone(obtener_carta(carta.id))
+
+        user = CustomUser.objects.create_user(email="mazo@test.com", password="clave-segura-123")
+        tipo_tirada = TipoTirada.objects.create(
+            nombre="Tirada Básica", tipo="basica", num_cartas=1,
+            descripcion="", costo_gemas=1, layout_descripcion=""
+        )
+        tirada = TiradaRealizada.objects.create(user=user, tipo_tirada=tipo_tirada, pregunta="¿Me ama?")
+        en_tirada = CartaEnTirada.objects.create(tirada=tirada, carta_id=carta.id, posicion=1, invertida=True)
+        datos = CartaEnTiradaSerializer(en_tirada).data
+        self.assertEqual(datos['carta_nombre'], "El Mundo")
+        self.assertEqual(datos['carta_imagen'], "mundo.jpg")
+        self.assertEqual(datos['significado'], "Estancamiento")
+
+    def test_contador_perdido_no_repite_versiones(self):
+        version = obtener_mazo().version
+        cache.delete(VERSION_CACHE_KEY)
+        self.assertGreater(obtener_mazo().version, version)
+
+
+class CacheInterpretacionesTests(TestCase):
+    """Las tiradas equivalentes reutilizan la interpretación mientras no cambie el mazo"""
+
+    def setUp(self):
+        cache.clear()
+        caches[interpretation_cache.CACHE_ALIAS].clear()
+        crear_mazo()
+        tipo_tirada = TipoTirada.objects.create(
+            nombre="Tirada Básica", tipo="basica", num_cartas=3,
+            descripcion="", costo_gemas=1, layout_descripcion=""
+        )
+        user = CustomUser.objects.create_user(email="cache@test.com", password="clave-segura-123")
+        self.tirada = TiradaRealizada(user=user, tipo_tirada=tipo_tirada, pregunta="¿Me ama?")
+        self.cartas = [
+            CartaEnTirada(carta_id=carta.id, posicion=i + 1, invertida=False)
+            for i, carta in enumerate(obtener_mazo().cartas[:3])
+        ]
+
+    def test_acierto_fallo_y_version_del_mazo(self):
+        interpretation_cache.guardar_interpretacion(self.tirada, self.cartas, "Sí, te ama")
+
+        equivalente = TiradaRealizada(tipo_tirada=self.tirada.tipo_tirada, pregunta="me ama")
+        self.assertEqual(interpretation_cache.obtener_interpretacion_cacheada(equivalente, self.cartas), "Sí, te ama")
+
+        self.cartas[0].invertida = True
+        self.assertIsNone(interpretation_cache.obtener_interpretacion_cacheada(self.tirada, self.cartas))
+        self.cartas[0].invertida = False
+
+        # Editar una carta cambia la versión del mazo y con ella la clave
+        carta = CartaTarot.objects.get(numero=0)
+        carta.significado_normal = "Otro significado"
+        carta.save()
+        self.assertIsNone(interpretation_cache.obtener_interpretacion_cacheada(self.tirada, self.cartas))
+
+
+class RealizarTiradaQueryCountTests(TestCase):
+    """El número de consultas de una tirada no depende de cuántas cartas tenga"""
+
+    def setUp(self):
+        crear_mazo()
+        self.tipos = [
+            TipoTirada.objects.create(
+                nombre=nombre, tipo=tipo, num_cartas=num_cartas,
+                descripcion="", costo_gemas=1, layout_descripcion=""
+            )
+            for nombre, tipo, num_cartas in [
+                ("Tirada Básica", "basica", 3),
+                ("Tirada de Claridad", "claridad", 6),
+                ("Tirada Profunda", "profunda", 11),
+            ]
+        ]
+        self.user = CustomUser.objects.create_user(email="consultas@test.com", password="clave-segura-123")
+        self.user.profile.gemas = 100
+        self.user.profile.save()
+        self.token = str(AccessToken.for_user(self.user))
+
+    def test_consultas_por_tipo_de_tirada(self):
+        # Cargar el mazo en memoria antes de medir
+        obtener_mazo()
+
+        for tipo_tirada in self.tipos:
+            with self.subTest(tipo=tipo_tirada.tipo), mock.patch.dict('os.environ', {'ANTHROPIC_API_KEY': ''}):
+                # usuario, tipo de tirada, savepoint, perfil, cobro, movimiento de gemas,
+                # INSERT tirada, INSERT masivo de cartas, release, UPDATE interpretación
+                with self.assertNumQueries(10):
+                    response = self.client.post(
+                        '/api/realizar-tirada/',
+                        {'tipo_tirada': tipo_tirada.id, 'pregunta': '¿Qué me depara el mes?', 'usar_cache': False},
+                        content_type='application/json',
+                        HTTP_AUTHORIZATION=f'Bearer {self.token}'
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['tirada']['cartas']), tipo_tirada.num_cartas)
+
+
+@override_settings(INTERPRETACION_BACKEND='local', TIRADA_LONG_POLL_INTERVALO=0.05)
+class TiradaAsincronaTests(TestCase):
+    """Las tiradas asíncronas se completan con el worker y se consultan en tiradas/<id>/"""
+
+    def setUp(self):
+        cache.clear()
+        crear_mazo()
+        self.tipo_tirada = TipoTirada.objects.create(
+            nombre="Tirada Básica", tipo="basica", num_cartas=3,
+            descripcion="", costo_gemas=1, layout_descripcion=""
+        )
+        self.user = CustomUser.objects.create_user(email="asincrona@test.com", password="clave-segura-123")
+        ledger.acreditar_gemas(self.user.id, 10, 'ajuste')
+        self.token = str(AccessToken.for_user(self.user))
+
+    def crear(self):
+        response = self.client.post(
+            '/api/realizar-tirada/',
+            {'tipo_tirada': self.tipo_tirada.id, 'pregunta': '¿Qué me depara el mes?', 'asincrona': True},
+            content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 202)
+        return response.json()['tirada']['id']
+
+    def consultar(self, tirada_id, **params):
+        return self.client.get(f'/api/tiradas/{tirada_id}/', params, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_worker_completa_la_tirada_encolada(self):
+        tirada_id = self.crear()
+        pendiente = self.consultar(tirada_id)
+        self.assertEqual((pendiente.status_code, pendiente.json()['estado']), (202, 'pendiente'))
+
+        call_command('procesar_interpretaciones', stdout=StringIO())
+        completada = self.consultar(tirada_id)
+        self.assertEqual(completada.status_code, 200)
+        self.assertIn("¿Qué me depara el mes?", completada.json()['tirada']['interpretacion'])
+        self.assertEqual(self.client.get('/api/tiradas/999/', HTTP_AUTHORIZATION=f'Bearer {self.token}').status_code, 404)
+
+    def test_reclamo_vencido_vuelve_a_la_cola(self):
+        vencida, en_curso = self.crear(), self.crear()
+        # Un worker (o una petición síncrona) murió tras reclamar la primera; la segunda sigue en curso
+        TiradaRealizada.objects.filter(id=vencida).update(
+            estado='procesando', reclamada=timezone.now() - timedelta(seconds=settings.INTERPRETACION_RECLAMO_SEGUNDOS + 1)
+        )
+        TiradaRealizada.objects.filter(id=en_curso).update(estado='procesando', reclamada=timezone.now())
+
+        self.assertEqual(interpretation_queue.procesar_pendientes(), 1)
+        self.assertEqual(
+            dict(TiradaRealizada.objects.values_list('id', 'estado')),
+            {vencida: 'completada', en_curso: 'procesando'}
+        )
+
+    async def test_long_poll_espera_a_la_interpretacion(self):
+        tirada_id = await sync_to_async(self.crear)()
+
+        async def completar():
+            await asyncio.sleep(0.2)
+            await TiradaRealizada.objects.filter(id=tirada_id).aupdate(interpretacion="Lista", estado='completada')
+
+        response, _ = await asyncio.gather(
+            self.async_client.get(f'/api/tiradas/{tirada_id}/', {'esperar': 5}, headers={'Authorization': f'Bearer {self.token}'}),
+            completar()
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['tirada']['interpretacion'], "Lista")
+
+
+@override_settings(LIMITES_PETICIONES_ACTIVOS=False)
+class LedgerConcurrencyTests(TransactionTestCase):
+    """Peticiones simultáneas sobre un mismo perfil no pierden ni duplican gemas"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="concurrencia@test.com", password="clave-segura-123")
+        UserProfile.objects.filter(user=self.user).update(gemas=10)
+        self.token = str(AccessToken.for_user(self.user))
+
+    def post_en_paralelo(self, peticiones):
+        barrera = threading.Barrier(len(peticiones))
+
+        def enviar(peticion):
+            url, datos = peticion
+            try:
+                barrera.wait()
+                response = Client().post(
+                    url, datos, content_type='application/json',
+                    HTTP_AUTHORIZATION=f'Bearer {self.token}'
+                )
+                return url, response.status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(peticiones)) as executor:
+            return list(executor.map(enviar, peticiones))
+
+    def test_debitos_simultaneos_no_gastan_dos_veces(self):
+        resultados = self.post_en_paralelo([('/api/usar-tirada/', {'tipo': 'basica'})] * 25)
+
+        exitosos = [codigo for _, codigo in resultados if codigo == 200]
+        self.assertEqual(len(exitosos), 10)
+        self.assertEqual(ledger.saldo_gemas(self.user.id), 0)
+
+    def test_creditos_y_debitos_simultaneos_no_pierden_gemas(self):
+        peticiones = (
+            [('/api/comprar-gemas/', {'cantidad': 5})] * 10 +
+            [('/api/usar-tirada/', {'tipo': 'basica'})] * 10
+        )
+        resultados = self.post_en_paralelo(peticiones)
+
+        creditos = sum(1 for url, codigo in resultados if url == '/api/comprar-gemas/' and codigo == 200)
+        debitos = sum(1 for url, codigo in resultados if url == '/api/usar-tirada/' and codigo == 200)
+        self.assertEqual(creditos, 10)
+        self.assertEqual(ledger.saldo_gemas(self.user.id), 10 + creditos * 5 - debitos)
+
+
+class GemLedgerTests(TestCase):
+    """Los créditos se insertan pendientes y la compactación los lleva al saldo materializado"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="libro@test.com", password="clave-segura-123")
+
+    def test_creditos_pendientes_compactacion_y_reconciliacion(self):
+        ledger.acreditar_gemas(self.user.id, 5, 'compra_gemas', 'pago-1')
+        ledger.acreditar_gemas(self.user.id, 3, 'compra_gemas', 'pago-2')
+
+        # El crédito no toca el perfil pero ya cuenta en el saldo
+        self.assertEqual(UserProfile.objects.get(user=self.user).gemas, 0)
+        self.assertEqual(ledger.saldo_gemas(self.user.id), 8)
+
+        # El débito que no alcanza con el saldo materializado compacta primero
+        self.assertTrue(ledger.debitar_gemas(self.user.id, 6, 'hechizo', 1))
+        self.assertFalse(ledger.debitar_gemas(self.user.id, 6, 'hechizo', 2))
+        self.assertEqual(UserProfile.objects.get(user=self.user).gemas, 2)
+        self.assertEqual(
+            list(ledger.historial_gemas(self.user.id).values_list('amount', flat=True)),
+            [-6, 3, 5]
+        )
+        self.assertEqual(ledger.descuadres(), [])
+
+        # Un cambio directo del perfil aparece en la reconciliación y se corrige con un ajuste
+        UserProfile.objects.filter(user=self.user).update(gemas=12)
+        self.assertEqual(ledger.descuadres(), [(self.user.id, 12, 2)])
+        call_command('reconciliar_gemas', '--corregir', stdout=mock.MagicMock())
+        self.assertEqual(ledger.descuadres(), [])
+        self.assertEqual(ledger.saldo_gemas(self.user.id), 12)
+
+
+class CupoMensualTests(TestCase):
+    """Los contadores de un periodo anterior cuentan como cero sin escribir en el perfil"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="cupo@test.com", password="clave-segura-123")
+        UserProfile.objects.filter(user=self.user).update(
+            tiene_suscripcion=True, periodo_tiradas=ledger.periodo_actual() - 1,
+            tiradas_basicas_usadas=100, tiradas_claridad_usadas=7
+        )
+
+    def test_periodo_anterior_se_lee_como_cero_y_se_reinicia_al_consumir(self):
+        profile = UserProfile.objects.get(user=self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(ledger.tiradas_usadas(profile, 'basica'), 0)
+
+        self.assertTrue(ledger.consumir_tirada_incluida(self.user.id, 'basica', 100))
+        profile.refresh_from_db()
+        self.assertEqual(profile.periodo_tiradas, ledger.periodo_actual())
+        self.assertEqual(
+            (profile.tiradas_basicas_usadas, profile.tiradas_claridad_usadas, profile.tiradas_profundas_usadas),
+            (1, 0, 0)
+        )
+
+    def test_reiniciar_cupos_en_lotes(self):
+        otros = [
+            CustomUser.objects.create_user(email=f"cupo{i}@test.com", password="clave-segura-123")
+            for i in range(4)
+        ]
+        UserProfile.objects.filter(user__in=otros).update(periodo_tiradas=0, tiradas_profundas_usadas=3)
+
+        self.assertEqual(ledger.reiniciar_periodos(lote=2), 5)
+        self.assertFalse(UserProfile.objects.filter(periodo_tiradas__lt=ledger.periodo_actual()).exists())
+        self.assertFalse(UserProfile.objects.exclude(tiradas_profundas_usadas=0).exists())
+
+
+class HistorialTiradasTests(TestCase):
+    """El historial se pagina por cursor con un número fijo de consultas por página"""
+
+    def setUp(self):
+        crear_mazo()
+        self.user = CustomUser.objects.create_user(email="historial@test.com", password="clave-segura-123")
+        self.token = str(AccessToken.for_user(self.user))
+        tipo = TipoTirada.objects.create(
+            nombre="Tirada Básica", tipo="basica", num_cartas=3,
+            descripcion="", costo_gemas=1, layout_descripcion=""
+        )
+        cartas = list(CartaTarot.objects.all()[:3])
+        for i in range(25):
+            tirada = TiradaRealizada.objects.create(
+                user=self.user, tipo_tirada=tipo, pregunta=f"Pregunta {i}", interpretacion="Texto largo"
+            )
+            CartaEnTirada.objects.bulk_create([
+                CartaEnTirada(tirada=tirada, carta=carta, posicion=posicion)
+                for posicion, carta in enumerate(cartas, start=1)
+            ])
+        obtener_mazo()
+
+    def get(self, **params):
+        return self.client.get('/api/historial-tiradas/', params, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_paginas_por_cursor_sin_repetir_tiradas(self):
+        vistos = []
+        cursor = None
+        while True:
+            params = {'limite': 10, **({'cursor': cursor} if cursor else {})}
+            # usuario + página
+            with self.assertNumQueries(2):
+                datos = self.get(**params).json()
+            vistos += [tirada['id'] for tirada in datos['resultados']]
+            self.assertNotIn('interpretacion', datos['resultados'][0])
+            self.assertNotIn('cartas', datos['resultados'][0])
+            cursor = datos['siguiente']
+            if not cursor:
+                break
+
+        ids = list(TiradaRealizada.objects.order_by('-fecha', '-id').values_list('id', flat=True))
+        self.assertEqual(vistos, ids)
+
+    def test_fields_anade_detalles_con_una_consulta_mas(self):
+        # usuario + página + cartas de la página
+        with self.assertNumQueries(3):
+            datos = self.get(limite=25, fields='interpretacion,cartas').json()
+        self.assertEqual(len(datos['resultados']), 25)
+        self.assertEqual(datos['resultados'][0]['interpretacion'], "Texto largo")
+        self.assertEqual(len(datos['resultados'][0]['cartas']), 3)
+        self.assertIsNone(datos['siguiente'])
+
+        self.assertEqual(self.get(fields='usuario').status_code, 400)
+        self.assertEqual(self.get(cursor='no-es-un-cursor').status_code, 400)
+
+
+def escaneos_completos(queryset):
+    """Tablas que el plan de la consulta recorre enteras (EXPLAIN de SQLite o MySQL)"""
+    plan = queryset.explain()
+    if connection.vendor == 'mysql':
+        # Columna type = ALL
+        return [linea for linea in plan.splitlines() if re.search(r'\bALL\b', linea)]
+    # "SCAN tabla" sin "USING INDEX": recorrido completo de la tabla
+    return re.findall(r'\bSCAN (\w+)$', plan, re.MULTILINE)
+
+
+# Consultas frecuentes que deben resolverse con un índice
+CONSULTAS_FRECUENTES = {
+    'historial_tiradas': lambda user: TiradaRealizada.objects.filter(user=user).order_by('-fecha', '-id'),
+    'tiradas_pendientes': lambda user: TiradaRealizada.objects.filter(estado='pendiente', urgente=True).order_by('fecha', 'id'),
+    'tiradas_no_urgentes': lambda user: TiradaRealizada.objects.filter(estado='pendiente', urgente=False).order_by('fecha', 'id'),
+    'tiradas_a_regenerar': lambda user: TiradaRealizada.objects.filter(regenerar=True, lote__isnull=True).order_by('fecha', 'id'),
+    'lotes_en_curso': lambda user: LoteInterpretacion.objects.filter(estado='en_curso').order_by('id'),
+    'tiradas_reclamo_vencido': lambda user: TiradaRealizada.objects.filter(
+        Q(reclamada__lt=timezone.now()) | Q(reclamada__isnull=True), estado='procesando', lote__isnull=True
+    ),
+    'mis_hechizos': lambda user: CompraHechizo.objects.filter(user=user),
+    'mis_pociones': lambda user: CompraPocion.objects.filter(user=user),
+    'hechizos_por_categoria': lambda user: Hechizo.objects.filter(activo=True, categoria='amor'),
+    'hechizos_activos': lambda user: Hechizo.objects.filter(activo=True),
+    'pociones_por_categoria': lambda user: Pocion.objects.filter(activo=True, categoria='amor'),
+    'pociones_activas': lambda user: Pocion.objects.filter(activo=True),
+    'tipo_tirada': lambda user: TipoTirada.objects.filter(tipo='basica'),
+    'pago_stripe': lambda user: StripePayment.objects.filter(stripe_payment_intent_id='pi_123'),
+    'suscripcion_stripe': lambda user: StripeSubscription.objects.filter(stripe_subscription_id='sub_123'),
+    'perfil': lambda user: UserProfile.objects.filter(user=user),
+    'gemas_pendientes': lambda user: GemTransaction.objects.filter(user=user, applied=False),
+    'historial_gemas': lambda user: ledger.historial_gemas(user.id),
+    'webhooks_pendientes': lambda user: WebhookEvent.objects.filter(estado='pendiente').order_by('id'),
+    'webhooks_reclamo_vencido': lambda user: WebhookEvent.objects.filter(
+        Q(reclamado__lt=timezone.now()) | Q(reclamado__isnull=True), estado='procesando'
+    ),
+}
+
+
+class PlanesDeConsultaTests(TestCase):
+    """Ninguna consulta frecuente recorre una tabla completa"""
+
+    def test_consultas_frecuentes_usan_indices(self):
+        user = CustomUser.objects.create_user(email="planes@test.com", password="clave-segura-123")
+        for nombre, consulta in CONSULTAS_FRECUENTES.items():
+            with self.subTest(consulta=nombre):
+                self.assertEqual(escaneos_completos(consulta(user)), [])
+
+
+class CatalogoTests(TestCase):
+    """Los catálogos se sirven desde caché con ETag y se invalidan al editarlos"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email="catalogo@test.com", password="clave-segura-123")
+        self.token = str(AccessToken.for_user(self.user))
+        self.hechizo = Hechizo.objects.create(titulo="Amarre", descripcion="", categoria='amor')
+        Hechizo.objects.create(titulo="Prosperidad", descripcion="", categoria='dinero')
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers={'Authorization': f'Bearer {self.token}', **headers})
+
+    def test_etag_304_y_sin_consultas_al_catalogo(self):
+        response = self.get('/api/hechizos/?categoria=amor')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([h['titulo'] for h in response.json()], ["Amarre"])
+        etag = response['ETag']
+
+        # Solo la consulta del usuario autenticado
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get('/api/hechizos/?categoria=amor').content, response.content)
+        with self.assertNumQueries(1):
+            no_modificada = self.get('/api/hechizos/?categoria=amor', **{'If-None-Match': etag})
+        self.assertEqual(no_modificada.status_code, 304)
+        self.assertEqual(no_modificada.content, b'')
+
+        # Editar el catálogo cambia la versión y el ETag
+        self.hechizo.titulo = "Amarre eterno"
+        self.hechizo.save()
+        actualizada = self.get('/api/hechizos/?categoria=amor', **{'If-None-Match': etag})
+        self.assertEqual(actualizada.status_code, 200)
+        self.assertNotEqual(actualizada['ETag'], etag)
+        self.assertEqual(actualizada.json()[0]['titulo'], "Amarre eterno")
+
+    def test_variantes_por_categoria(self):
+        self.assertEqual(len(self.get('/api/hechizos/').json()), 2)
+        self.assertEqual(len(self.get('/api/hechizos/?categoria=dinero').json()), 1)
+        self.assertEqual(self.get('/api/hechizos/?categoria=otra').json(), [])
+
+    def test_contador_perdido_no_repite_versiones(self):
+        self.assertEqual(self.get('/api/hechizos/?categoria=amor').json()[0]['titulo'], "Amarre")
+        Hechizo.objects.filter(pk=self.hechizo.pk).update(titulo="Amarre eterno")
+        # La caché descarta el contador: el nuevo no puede coincidir con la versión ya servida
+        cache.delete(catalog.clave_version('hechizos'))
+        self.assertEqual(self.get('/api/hechizos/?categoria=amor').json()[0]['titulo'], "Amarre eterno")
+
+    def test_respuestas_caducan_y_el_contador_no(self):
+        with override_settings(CACHE_CATALOGO_TTL=1):
+            self.get('/api/hechizos/')
+        version = catalog.version_catalogo('hechizos')
+        with mock.patch('time.time', return_value=time.time() + 2):
+            # La respuesta caducó: se vuelve a construir desde la base
+            with self.assertNumQueries(2):
+                self.get('/api/hechizos/')
+            self.assertEqual(catalog.version_catalogo('hechizos'), version)
+
+
+class CatalogSyncTests(TestCase):
+    """manage.py catalog sync aplica el catálogo versionado con operaciones masivas"""
+
+    def setUp(self):
+        cache.clear()
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+
+    def escribir(self, datos):
+        ruta = f'{self.directorio.name}/catalogo.json'
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            json.dump(datos, archivo)
+        return ruta
+
+    def sync(self, *args):
+        salida = StringIO()
+        call_command('catalog', 'sync', *args, stdout=salida)
+        return salida.getvalue()
+
+    def test_catalogo_del_proyecto_y_diff(self):
+        ruta = str(settings.BASE_DIR / 'catalogo.json')
+        self.sync(ruta)
+        self.assertEqual(CartaTarot.objects.count(), 22)
+        self.assertEqual(set(TipoTirada.objects.values_list('tipo', flat=True)), {'basica', 'claridad', 'profunda'})
+        self.assertIn("cartas: 0 nuevos, 0 modificados", self.sync(ruta, '--dry-run'))
+
+        datos = catalog_sync.leer_catalogo(ruta)
+        datos['cartas'][0]['nombre'] = "El Bufón"
+        datos['hechizos'] = [{'titulo': "Amarre", 'descripcion': "Une dos almas", 'precio_gemas': 3, 'categoria': 'amor'}]
+        Hechizo.objects.create(titulo="Retirado", descripcion="Ya no se vende")
+        ruta = self.escribir(datos)
+
+        salida = self.sync(ruta, '--dry-run')
+        self.assertIn("~ cartas 0: nombre", salida)
+        self.assertIn("+ hechizos 'Amarre'", salida)
+        self.assertFalse(Hechizo.objects.filter(titulo="Amarre").exists())
+
+        obtener_mazo()
+        # savepoint, una lectura por sección (3), UPDATE de cartas, INSERT y UPDATE de hechizos, release
+        with self.assertNumQueries(8):
+            salida = self.sync(ruta)
+        self.assertEqual(obtener_mazo().cartas[0].nombre, "El Bufón")
+        # Sin caché compartida los workers de la aplicación no ven la invalidación
+        self.assertIn("reinicia la aplicación", salida)
+        self.assertEqual(dict(Hechizo.objects.values_list('titulo', 'activo')), {"Amarre": True, "Retirado": False})
+
+    def test_catalogo_invalido_no_cambia_nada(self):
+        ruta = self.escribir({'version': 1, 'hechizos': [
+            {'titulo': "Amarre", 'descripcion': "Une dos almas"},
+            {'titulo': "Prosperidad", 'descripcion': "Atrae dinero", 'categoria': 'otra'},
+        ]})
+        with self.assertRaisesMessage(CommandError, "categoria"):
+            self.sync(ruta)
+        with self.assertRaisesMessage(CommandError, "Versión de catálogo no soportada"):
+            self.sync(self.escribir({'version': 2}))
+        self.assertFalse(Hechizo.objects.exists())
+
+
+@override_settings(CACHE_COMPARTIDA=True)
+class BootstrapTests(TestCase):
+    """bootstrap/ reúne las llamadas de arranque de la app en una respuesta"""
+
+    def setUp(self):
+        cache.clear()
+        crear_mazo()
+        self.user = CustomUser.objects.create_user(email="bootstrap@test.com", password="clave-segura-123")
+        self.token = str(AccessToken.for_user(self.user))
+        hechizo = Hechizo.objects.create(titulo="Amarre", descripcion="", categoria='amor')
+        CompraHechizo.objects.create(user=self.user, hechizo=hechizo)
+        TipoTirada.objects.create(
+            nombre="Tirada Básica", tipo="basica", num_cartas=3,
+            descripcion="", costo_gemas=1, layout_descripcion=""
+        )
+
+    def get(self, **params):
+        return self.client.get('/api/bootstrap/', params, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_secciones_y_catalogos_sin_cambios(self):
+        datos = self.get().json()
+        self.assertEqual(datos['hechizos_comprados'], [CompraHechizo.objects.get().hechizo_id])
+        self.assertEqual(datos['pociones_compradas'], [])
+        self.assertIn('gemas', datos['perfil'])
+        self.assertEqual(len(datos['cartas']['datos']), 22)
+        self.assertEqual(datos['hechizos']['etag'], self.client.get(
+            '/api/hechizos/', HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )['ETag'])
+
+        etags = {nombre: datos[nombre]['etag'] for nombre in ('hechizos', 'pociones', 'cartas', 'tipos_tirada')}
+        # Solo el usuario: perfil, compras y catálogos salen de la caché
+        with self.assertNumQueries(1):
+            segunda = self.get(**etags).json()
+        for nombre, etag in etags.items():
+            self.assertEqual(segunda[nombre], {"etag": etag, "sin_cambios": True})
+
+
+@override_settings(CACHE_COMPARTIDA=True)
+class PerfilCacheadoTests(TestCase):
+    """perfil/ se responde con la instantánea cacheada y las mutaciones la invalidan"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email="instantanea@test.com", password="clave-segura-123")
+        self.token = str(CustomTokenObtainPairSerializer.get_token(self.user).access_token)
+
+    def perfil(self):
+        return self.client.get('/api/perfil/', HTTP_AUTHORIZATION=f'Bearer {self.token}').json()
+
+    def test_lectura_cacheada_e_invalidacion(self):
+        self.assertEqual(self.perfil()['gemas'], 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.perfil()['gemas'], 0)
+
+        ledger.acreditar_gemas(self.user.id, 5, 'compra_gemas')
+        self.assertEqual(self.perfil()['gemas'], 5)
+        self.assertTrue(ledger.debitar_gemas(self.user.id, 2, 'hechizo', 1))
+        ledger.activar_suscripcion(self.user.id)
+        self.assertTrue(ledger.consumir_tirada_incluida(self.user.id, 'basica', 100))
+        datos = self.perfil()
+        self.assertEqual((datos['gemas'], datos['tiene_suscripcion'], datos['tiradas_basicas_usadas']), (33, True, 1))
+
+        # Los cambios hechos desde el admin también invalidan por la señal post_save
+        profile = UserProfile.objects.get(user=self.user)
+        profile.tiene_suscripcion = False
+        profile.save()
+        self.assertFalse(self.perfil()['tiene_suscripcion'])
+
+    def test_lectura_lenta_no_pisa_una_version_mas_reciente(self):
+        # Una lectura empieza con la versión vigente y carga el perfil...
+        version = profile_cache.version_perfil(self.user.id)
+        perfil_viejo = profile_cache.cargar_perfil(self.user.id)
+        # ...mientras otra petición acredita gemas
+        ledger.acreditar_gemas(self.user.id, 7, 'compra_gemas')
+        cache.set(f'perfil:{self.user.id}:{version}', (
+            [getattr(perfil_viejo, campo) for campo in profile_cache.CAMPOS], perfil_viejo.creditos_pendientes
+        ))
+
+        self.assertEqual(self.perfil()['gemas'], 7)
+
+    @override_settings(CACHE_COMPARTIDA=False)
+    def test_sin_cache_compartida_lee_la_base(self):
+        self.assertEqual(self.perfil()['gemas'], 0)
+        # Un cambio que no pasa por este proceso (otro worker, un comando) se ve en la siguiente lectura
+        UserProfile.objects.filter(user=self.user).update(gemas=9)
+        with self.assertNumQueries(1):
+            self.assertEqual(profile_cache.obtener_perfil(self.user.id).gemas, 9)
+
+
+@override_settings(CACHE_COMPARTIDA=True)
+class ItemsPoseidosTests(TestCase):
+    """Las compras y mis-hechizos/ se responden con el bitmap cacheado de cada usuario"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email="poseidos@test.com", password="clave-segura-123")
+        ledger.acreditar_gemas(self.user.id, 10, 'ajuste')
+        self.token = str(AccessToken.for_user(self.user))
+        self.hechizos = [
+            Hechizo.objects.create(titulo=f"Hechizo {i}", descripcion="", precio_gemas=2) for i in range(3)
+        ]
+
+    def post(self, url, datos):
+        return self.client.post(url, datos, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def mis_hechizos(self):
+        return self.client.get('/api/mis-hechizos/', HTTP_AUTHORIZATION=f'Bearer {self.token}').json()['hechizos_comprados']
+
+    def test_compras_invalidan_el_bitmap(self):
+        self.assertEqual(self.mis_hechizos(), [])
+        for hechizo in reversed(self.hechizos[:2]):
+            self.assertEqual(self.post('/api/comprar-hechizo/', {'hechizo_id': hechizo.id}).json()['status'], 'ok')
+
+        # La compra invalidó el bitmap: se reconstruye una vez y luego solo se consulta el usuario
+        self.assertEqual(self.mis_hechizos(), sorted(h.id for h in self.hechizos[:2]))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.mis_hechizos(), sorted(h.id for h in self.hechizos[:2]))
+        self.assertEqual(self.post('/api/comprar-hechizo/', {'hechizo_id': self.hechizos[0].id}).json()['status'], 'ya_comprado')
+        self.assertEqual(ledger.saldo_gemas(self.user.id), 6)
+
+    def test_compra_duplicada_no_cobra_aunque_la_cache_no_la_tenga(self):
+        self.assertEqual(self.mis_hechizos(), [])
+        # Compra registrada por otro proceso sin pasar por este bitmap
+        CompraHechizo.objects.create(user=self.user, hechizo=self.hechizos[2])
+
+        response = self.post('/api/comprar-hechizo/', {'hechizo_id': self.hechizos[2].id})
+        self.assertEqual(response.json()['status'], 'ya_comprado')
+        self.assertEqual(ledger.saldo_gemas(self.user.id), 10)
+        self.assertEqual(self.mis_hechizos(), [self.hechizos[2].id])
+
+    def test_compras_simultaneas_no_se_pisan(self):
+        self.assertEqual(self.mis_hechizos(), [])
+        # Dos compras concurrentes: cada una leyó el bitmap antes de que la otra lo invalidara
+        clave_vieja = clave_poseidos('hechizos', self.user.id)
+        for hechizo in self.hechizos[:2]:
+            CompraHechizo.objects.create(user=self.user, hechizo=hechizo)
+            owned_items.invalidar('hechizos', self.user.id)
+            cache.set(clave_vieja, codificar([hechizo.id]))
+
+        self.assertEqual(self.mis_hechizos(), sorted(h.id for h in self.hechizos[:2]))
+
+    @override_settings(CACHE_COMPARTIDA=False)
+    def test_sin_cache_compartida_lee_la_base(self):
+        self.assertEqual(self.mis_hechizos(), [])
+        CompraHechizo.objects.create(user=self.user, hechizo=self.hechizos[1])
+        # El usuario autenticado y sus compras
+        with self.assertNumQueries(2):
+            self.assertEqual(self.mis_hechizos(), [self.hechizos[1].id])
+        self.assertIsNone(cache.get(clave_poseidos('hechizos', self.user.id)))
+
+    def test_codificacion_bitmap(self):
+        self.assertEqual(decodificar(codificar([0, 9, 3, 64])), [0, 3, 9, 64])
+        self.assertEqual(codificar([]), b'')
+
+
+class CheckoutTests(TestCase):
+    """checkout/ cobra el carrito de una vez e informa el resultado de cada item"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email="carrito@test.com", password="clave-segura-123")
+        ledger.acreditar_gemas(self.user.id, 10, 'ajuste')
+        self.token = str(AccessToken.for_user(self.user))
+        self.hechizos = [
+            Hechizo.objects.create(titulo=f"Hechizo {i}", descripcion="", precio_gemas=3) for i in range(3)
+        ]
+        self.pocion = Pocion.objects.create(titulo="Poción", descripcion="", precio_gemas=2)
+        CompraHechizo.objects.create(user=self.user, hechizo=self.hechizos[2])
+
+    def checkout(self, items):
+        return self.client.post(
+            '/api/checkout/', {'items': items}, content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+
+    def test_resultado_por_item_y_un_solo_cobro(self):
+        response = self.checkout([
+            {'tipo': 'hechizo', 'id': self.hechizos[0].id},
+            {'tipo': 'hechizo', 'id': self.hechizos[1].id},
+            {'tipo': 'hechizo', 'id': self.hechizos[2].id},
+            {'tipo': 'pocion', 'id': self.pocion.id},
+            {'tipo': 'hechizo', 'id': 999},
+        ])
+        datos = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['resultado'] for item in datos['items']],
+            ['comprado', 'comprado', 'ya_comprado', 'requiere_suscripcion', 'no_encontrado']
+        )
+        self.assertEqual((datos['total_gemas'], datos['gemas_restantes']), (6, 4))
+        self.assertEqual(GemTransaction.objects.filter(user=self.user, reason='carrito').count(), 1)
+        self.assertEqual(CompraHechizo.objects.filter(user=self.user).count(), 3)
+
+    def test_sin_gemas_suficientes_no_compra_nada(self):
+        UserProfile.objects.filter(user=self.user).update(tiene_suscripcion=True)
+        otro = Hechizo.objects.create(titulo="Caro", descripcion="", precio_gemas=9)
+        response = self.checkout([
+            {'tipo': 'hechizo', 'id': otro.id},
+            {'tipo': 'pocion', 'id': self.pocion.id},
+            {'tipo': 'pocion', 'id': self.pocion.id},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [item['resultado'] for item in response.json()['items']],
+            ['gemas_insuficientes', 'gemas_insuficientes', 'duplicado']
+        )
+        self.assertEqual(ledger.saldo_gemas(self.user.id), 10)
+        self.assertFalse(CompraPocion.objects.exists())
+
+    @override_settings(CACHE_COMPARTIDA=False)
+    def test_consultas_no_dependen_del_tamano_del_carrito(self):
+        UserProfile.objects.filter(user=self.user).update(tiene_suscripcion=True)
+        ledger.acreditar_gemas(self.user.id, 200, 'ajuste')
+        # Aplicar los créditos pendientes para que el débito no los compacte en una de las medidas
+        ledger.compactar_saldo(self.user.id)
+        for tamano in (2, 20):
+            hechizos = Hechizo.objects.bulk_create([
+                Hechizo(titulo=f"Carrito {tamano}-{i}", descripcion="", precio_gemas=1) for i in range(tamano)
+            ])
+            pociones = Pocion.objects.bulk_create([
+                Pocion(titulo=f"Carrito {tamano}-{i}", descripcion="", precio_gemas=1) for i in range(tamano)
+            ])
+            items = [{'tipo': 'hechizo', 'id': h.id} for h in hechizos] + [{'tipo': 'pocion', 'id': p.id} for p in pociones]
+            # Catálogo, compras y perfil (5); savepoint, débito, movimiento, dos INSERT masivos, release (6)
+            with self.subTest(tamano=tamano), self.assertNumQueries(11):
+                resultados, total = checkout_service.procesar_checkout(self.user, items)
+            self.assertEqual(total, 2 * tamano)
+
+
+class WebhookInboxTests(TestCase):
+    """Los webhooks se guardan una vez por id de evento y el worker los aplica"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="webhooks@test.com", password="clave-segura-123")
+        StripePayment.objects.create(
+            user=self.user, stripe_payment_intent_id='pi_123', amount=5, status='pending',
+            payment_type='gems', gems_amount=50
+        )
+        self.evento = {
+            'id': 'evt_1', 'type': 'payment_intent.succeeded',
+            'data': {'object': {'id': 'pi_123', 'object': 'payment_intent'}}
+        }
+
+    def enviar_stripe(self):
+        with mock.patch('stripe.Webhook.construct_event', return_value=self.evento):
+            return self.client.post(
+                '/api/stripe-webhook/', json.dumps(self.evento), content_type='application/json',
+                HTTP_STRIPE_SIGNATURE='firma'
+            )
+
+    def test_reintentos_no_acreditan_dos_veces(self):
+        for _ in range(3):
+            self.assertEqual(self.enviar_stripe().status_code, 200)
+
+        # Nada se aplica en la petición
+        self.assertEqual(ledger.saldo_gemas(self.user.id), 0)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+        self.assertEqual(webhook_inbox.procesar_eventos(), 1)
+        self.assertEqual(self.enviar_stripe().status_code, 200)
+        self.assertEqual(webhook_inbox.procesar_eventos(), 0)
+
+        self.assertEqual(ledger.saldo_gemas(self.user.id), 50)
+        self.assertEqual(StripePayment.objects.get().status, 'completed')
+        self.assertEqual(WebhookEvent.objects.get().estado, 'procesado')
+
+    def test_paypal_en_orden_de_llegada(self):
+        PayPalSubscription.objects.create(user=self.user, subscription_id='I-SUB')
+        eventos = [
+            {'id': 'WH-1', 'event_type': 'BILLING.SUBSCRIPTION.ACTIVATED', 'resource': {'id': 'I-SUB'}},
+            {'id': 'WH-2', 'event_type': 'BILLING.SUBSCRIPTION.CANCELLED', 'resource': {'id': 'I-SUB'}},
+        ]
+        with mock.patch('api.views.verificar_webhook_paypal', return_value=True):
+            for evento in eventos + eventos:
+                response = self.client.post('/api/paypal/subscription/webhook/', evento, content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(webhook_inbox.procesar_eventos(), 2)
+        self.assertEqual(PayPalSubscription.objects.get().status, 'CANCELLED')
+        self.assertFalse(UserProfile.objects.get(user=self.user).tiene_suscripcion)
+        self.assertEqual(ledger.saldo_gemas(self.user.id), ledger.BONO_SUSCRIPCION)
+
+    def test_reclamo_vencido_se_reintenta(self):
+        self.enviar_stripe()
+        evento = WebhookEvent.objects.get()
+        # Un worker reclama el evento y cae antes de aplicarlo
+        self.assertTrue(webhook_inbox.reclamar_evento(evento.id))
+        self.assertEqual(webhook_inbox.procesar_eventos(), 0)
+
+        WebhookEvent.objects.update(reclamado=timezone.now() - webhook_inbox.RECLAMO_VENCIMIENTO - timedelta(seconds=1))
+        self.assertEqual(webhook_inbox.procesar_eventos(), 1)
+        evento.refresh_from_db()
+        self.assertEqual((evento.estado, evento.intentos), ('procesado', 2))
+        self.assertEqual(ledger.saldo_gemas(self.user.id), 50)
+
+        # Sin intentos restantes queda en 'error'
+        WebhookEvent.objects.update(
+            estado='procesando', intentos=webhook_inbox.MAX_INTENTOS, reclamado=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(webhook_inbox.reintentar_vencidos(), 1)
+        self.assertEqual(WebhookEvent.objects.get().estado, 'error')
+
+
+def crear_certificado_autofirmado():
+    """Clave RSA y certificado autofirmado (PEM) que imitan los de PayPal"""
+    clave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'messageverificationcerts.paypal.com')])
+    ahora = datetime.now(dt_timezone.utc)
+    certificado = (
+        x509.CertificateBuilder()
+        .subject_name(nombre).issuer_name(nombre)
+        .public_key(clave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(ahora - timedelta(days=1))
+        .not_valid_after(ahora + timedelta(days=30))
+        .sign(clave, hashes.SHA256())
+    )
+    return clave, certificado.public_bytes(serialization.Encoding.PEM)
+
+
+@override_settings(PAYPAL_WEBHOOK_ID='WH-CONFIG-1')
+class FirmaPayPalTests(TestCase):
+    """La firma de los webhooks de PayPal se verifica localmente con el certificado cacheado"""
+    CERT_URL = 'https://api.sandbox.paypal.com/v1/notifications/certs/CERT-prueba'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.clave, cls.pem = crear_certificado_autofirmado()
+
+    def setUp(self):
+        cache.clear()
+        self.descargas = []
+
+        def descargar(url, **kwargs):
+            self.descargas.append(url)
+            return mock.Mock(status_code=200, content=self.pem)
+
+        patcher = mock.patch('api.paypal_signature.http_client.get', side_effect=descargar)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def enviar(self, evento, cert_url=CERT_URL, cuerpo_enviado=None):
+        cuerpo = json.dumps(evento).encode()
+        transmission_id, transmission_time = evento['id'] + '-tx', '2026-10-18T10:00:00Z'
+        firma = self.clave.sign(
+            paypal_signature.mensaje_firmado(transmission_id, transmission_time, 'WH-CONFIG-1', cuerpo),
+            padding.PKCS1v15(), hashes.SHA256()
+        )
+        return self.client.post(
+            '/api/paypal/payment/webhook/', cuerpo_enviado or cuerpo, content_type='application/json',
+            headers={
+                'PAYPAL-AUTH-ALGO': 'SHA256withRSA',
+                'PAYPAL-CERT-URL': cert_url,
+                'PAYPAL-TRANSMISSION-ID': transmission_id,
+                'PAYPAL-TRANSMISSION-SIG': base64.b64encode(firma).decode(),
+                'PAYPAL-TRANSMISSION-TIME': transmission_time,
+            }
+        )
+
+    def evento(self, numero):
+        return {'id': f'WH-{numero}', 'event_type': 'CHECKOUT.ORDER.APPROVED', 'resource': {'id': f'ORDEN-{numero}'}}
+
+    def test_firma_valida_con_certificado_descargado_una_vez(self):
+        self.assertEqual(self.enviar(self.evento(1)).status_code, 200)
+        self.assertEqual(self.enviar(self.evento(2)).status_code, 200)
+        self.assertEqual(self.descargas, [self.CERT_URL])
+        self.assertEqual(WebhookEvent.objects.count(), 2)
+
+    def test_cuerpo_alterado_o_host_no_permitido(self):
+        alterado = json.dumps({**self.evento(1), 'resource': {'id': 'OTRA-ORDEN'}}).encode()
+        self.assertEqual(self.enviar(self.evento(1), cuerpo_enviado=alterado).status_code, 400)
+
+        falso = 'https://paypal.example.com/v1/notifications/certs/CERT-prueba'
+        self.assertEqual(self.enviar(self.evento(2), cert_url=falso).status_code, 400)
+        self.assertEqual(self.descargas, [self.CERT_URL])
+        self.assertFalse(WebhookEvent.objects.exists())
+
+
+@override_settings(PAYPAL_TOKEN_MARGEN_REFRESCO=60)
+class TokenPayPalTests(TestCase):
+    """Un único gestor de tokens de PayPal, sin estampidas al caducar"""
+
+    def setUp(self):
+        cache.clear()
+        self.gestor = paypal_token.GestorTokenPayPal()
+        self.solicitudes = 0
+
+    def solicitar(self, expires_in=3600, demora=0):
+        def solicitar_token():
+            self.solicitudes += 1
+            time.sleep(demora)
+            return f'token-{self.solicitudes}', expires_in
+        return mock.patch('api.paypal_token.solicitar_token', side_effect=solicitar_token)
+
+    def test_single_flight_con_peticiones_simultaneas(self):
+        with self.solicitar(demora=0.2), ThreadPoolExecutor(max_workers=8) as executor:
+            tokens = list(executor.map(lambda _: self.gestor.obtener_token(), range(8)))
+
+        self.assertEqual(tokens, ['token-1'] * 8)
+        self.assertEqual(self.solicitudes, 1)
+        self.assertEqual(self.gestor.resumen()['solicitudes'], 1)
+
+    def test_refresco_anticipado_y_respaldo_si_falla(self):
+        with self.solicitar(expires_in=30):
+            self.assertEqual(self.gestor.obtener_token(), 'token-1')
+
+        with mock.patch('api.paypal_token.solicitar_token', side_effect=Exception('PayPal caído')):
+            # Dentro del margen: sigue sirviendo el token vigente aunque el refresco falle
+            self.assertEqual(self.gestor.obtener_token(), 'token-1')
+            self.gestor._refresco.join()
+
+        with self.solicitar(expires_in=3600):
+            self.assertEqual(self.gestor.obtener_token(), 'token-1')
+            self.gestor._refresco.join()
+            self.assertEqual(self.gestor.obtener_token(), 'token-2')
+
+        resumen = self.gestor.resumen()
+        self.assertEqual((resumen['refrescos_anticipados'], resumen['fallos']), (1, 1))
+
+
+class FakeAnthropicBatchesHandler(BaseHTTPRequestHandler):
+    """Servidor local que imita la Message Batches API: el lote termina en la segunda consulta"""
+
+    def responder(self, cuerpo, content_type='application/json'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_POST(self):
+        longitud = int(self.headers.get('Content-Length', 0))
+        self.server.lotes.append(json.loads(self.rfile.read(longitud)))
+        self.responder(json.dumps({"id": "msgbatch_1", "processing_status": "in_progress"}).encode())
+
+    def do_GET(self):
+        if self.path.endswith('/results'):
+            lineas = []
+            for solicitud in self.server.lotes[-1]['requests']:
+                if solicitud['custom_id'] == self.server.fallida:
+                    resultado = {"type": "errored", "error": {"type": "overloaded_error"}}
+                else:
+                    resultado = {"type": "succeeded", "message": {
+                        "content": [{"type": "text", "text": f"Lote: {solicitud['custom_id']}"}]
+                    }}
+                lineas.append(json.dumps({"custom_id": solicitud['custom_id'], "result": resultado}))
+            self.responder("\n".join(lineas).encode(), 'application/binary')
+            return
+
+        self.server.consultas += 1
+        base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.responder(json.dumps({
+            "id": "msgbatch_1",
+            "processing_status": "ended" if self.server.consultas > 1 else "in_progress",
+            "results_url": f"{base}/v1/messages/batches/msgbatch_1/results",
+        }).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class InterpretacionPorLotesTests(TestCase):
+    """Las tiradas no urgentes se envían en un solo lote y se guardan con un UPDATE masivo"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = ThreadingHTTPServer(('127.0.0.1', 0), FakeAnthropicBatchesHandler)
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.servidor.lotes = []
+        self.servidor.consultas = 0
+        self.servidor.fallida = None
+        crear_mazo()
+        self.user = CustomUser.objects.create_user(email="lotes@test.com", password="clave-segura-123")
+        tipo = TipoTirada.objects.create(
+            nombre="Tirada Básica", tipo="basica", num_cartas=3,
+            descripcion="", costo_gemas=1, layout_descripcion=""
+        )
+        cartas = list(CartaTarot.objects.all()[:3])
+        for i in range(3):
+            tirada = TiradaRealizada.objects.create(
+                user=self.user, tipo_tirada=tipo, pregunta=f"Pregunta {i}", interpretacion="Antigua"
+            )
+            CartaEnTirada.objects.bulk_create([
+                CartaEnTirada(tirada=tirada, carta=carta, posicion=posicion)
+                for posicion, carta in enumerate(cartas, start=1)
+            ])
+        obtener_mazo()
+
+    def test_regeneracion_por_lotes(self):
+        tiradas = TiradaRealizada.objects.order_by('id')
+        ids = list(tiradas.values_list('id', flat=True))
+        self.servidor.fallida = f"tirada-{ids[1]}"
+        self.assertEqual(interpretation_queue.marcar_para_regenerar(tiradas), 3)
+        # El worker de tiradas interactivas no las toma
+        self.assertEqual(interpretation_queue.procesar_pendientes(), 0)
+        # Una tirada pendiente ya recibirá su interpretación: no se marca ni pierde la urgencia
+        urgente = TiradaRealizada.objects.create(
+            user=self.user, tipo_tirada=tiradas[0].tipo_tirada, pregunta="Urgente", interpretacion="", estado='pendiente'
+        )
+        self.assertEqual(interpretation_queue.marcar_para_regenerar(TiradaRealizada.objects.filter(id=urgente.id)), 0)
+        urgente.delete()
+
+        url_fake = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+        with override_settings(ANTHROPIC_API_URL=url_fake, INTERPRETACION_BACKEND_LOTES='lotes'), \
+                mock.patch.dict('os.environ', {'ANTHROPIC_API_KEY': 'test-key'}):
+            self.assertEqual(interpretation_queue.enviar_lote(), 3)
+            self.assertEqual(len(self.servidor.lotes), 1)
+            self.assertEqual(len(self.servidor.lotes[0]['requests']), 3)
+            self.assertEqual(interpretation_queue.enviar_lote(), 0)
+
+            # Lote aún en curso: las tiradas siguen completadas con la interpretación anterior
+            self.assertEqual(interpretation_queue.recoger_lotes(), 0)
+            self.assertEqual(set(tiradas.values_list('estado', 'interpretacion')), {('completada', "Antigua")})
+            self.assertEqual(interpretation_queue.marcar_para_regenerar(tiradas), 0)
+
+            # lotes en curso, tiradas, cartas, UPDATE masivo, lote finalizado
+            with self.assertNumQueries(5):
+                self.assertEqual(interpretation_queue.recoger_lotes(), 3)
+
+        interpretaciones = dict(tiradas.values_list('id', 'interpretacion'))
+        self.assertEqual(interpretaciones[ids[0]], f"Lote: tirada-{ids[0]}")
+        self.assertEqual(interpretaciones[ids[2]], f"Lote: tirada-{ids[2]}")
+        # La regeneración fallida conserva la interpretación anterior y queda marcada
+        self.assertEqual(interpretaciones[ids[1]], "Antigua")
+        self.assertEqual(
+            list(tiradas.values_list('estado', 'regenerar')),
+            [('completada', False), ('completada', True), ('completada', False)]
+        )
+        self.assertEqual(LoteInterpretacion.objects.get().estado, 'finalizado')
+        # No se reenvía sola; el admin puede volver a pedirla
+        self.assertEqual(interpretation_queue.enviar_lote(), 0)
+        self.assertEqual(interpretation_queue.marcar_para_regenerar(tiradas.filter(id=ids[1])), 1)
+
+    def test_tirada_pendiente_sin_resultado_recibe_el_respaldo(self):
+        tirada = TiradaRealizada.objects.select_related('tipo_tirada').first()
+        TiradaRealizada.objects.filter(id=tirada.id).update(estado='pendiente', urgente=False, interpretacion="")
+        regenerada = TiradaRealizada.objects.exclude(id=tirada.id).first()
+        interpretation_queue.marcar_para_regenerar(TiradaRealizada.objects.filter(id=regenerada.id))
+
+        lote = LoteInterpretacion.objects.create(backend='lotes')
+        TiradaRealizada.objects.filter(id__in=[tirada.id, regenerada.id]).update(lote=lote)
+        interpretation_queue.escribir_resultados(
+            lote, interpretation_queue.tiradas_del_lote(lote), {}, obtener_backend('lotes')
+        )
+        self.assertIn("percibo energías", TiradaRealizada.objects.get(id=tirada.id).interpretacion)
+        regenerada.refresh_from_db()
+        self.assertEqual((regenerada.interpretacion, regenerada.regenerar), ("Antigua", True))
+
+    @override_settings(INTERPRETACION_BACKEND='local', INTERPRETACION_BACKEND_LOTES='local')
+    def test_backend_local_determinista(self):
+        tirada = TiradaRealizada.objects.select_related('tipo_tirada').first()
+        cartas = list(tirada.cartas.all())
+        primera = obtener_interpretacion_tirada(tirada, cartas, usar_cache=False)
+        self.assertEqual(primera, obtener_interpretacion_tirada(tirada, cartas))
+        self.assertIn("Carta 0 (normal): Significado normal 0", primera)
+
+        # Sin API de lotes el lote se resuelve en el acto
+        interpretation_queue.marcar_para_regenerar(TiradaRealizada.objects.all())
+        self.assertEqual(interpretation_queue.enviar_lote(), 3)
+        self.assertEqual(LoteInterpretacion.objects.get().estado, 'finalizado')
+        self.assertFalse(TiradaRealizada.objects.exclude(estado='completada').exists())
+
+
+class FakeAnthropicLatenciaHandler(BaseHTTPRequestHandler):
+    """Messages API local con latencia y código de estado configurables"""
+
+    def do_POST(self):
+        longitud = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(longitud)
+        with self.server.lock:
+            self.server.solicitudes += 1
+            self.server.en_curso += 1
+            self.server.max_en_curso = max(self.server.max_en_curso, self.server.en_curso)
+        time.sleep(self.server.retraso)
+
+        cuerpo = json.dumps({"content": [{"type": "text", "text": "Interpretación de la API"}]}).encode()
+        self.send_response(self.server.estado)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+        with self.server.lock:
+            self.server.en_curso -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(LLM_CIRCUITO_MIN_SOLICITUDES=3, LLM_CIRCUITO_APERTURA=30, LLM_CONCURRENCIA_ESPERA=0)
+class LlmGuardTests(TestCase):
+    """El circuito y el limitador evitan esperar a una API degradada"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = ThreadingHTTPServer(('127.0.0.1', 0), FakeAnthropicLatenciaHandler)
+        cls.servidor.lock = threading.Lock()
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.servidor.solicitudes = self.servidor.en_curso = self.servidor.max_en_curso = 0
+        self.servidor.retraso = 0
+        self.servidor.estado = 200
+        cache.clear()
+        llm_guard.breaker.reiniciar_metricas()
+        llm_guard.limitador.reiniciar()
+
+        crear_mazo()
+        tipo = TipoTirada.objects.create(
+            nombre="Tirada Básica", tipo="basica", num_cartas=3,
+            descripcion="", costo_gemas=1, layout_descripcion=""
+        )
+        user = CustomUser.objects.create_user(email="guard@test.com", password="clave-segura-123")
+        self.tirada = TiradaRealizada.objects.create(user=user, tipo_tirada=tipo, pregunta="¿Me ama?", interpretacion="")
+        self.cartas = CartaEnTirada.objects.bulk_create([
+            CartaEnTirada(tirada=self.tirada, carta=carta, posicion=posicion)
+            for posicion, carta in enumerate(CartaTarot.objects.all()[:3], start=1)
+        ])
+        obtener_mazo()
+
+        url_fake = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+        configuracion = override_settings(ANTHROPIC_API_URL=url_fake)
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+        patcher = mock.patch.dict('os.environ', {'ANTHROPIC_API_KEY': 'test-key'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def interpretar(self):
+        return obtener_interpretacion_tirada(self.tirada, self.cartas, usar_cache=False)
+
+    def test_circuito_se_abre_con_errores_y_se_cierra_tras_la_sonda(self):
+        self.servidor.estado = 500
+        for _ in range(5):
+            self.assertIn("percibo energías", self.interpretar())
+        # Abierto tras 3 errores: las dos últimas tiradas no llegaron a la API
+        self.assertEqual(self.servidor.solicitudes, 3)
+        self.assertEqual(llm_guard.breaker.estado(), 'abierto')
+
+        self.servidor.estado = 200
+        ahora = time.time()
+        with mock.patch.object(llm_guard.breaker, 'reloj', return_value=ahora + 31):
+            self.assertEqual(llm_guard.breaker.estado(), 'semiabierto')
+            self.assertEqual(self.interpretar(), "Interpretación de la API")
+            self.assertEqual(llm_guard.breaker.estado(), 'cerrado')
+        self.assertEqual(llm_guard.breaker.resumen()['sondas'], 1)
+
+    @override_settings(LLM_CIRCUITO_LATENCIA_LENTA=0.1)
+    def test_circuito_se_abre_por_latencia(self):
+        self.servidor.retraso = 0.2
+        for _ in range(3):
+            self.assertEqual(self.interpretar(), "Interpretación de la API")
+        self.assertEqual(llm_guard.breaker.estado(), 'abierto')
+
+        inicio = time.monotonic()
+        self.assertIn("percibo energías", self.interpretar())
+        self.assertLess(time.monotonic() - inicio, 0.1)
+        self.assertEqual(self.servidor.solicitudes, 3)
+
+    @override_settings(LLM_CONCURRENCIA_INICIAL=4, LLM_LATENCIA_OBJETIVO=0.1, LLM_CIRCUITO_MIN_SOLICITUDES=100)
+    def test_limitador_adapta_la_concurrencia_a_la_latencia(self):
+        llm_guard.limitador.reiniciar()
+        self.servidor.retraso = 0.3
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            resultados = list(executor.map(lambda _: self.interpretar(), range(8)))
+
+        self.assertLessEqual(self.servidor.max_en_curso, 4)
+        self.assertEqual(resultados.count("Interpretación de la API"), self.servidor.solicitudes)
+        resumen = llm_guard.limitador.resumen()
+        self.assertEqual(resumen['rechazos'], 8 - self.servidor.solicitudes)
+        self.assertLess(resumen['limite'], 4)
+
+        # Con latencia baja y el límite en uso vuelve a crecer
+        self.servidor.retraso = 0.02
+        limite = llm_guard.limitador.limite
+        with ThreadPoolExecutor(max_workers=int(limite)) as executor:
+            list(executor.map(lambda _: self.interpretar(), range(20)))
+        self.assertGreater(llm_guard.limitador.limite, limite)
+
+
+class PromptBuilderTests(TestCase):
+    """El prompt pone primero el prefijo estable y recorta cada carta por tokens"""
+
+    def setUp(self):
+        cache.clear()
+        crear_mazo()
+        carta = CartaTarot.objects.get(numero=1)
+        carta.significado_normal = "palabra " * 300
+        carta.save()
+        self.tipo = TipoTirada.objects.create(
+            nombre="Tirada Básica", tipo="basica", num_cartas=3,
+            descripcion="Pasado, presente y futuro", costo_gemas=1, layout_descripcion="Tres cartas en línea"
+        )
+        user = CustomUser.objects.create_user(email="prompt@test.com", password="clave-segura-123")
+        self.tiradas = []
+        for pregunta, numeros in (("¿Me ama?", (0, 1, 2)), ("¿Cambio de trabajo?", (3, 4, 5))):
+            tirada = TiradaRealizada.objects.create(user=user, tipo_tirada=self.tipo, pregunta=pregunta, interpretacion="")
+            cartas = CartaEnTirada.objects.bulk_create([
+                CartaEnTirada(tirada=tirada, carta=CartaTarot.objects.get(numero=numero), posicion=posicion)
+                for posicion, numero in enumerate(numeros, start=1)
+            ])
+            self.tiradas.append((tirada, cartas))
+
+    def test_prefijo_estable_y_cartas_recortadas_por_tokens(self):
+        primera, segunda = (prompt_builder.construir_solicitud(tirada, cartas) for tirada, cartas in self.tiradas)
+        self.assertEqual(primera['system'], segunda['system'])
+        self.assertIn("Tres cartas en línea", primera['system'][-1]['text'])
+
+        lineas = primera['messages'][0]['content'].split("\n")
+        carta_larga = next(linea for linea in lineas if linea.startswith("2. "))
+        significado = carta_larga.split(": ", 1)[1]
+        self.assertTrue(significado.endswith("…"))
+        self.assertLessEqual(prompt_builder.estimar_tokens(significado), settings.PROMPT_TOKENS_POR_CARTA)
+        self.assertIn("1. Carta 0 (normal): Significado normal 0", lineas)
+        # Solo las cartas de la lectura, no el mazo completo
+        self.assertNotIn("Carta 3", primera['messages'][0]['content'] + primera['system'][-1]['text'])
+
+    def test_cache_control_solo_si_el_prefijo_llega_al_minimo(self):
+        tirada, cartas = self.tiradas[0]
+        solicitud = prompt_builder.construir_solicitud(tirada, cartas)
+        self.assertNotIn('cache_control', solicitud['system'][-1])
+
+        # Una descripción larga de la tirada lleva el prefijo por encima del mínimo del proveedor
+        self.tipo.layout_descripcion = "posición " * 500
+        self.tipo.save()
+        solicitud = prompt_builder.construir_solicitud(tirada, cartas)
+        prefijo = "".join(bloque['text'] for bloque in solicitud['system'])
+        self.assertGreaterEqual(prompt_builder.estimar_tokens(prefijo), prompt_builder.MINIMO_TOKENS_CACHE)
+        self.assertEqual(solicitud['system'][-1]['cache_control'], {"type": "ephemeral"})
+
+    def test_segmentos_se_renderizan_una_vez(self):
+        segmentos = prompt_builder.segmentos_mazo()
+        self.assertIs(prompt_builder.segmentos_mazo(), segmentos)
+        segmento = prompt_builder.segmento_tirada(self.tipo)
+        self.assertIs(prompt_builder.segmento_tirada(TipoTirada.objects.get(id=self.tipo.id)), segmento)
+
+        self.tipo.layout_descripcion = "Cruz de tres cartas"
+        self.tipo.save()
+        self.assertIn("Cruz de tres cartas", prompt_builder.segmento_tirada(self.tipo))
+
+        # Un cambio en el mazo vuelve a renderizar sus segmentos
+        CartaTarot.objects.get(numero=0).save()
+        self.assertIsNot(prompt_builder.segmentos_mazo(), segmentos)
+
+    def test_ahorro_frente_al_prompt_sin_cache(self):
+        prompt_builder.metricas.reiniciar()
+        respuestas = []
+        # La primera lectura escribe el prefijo en la caché y la segunda lo lee
+        for escritos, leidos in ((1100, 0), (0, 1100)):
+            respuesta = mock.Mock(status_code=200)
+            respuesta.json.return_value = {
+                "content": [{"type": "text", "text": "Interpretación"}],
+                "usage": {"input_tokens": 120, "cache_read_input_tokens": leidos, "cache_creation_input_tokens": escritos},
+            }
+            respuestas.append(respuesta)
+        tirada, cartas = self.tiradas[0]
+        with mock.patch('api.interpretation_backends.http_client.post', side_effect=respuestas), \
+                mock.patch.dict('os.environ', {'ANTHROPIC_API_KEY': 'test-key'}):
+            with self.assertLogs('api.prompt_builder', 'INFO') as registros:
+                for _ in range(2):
+                    self.assertEqual(obtener_interpretacion_tirada(tirada, cartas, usar_cache=False), "Interpretación")
+        self.assertIn(f"Tirada {tirada.id}: 1220 tokens de entrada", registros.output[0])
+        self.assertIn("ahorro frente al prompt sin caché: -275.0", registros.output[0])
+        self.assertIn("ahorro frente al prompt sin caché: 990.0", registros.output[1])
+
+        resumen = prompt_builder.metricas.resumen()
+        self.assertEqual((resumen['lecturas'], resumen['tokens_entrada'], resumen['tokens_cache_leidos']), (2, 2440, 1100))
+        self.assertEqual(resumen['tokens_ahorrados'], 715)
+        self.assertEqual(resumen['ahorro_promedio_por_lectura'], 357.5)
+
+
+class RelojFalso:
+    def __init__(self, ahora=1000.0):
+        self.ahora = ahora
+
+    def __call__(self):
+        return self.ahora
+
+
+@override_settings(LIMITES_PETICIONES={
+    'tiradas': {'usuario': (2, 60), 'ip': (100, 60), 'global': (3, 60)},
+    'compras': {'usuario': (3, 60), 'ip': (100, 60), 'global': (100, 60)},
+})
+class LimitesPeticionesTests(TestCase):
+    """Token buckets por usuario, IP y globales con un reloj falso"""
+
+    def setUp(self):
+        cache.clear()
+        rate_limit.limitador.metricas.reiniciar()
+        self.reloj = RelojFalso()
+        patcher = mock.patch.object(rate_limit.limitador, 'reloj', self.reloj)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.usuarios = [
+            CustomUser.objects.create_user(email=f"limite{i}@test.com", password="clave-segura-123") for i in range(2)
+        ]
+
+    def comprar_gemas(self, user):
+        return self.client.post(
+            '/api/comprar-gemas/', {'cantidad': 1}, content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}'
+        )
+
+    def test_bucket_por_usuario_con_retry_after(self):
+        for _ in range(3):
+            self.assertEqual(self.comprar_gemas(self.usuarios[0]).status_code, 200)
+        response = self.comprar_gemas(self.usuarios[0])
+        self.assertEqual(response.status_code, 429)
+        # Un token cada 20 s
+        self.assertEqual(response['Retry-After'], '20')
+        self.assertEqual(ledger.saldo_gemas(self.usuarios[0].id), 3)
+
+        # Otro usuario tiene su propio bucket
+        self.assertEqual(self.comprar_gemas(self.usuarios[1]).status_code, 200)
+
+        self.reloj.ahora += 19
+        self.assertEqual(self.comprar_gemas(self.usuarios[0]).status_code, 429)
+        self.reloj.ahora += 1
+        self.assertEqual(self.comprar_gemas(self.usuarios[0]).status_code, 200)
+
+        metricas = rate_limit.limitador.metricas.resumen()['compras']
+        self.assertEqual(metricas['permitidas'], 5)
+        self.assertEqual(metricas['rechazadas'], 2)
+        self.assertEqual(metricas['rechazadas_usuario'], 2)
+
+    def test_bucket_global_y_todo_o_nada(self):
+        consumir = rate_limit.limitador.consumir
+        self.assertEqual(consumir('tiradas', 1, '10.0.0.1'), (True, 0.0))
+        self.assertEqual(consumir('tiradas', 1, '10.0.0.1'), (True, 0.0))
+        # Usuario agotado: no gasta del bucket global
+        self.assertFalse(consumir('tiradas', 1, '10.0.0.1')[0])
+        self.assertEqual(consumir('tiradas', 2, '10.0.0.2'), (True, 0.0))
+
+        permitido, espera = consumir('tiradas', 3, '10.0.0.3')
+        self.assertFalse(permitido)
+        self.assertEqual(espera, 20)
+        self.assertEqual(rate_limit.limitador.metricas.resumen()['tiradas']['rechazadas_global'], 1)
+
+        self.reloj.ahora += 20
+        self.assertTrue(consumir('tiradas', 3, '10.0.0.3')[0])
+
+
+# Consultas por petición con la caché caliente: (token sin claims, token con claims)
+CONSULTAS_POR_PETICION = {
+    '/api/perfil/': (1, 0),
+    '/api/historial-gemas/': (2, 1),
+    '/api/mis-hechizos/': (1, 0),
+    '/api/mis-pociones/': (1, 0),
+    '/api/bootstrap/': (1, 0),
+    '/api/historial-tiradas/': (2, 1),
+}
+
+
+@override_settings(CACHE_COMPARTIDA=True)
+class AutenticacionPorClaimsTests(TestCase):
+    """Con los claims del token request.user no se consulta en cada petición"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email="claims@test.com", password="clave-segura-123")
+        self.token_claims = str(CustomTokenObtainPairSerializer.get_token(self.user).access_token)
+        self.token_simple = str(AccessToken.for_user(self.user))
+
+    def consultas(self, url, token):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        return len(consultas.captured_queries)
+
+    def test_consultas_por_peticion(self):
+        for url, esperadas in CONSULTAS_POR_PETICION.items():
+            with self.subTest(url=url):
+                # Calentar las cachés de catálogos y de items poseídos
+                self.consultas(url, self.token_simple)
+                medidas = (self.consultas(url, self.token_simple), self.consultas(url, self.token_claims))
+                self.assertEqual(medidas, esperadas)
+
+    def test_campos_fuera_del_token_se_cargan_bajo_demanda(self):
+        response = self.client.post(
+            '/api/token/', {'email': 'claims@test.com', 'password': 'clave-segura-123'}, content_type='application/json'
+        )
+        acceso = AccessToken(response.json()['access'])
+        self.assertEqual(acceso['email'], 'claims@test.com')
+        self.assertNotIn('suscripcion', acceso)
+
+        user = JWTClaimsAuthentication().get_user(acceso)
+        with self.assertNumQueries(0):
+            self.assertEqual((user.id, user.email, user.is_authenticated), (self.user.id, 'claims@test.com', True))
+        with self.assertNumQueries(1):
+            self.assertFalse(user.is_staff)
+
+        # Solo el staff accede a las métricas, aunque is_staff no viaje en el token
+        self.assertEqual(self.client.get('/api/metricas/', HTTP_AUTHORIZATION=f'Bearer {self.token_claims}').status_code, 403)
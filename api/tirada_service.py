@@ -0,0 +1,102 @@
+"""
+Tirada service module for TarotNautica
+
+Punto único de creación de tiradas: cobra la tirada, selecciona las cartas del
+mazo en memoria y guarda la tirada con todas sus cartas en una sola transacción
+(un INSERT para la tirada y un INSERT masivo para las cartas).
+"""
+import random
+from django.db import connection, transaction
+from django.utils import timezone
+from .ledger import CAMPOS_TIRADAS, consumir_tirada_incluida, debitar_gemas, tiradas_usadas
+from .models import TiradaRealizada, CartaEnTirada
+from .profile_cache import obtener_perfil
+from .tarot_deck import obtener_mazo
+
+
+def validar_puede_hacer_tirada(user, tipo_tirada):
+    """
+    Verifica si el usuario puede realizar una tirada:
+    1. Si tiene suscripción, verifica los límites mensuales
+    2. Si no tiene suscripción, descuenta gemas
+    
+    Retorna (puede_hacer_tirada, mensaje, costo_gemas)
+    """
+    profile = obtener_perfil(user.id)
+    
+    # Determinar límites según tipo de tirada
+    if tipo_tirada.tipo not in CAMPOS_TIRADAS:
+        return False, "Tipo de tirada no válido", 0
+    # Un periodo de facturación anterior cuenta como cupo sin usar
+    usadas = tiradas_usadas(profile, tipo_tirada.tipo)
+    
+    # Si tiene suscripción y no ha excedido límites mensuales
+    # (el UPDATE condicional vuelve a comprobar el cupo frente a peticiones simultáneas)
+    if profile.tiene_suscripcion and usadas < tipo_tirada.limite_mensual:
+        if consumir_tirada_incluida(user.id, tipo_tirada.tipo, tipo_tirada.limite_mensual):
+            return True, "Tirada incluida en suscripción", 0
+    
+    # Si no tiene suscripción o ha excedido límites, verificar gemas
+    costo_gemas = tipo_tirada.costo_gemas
+    if debitar_gemas(user.id, costo_gemas, 'tirada', tipo_tirada.tipo):
+        return True, f"Tirada realizada (costo: {costo_gemas} gemas)", costo_gemas
+    
+    return False, f"No tienes suficientes gemas para esta tirada. Necesitas {costo_gemas} gemas.", 0
+
+def registrar_tirada(user, tipo_tirada, pregunta, estado='completada'):
+    """
+    Cobra la tirada y guarda la tirada junto con sus cartas de forma atómica.
+    
+    Retorna (tirada, cartas_en_tirada, mensaje, costo_gemas).
+    Si la tirada no se puede realizar, tirada y cartas_en_tirada son None
+    y mensaje explica el motivo; en ese caso no se cobra nada.
+    """
+    # Seleccionar cartas aleatorias del mazo en memoria
+    cartas = obtener_mazo().cartas
+    if len(cartas) < tipo_tirada.num_cartas:
+        return None, None, "No hay suficientes cartas registradas para este tipo de tirada", 0
+    
+    cartas_seleccionadas = random.sample(cartas, tipo_tirada.num_cartas)
+    
+    with transaction.atomic():
+        # Verificar si el usuario puede realizar esta tirada
+        puede_hacer_tirada, mensaje, costo = validar_puede_hacer_tirada(user, tipo_tirada)
+        if not puede_hacer_tirada:
+            return None, None, mensaje, 0
+        
+        # Crear la tirada
+        tirada = TiradaRealizada.objects.create(
+            user=user,
+            tipo_tirada=tipo_tirada,
+            pregunta=pregunta,
+            interpretacion="",  # La interpretación se añadirá después
+            estado=estado,
+            # La petición que la crea 'procesando' la reclama (ver interpretation_queue.py)
+            reclamada=timezone.now() if estado == 'procesando' else None
+        )
+        
+        # Crear las cartas en la tirada (50% de probabilidad de que cada una esté invertida)
+        cartas_en_tirada = CartaEnTirada.objects.bulk_create([
+            CartaEnTirada(
+                tirada=tirada,
+                carta_id=carta.id,
+                posicion=i+1,
+                invertida=random.choice([True, False])
+            )
+            for i, carta in enumerate(cartas_seleccionadas)
+        ])
+    
+    # Sin RETURNING (MySQL) el INSERT masivo no devuelve los ids
+    if not connection.features.can_return_rows_from_bulk_insert:
+        cartas_en_tirada = list(tirada.cartas.all())
+    
+    # tirada.cartas.all() usará estas cartas sin volver a consultarlas
+    tirada._prefetched_objects_cache = {'cartas': cartas_en_tirada}
+    
+    return tirada, cartas_en_tirada, mensaje, costo
+
+def guardar_interpretacion_tirada(tirada, interpretacion):
+    """Guarda la interpretación actualizando solo sus columnas"""
+    tirada.interpretacion = interpretacion
+    tirada.estado = 'completada'
+    tirada.save(update_fields=['interpretacion', 'estado'])
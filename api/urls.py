@@ -6,16 +6,19 @@ from .views import (welcome, perfil_usuario, comprar_gemas, activar_suscripcion,
                     comprar_hechizo, comprar_pocion, mis_hechizos, mis_pociones,
                     register_user, listar_cartas_tarot, detalle_carta_tarot,
                     listar_tipos_tirada, detalle_tipo_tirada, historial_tiradas,
-                    detalle_tirada, realizar_tirada, crear_tirada, obtener_tirada,
+                    detalle_tirada, realizar_tirada, crear_tirada,
                     create_paypal_payment, paypal_payment_webhook, create_paypal_subscription,
-                    paypal_subscription_webhook)
-from . import stripe_views
+                    paypal_subscription_webhook, metricas, historial_gemas, bootstrap, checkout)
+from . import stripe_views, streaming_views
 
 urlpatterns = [
     path('', welcome),
+    path('metricas/', metricas, name='metricas'),
     path('registro/', register_user, name='register_user'),
     path('perfil/', perfil_usuario),
+    path('bootstrap/', bootstrap, name='bootstrap'),
     path('comprar-gemas/', comprar_gemas),
+    path('historial-gemas/', historial_gemas, name='historial_gemas'),
     path('activar-suscripcion/', activar_suscripcion),
     path('cancelar-suscripcion/', cancelar_suscripcion),
     path('usar-tirada/', usar_tirada),
@@ -25,6 +28,7 @@ urlpatterns = [
     # Rutas para compras
     path('comprar-hechizo/', comprar_hechizo, name='comprar_hechizo'),
     path('comprar-pocion/', comprar_pocion, name='comprar_pocion'),
+    path('checkout/', checkout, name='checkout'),
     path('mis-hechizos/', mis_hechizos, name='mis_hechizos'),
     path('mis-pociones/', mis_pociones, name='mis_pociones'),
     
@@ -36,8 +40,9 @@ urlpatterns = [
     path('historial-tiradas/', historial_tiradas, name='historial_tiradas'),
     path('tirada/<int:tirada_id>/', detalle_tirada, name='detalle_tirada'),
     path('realizar-tirada/', realizar_tirada, name='realizar_tirada'),
+    path('realizar-tirada/stream/', streaming_views.realizar_tirada_stream, name='realizar_tirada_stream'),
     path('tiradas/crear/', crear_tirada, name='crear_tirada'),
-    path('tiradas/<int:tirada_id>/', obtener_tirada, name='obtener_tirada'),
+    path('tiradas/<int:tirada_id>/', streaming_views.obtener_tirada, name='obtener_tirada'),
 
     # Endpoints de Stripe
     path('crear-intent-pago/', stripe_views.create_payment_intent, name='crear-intent-pago'),
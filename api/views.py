@@ -1,68 +1,62 @@
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework import status
-from .models import (UserProfile, Hechizo, Pocion, CompraHechizo, CompraPocion,
-                     CartaTarot, TipoTirada, TiradaRealizada, CartaEnTirada,
+from .models import (Hechizo, Pocion, CompraHechizo, CompraPocion,
+                     TipoTirada, TiradaRealizada,
                      PayPalPayment, PayPalSubscription)
 from .subscription_handler import reset_subscription_benefits
+from .tarot_deck import obtener_mazo, obtener_carta
+from .tirada_service import registrar_tirada, guardar_interpretacion_tirada
+from .checkout_service import procesar_checkout
+from .rate_limit import LimiteCompras, LimiteTiradas
+from .interpretation_backends import generar_interpretacion_fallback
 from .serializers import (
-    UserProfileSerializer, HechizoSerializer, PocionSerializer,
-    UserSerializer, CompraHechizoSerializer, CompraPocionSerializer,
+    UserProfileSerializer, HechizoSerializer, PocionSerializer, UserSerializer,
     CartaTarotSerializer, TipoTiradaSerializer, TiradaRealizadaSerializer, 
-    CartaEnTiradaSerializer, CrearTiradaSerializer, PayPalPaymentSerializer,
-    PayPalSubscriptionSerializer
+    CrearTiradaSerializer, PayPalPaymentSerializer,
+    PayPalSubscriptionSerializer, GemTransactionSerializer, HistorialTiradaSerializer,
+    CheckoutSerializer
 )
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .custom_token import CustomTokenObtainPairSerializer
-import random
-import os
-import anthropic
 import logging
 from django.conf import settings
-import requests
+from . import (
+    catalog, http_client, interpretation_backends, interpretation_cache, ledger, llm_guard,
+    owned_items, paypal_signature, paypal_token, profile_cache, prompt_builder, rate_limit,
+    webhook_inbox
+)
 import base64
 import json
-from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
+# Categorías válidas de hechizos y pociones (las mismas en ambos modelos)
+CATEGORIAS_CATALOGO = {valor for valor, _ in Hechizo._meta.get_field('categoria').choices}
+
+# Tamaño de página del historial de tiradas
+HISTORIAL_LIMITE = 20
+HISTORIAL_LIMITE_MAXIMO = 100
+
 def get_paypal_config():
     """Get PayPal configuration"""
     return {
         'client_id': settings.PAYPAL_CLIENT_ID,
         'client_secret': settings.PAYPAL_CLIENT_SECRET,
         'mode': 'sandbox' if settings.DEBUG else 'live',
-        'api_base': 'https://api-m.sandbox.paypal.com' if settings.DEBUG else 'https://api-m.paypal.com'
+        'api_base': paypal_token.api_base()
     }
 
 def get_paypal_access_token():
     """Get PayPal OAuth access token"""
-    token = cache.get('paypal_access_token')
-    if token:
-        return token
-
-    config = get_paypal_config()
-    auth = base64.b64encode(f"{config['client_id']}:{config['client_secret']}".encode()).decode()
-    headers = {
-        'Authorization': f'Basic {auth}',
-        'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    data = {'grant_type': 'client_credentials'}
-    
-    response = requests.post(
-        f'{config["api_base"]}/v1/oauth2/token',
-        headers=headers,
-        data=data
-    )
-    
-    if response.status_code == 200:
-        token = response.json()['access_token']
-        cache.set('paypal_access_token', token, 60 * 60 * 7)
-        return token
-    
-    raise Exception('Failed to get PayPal access token')
+    return paypal_token.obtener_token()
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
@@ -71,6 +65,19 @@ class CustomTokenObtainPairView(TokenObtainPairView):
 def welcome(request):
     return Response({"message": "Bienvenido a Tarotnautica"})
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metricas(request):
+    """Métricas internas del backend (solo staff)"""
+    return Response({
+        "http": http_client.obtener_metricas(),
+        "cache_interpretaciones": interpretation_cache.metricas.resumen(),
+        "llm": llm_guard.metricas(),
+        "prompt": prompt_builder.metricas.resumen(),
+        "limites": rate_limit.limitador.metricas.resumen(),
+        "paypal_token": paypal_token.gestor.resumen()
+    })
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def register_user(request):
@@ -88,44 +95,38 @@ def register_user(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def perfil_usuario(request):
-    perfil = UserProfile.objects.get(user=request.user)
+    perfil = profile_cache.obtener_perfil(request.user.id)
     serializer = UserProfileSerializer(perfil)
     return Response(serializer.data)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LimiteCompras])
 def activar_suscripcion(request):
     profile = request.user.profile
-    was_subscribed = profile.tiene_suscripcion
-    profile.tiene_suscripcion = True
     
     # Reset tiradas and add bonus gemas when subscribing
-    if not was_subscribed:
-        profile = reset_subscription_benefits(profile)
-    else:
-        profile.save()
+    tiradas_reset = reset_subscription_benefits(profile)
         
     return Response({
         "status": "ok", 
         "suscripcion": True,
-        "gemas": profile.gemas,
-        "tiradas_reset": not was_subscribed
+        "gemas": ledger.saldo_perfil(profile),
+        "tiradas_reset": tiradas_reset
     })
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def cancelar_suscripcion(request):
-    profile = request.user.profile
-    profile.tiene_suscripcion = False
-    profile.save()
+    ledger.cancelar_suscripcion(request.user.id)
     return Response({"status": "ok", "suscripcion": False})
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LimiteCompras])
 def comprar_gemas(request):
-    profile = request.user.profile
     cantidad = request.data.get("cantidad", 0)
 
     try:
@@ -133,38 +134,42 @@ def comprar_gemas(request):
         if cantidad <= 0:
             return Response({"error": "Cantidad inválida"}, status=400)
 
-        profile.gemas += cantidad
-        profile.save()
-        return Response({"status": "ok", "gemas": profile.gemas})
+        ledger.acreditar_gemas(request.user.id, cantidad, 'compra_gemas')
+        return Response({"status": "ok", "gemas": ledger.saldo_gemas(request.user.id)})
     except:
         return Response({"error": "Error al procesar compra"}, status=500)
 
 
-def validar_tirada(profile, tipo):
-    profile.reset_tiradas_mensuales()
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def historial_gemas(request):
+    """Movimientos de gemas del usuario, los más recientes primero"""
+    try:
+        limite = min(int(request.query_params.get('limite', 50)), 200)
+    except ValueError:
+        return Response({"error": "Límite inválido"}, status=400)
 
+    movimientos = ledger.historial_gemas(request.user.id)[:max(limite, 1)]
+    serializer = GemTransactionSerializer(movimientos, many=True)
+    return Response(serializer.data)
+
+
+def validar_tirada(profile, tipo):
     limites = {
-        "basica": (profile.tiradas_basicas_usadas, 100, 1),
-        "claridad": (profile.tiradas_claridad_usadas, 50, 2),
-        "profunda": (profile.tiradas_profundas_usadas, 30, 7),
+        "basica": (100, 1),
+        "claridad": (50, 2),
+        "profunda": (30, 7),
     }
 
-    usadas, limite, costo_gemas = limites.get(tipo)
+    limite, costo_gemas = limites.get(tipo)
+    usadas = ledger.tiradas_usadas(profile, tipo)
 
     if profile.tiene_suscripcion and usadas < limite:
-        # Puede usar gratis
-        if tipo == "basica":
-            profile.tiradas_basicas_usadas += 1
-        elif tipo == "claridad":
-            profile.tiradas_claridad_usadas += 1
-        elif tipo == "profunda":
-            profile.tiradas_profundas_usadas += 1
-        profile.save()
-        return True, "OK - suscripción", 0
-
-    if profile.gemas >= costo_gemas:
-        profile.gemas -= costo_gemas
-        profile.save()
+        # Puede usar gratis si el cupo sigue disponible al actualizar
+        if ledger.consumir_tirada_incluida(profile.user_id, tipo, limite):
+            return True, "OK - suscripción", 0
+
+    if ledger.debitar_gemas(profile.user_id, costo_gemas, 'tirada', tipo):
         return True, "OK - usando gemas", costo_gemas
 
     return False, "No tienes suficientes gemas o tiradas disponibles", 0
@@ -172,9 +177,10 @@ def validar_tirada(profile, tipo):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LimiteTiradas])
 def usar_tirada(request):
     tipo = request.data.get("tipo")  # 'basica', 'claridad', 'profunda'
-    profile = request.user.profile
+    profile = profile_cache.obtener_perfil(request.user.id)
 
     valido, mensaje, costo = validar_tirada(profile, tipo)
 
@@ -182,63 +188,80 @@ def usar_tirada(request):
         return Response({
             "status": "ok",
             "mensaje": mensaje,
-            "gemas_restantes": profile.gemas
+            "gemas_restantes": ledger.saldo_gemas(request.user.id)
         })
     else:
         return Response({"error": mensaje}, status=400)
 
 
+def datos_hechizos(categoria=None):
+    hechizos = Hechizo.objects.filter(activo=True)
+    if categoria:
+        hechizos = hechizos.filter(categoria=categoria)
+    return HechizoSerializer(hechizos, many=True).data
+
+def datos_pociones(categoria=None):
+    pociones = Pocion.objects.filter(activo=True)
+    if categoria:
+        pociones = pociones.filter(categoria=categoria)
+    return PocionSerializer(pociones, many=True).data
+
+def datos_cartas():
+    return CartaTarotSerializer(obtener_mazo().cartas, many=True).data
+
+def datos_tipos_tirada():
+    return TipoTiradaSerializer(TipoTirada.objects.all(), many=True).data
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def listar_hechizos(request):
     categoria = request.query_params.get('categoria', None)
-    hechizos = Hechizo.objects.filter(activo=True)
-    if categoria:
-        hechizos = hechizos.filter(categoria=categoria)
-    serializer = HechizoSerializer(hechizos, many=True)
-    return Response(serializer.data)
+    if categoria and categoria not in CATEGORIAS_CATALOGO:
+        return Response([])
+    return catalog.respuesta_catalogo(request, 'hechizos', lambda: datos_hechizos(categoria), categoria or '')
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def listar_pociones(request):
     categoria = request.query_params.get('categoria', None)
-    pociones = Pocion.objects.filter(activo=True)
-    if categoria:
-        pociones = pociones.filter(categoria=categoria)
-    serializer = PocionSerializer(pociones, many=True)
-    return Response(serializer.data)
+    if categoria and categoria not in CATEGORIAS_CATALOGO:
+        return Response([])
+    return catalog.respuesta_catalogo(request, 'pociones', lambda: datos_pociones(categoria), categoria or '')
 
 # Nuevos endpoints para compras
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LimiteCompras])
 def comprar_hechizo(request):
     try:
         hechizo_id = request.data.get('hechizo_id')
         hechizo = Hechizo.objects.get(id=hechizo_id, activo=True)
         
-        # Verificar si ya lo compró
-        if CompraHechizo.objects.filter(user=request.user, hechizo=hechizo).exists():
+        # Verificar si ya lo compró (bitmap en caché)
+        if owned_items.posee('hechizos', request.user.id, hechizo.id):
             return Response({"status": "ya_comprado", "mensaje": "Ya has comprado este hechizo"})
         
-        # Verificar gemas suficientes
-        profile = request.user.profile
-        if profile.gemas < hechizo.precio_gemas:
-            return Response(
-                {"status": "error", "mensaje": "No tienes suficientes gemas"}, 
-                status=400
-            )
-        
-        # Descontar gemas
-        profile.gemas -= hechizo.precio_gemas
-        profile.save()
-        
-        # Registrar compra
-        CompraHechizo.objects.create(user=request.user, hechizo=hechizo)
+        try:
+            with transaction.atomic():
+                # Descontar gemas solo si el saldo alcanza
+                if not ledger.debitar_gemas(request.user.id, hechizo.precio_gemas, 'hechizo', hechizo.id):
+                    return Response(
+                        {"status": "error", "mensaje": "No tienes suficientes gemas"}, 
+                        status=400
+                    )
+                
+                # Registrar compra (la restricción única detecta compras simultáneas)
+                CompraHechizo.objects.create(user=request.user, hechizo=hechizo)
+        except IntegrityError:
+            # Otra petición lo compró antes: el cobro se revirtió con la transacción
+            owned_items.invalidar('hechizos', request.user.id)
+            return Response({"status": "ya_comprado", "mensaje": "Ya has comprado este hechizo"})
         
+        owned_items.invalidar('hechizos', request.user.id)
         return Response({
             "status": "ok", 
             "mensaje": "Hechizo comprado exitosamente",
-            "gemas_restantes": profile.gemas
+            "gemas_restantes": ledger.saldo_gemas(request.user.id)
         })
     
     except Hechizo.DoesNotExist:
@@ -248,41 +271,45 @@ def comprar_hechizo(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LimiteCompras])
 def comprar_pocion(request):
     try:
         pocion_id = request.data.get('pocion_id')
         pocion = Pocion.objects.get(id=pocion_id, activo=True)
         
-        # Verificar si ya lo compró
-        if CompraPocion.objects.filter(user=request.user, pocion=pocion).exists():
+        # Verificar si ya lo compró (bitmap en caché)
+        if owned_items.posee('pociones', request.user.id, pocion.id):
             return Response({"status": "ya_comprado", "mensaje": "Ya has comprado esta poción"})
         
         # Verificar suscripción
-        profile = request.user.profile
+        profile = profile_cache.obtener_perfil(request.user.id)
         if not profile.tiene_suscripcion:
             return Response(
                 {"status": "error", "mensaje": "Necesitas suscripción para comprar pociones"}, 
                 status=400
             )
             
-        # Verificar gemas suficientes
-        if profile.gemas < pocion.precio_gemas:
-            return Response(
-                {"status": "error", "mensaje": "No tienes suficientes gemas"}, 
-                status=400
-            )
-        
-        # Descontar gemas
-        profile.gemas -= pocion.precio_gemas
-        profile.save()
-        
-        # Registrar compra
-        CompraPocion.objects.create(user=request.user, pocion=pocion)
+        try:
+            with transaction.atomic():
+                # Descontar gemas solo si el saldo alcanza
+                if not ledger.debitar_gemas(request.user.id, pocion.precio_gemas, 'pocion', pocion.id):
+                    return Response(
+                        {"status": "error", "mensaje": "No tienes suficientes gemas"}, 
+                        status=400
+                    )
+                
+                # Registrar compra (la restricción única detecta compras simultáneas)
+                CompraPocion.objects.create(user=request.user, pocion=pocion)
+        except IntegrityError:
+            # Otra petición la compró antes: el cobro se revirtió con la transacción
+            owned_items.invalidar('pociones', request.user.id)
+            return Response({"status": "ya_comprado", "mensaje": "Ya has comprado esta poción"})
         
+        owned_items.invalidar('pociones', request.user.id)
         return Response({
             "status": "ok", 
             "mensaje": "Poción comprada exitosamente",
-            "gemas_restantes": profile.gemas
+            "gemas_restantes": ledger.saldo_gemas(request.user.id)
         })
     
     except Pocion.DoesNotExist:
@@ -290,51 +317,109 @@ def comprar_pocion(request):
     except Exception as e:
         return Response({"status": "error", "mensaje": str(e)}, status=500)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([LimiteCompras])
+def checkout(request):
+    """
+    Comprar varios hechizos y pociones a la vez.
+
+    Body: {"items": [{"tipo": "hechizo", "id": 1}, {"tipo": "pocion", "id": 4}]}
+    El total se cobra de una vez; cada item informa su resultado (comprado,
+    ya_comprado, no_encontrado, requiere_suscripcion, gemas_insuficientes...).
+    """
+    serializer = CheckoutSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=400)
+
+    resultados, total = procesar_checkout(request.user, serializer.validated_data['items'])
+    for resultado in resultados:
+        resultado.pop('precio_gemas', None)
+
+    sin_gemas = any(r['resultado'] == 'gemas_insuficientes' for r in resultados)
+    return Response({
+        "status": "error" if sin_gemas else "ok",
+        "total_gemas": total,
+        "gemas_restantes": ledger.saldo_gemas(request.user.id),
+        "items": resultados
+    }, status=400 if sin_gemas else 200)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def mis_hechizos(request):
-    compras = CompraHechizo.objects.filter(user=request.user)
-    hechizos_ids = compras.values_list('hechizo_id', flat=True)
     return Response({
-        "hechizos_comprados": list(hechizos_ids)
+        "hechizos_comprados": owned_items.ids_poseidos('hechizos', request.user.id)
     })
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def mis_pociones(request):
-    compras = CompraPocion.objects.filter(user=request.user)
-    pociones_ids = compras.values_list('pocion_id', flat=True)
     return Response({
-        "pociones_compradas": list(pociones_ids)
+        "pociones_compradas": owned_items.ids_poseidos('pociones', request.user.id)
     })
     
 
+# Catálogos incluidos en bootstrap y la función que construye cada uno
+CATALOGOS_BOOTSTRAP = {
+    'hechizos': datos_hechizos,
+    'pociones': datos_pociones,
+    'cartas': datos_cartas,
+    'tipos_tirada': datos_tipos_tirada,
+}
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def bootstrap(request):
+    """
+    Todo lo que la app necesita al arrancar en una sola respuesta: perfil,
+    compras del usuario y los catálogos.
+
+    Cada catálogo incluye su ETag. Si el cliente envía el ETag que ya tiene
+    (`?hechizos=<etag>&cartas=<etag>...`) y sigue vigente, la sección llega
+    como {"etag": ..., "sin_cambios": true} sin los datos.
+    """
+    usuario = {
+        "perfil": UserProfileSerializer(profile_cache.obtener_perfil(request.user.id)).data,
+        "hechizos_comprados": owned_items.ids_poseidos('hechizos', request.user.id),
+        "pociones_compradas": owned_items.ids_poseidos('pociones', request.user.id),
+    }
+    partes = [
+        (nombre, JSONRenderer().render(valor)) for nombre, valor in usuario.items()
+    ]
+
+    for nombre, construir in CATALOGOS_BOOTSTRAP.items():
+        etag, cuerpo = catalog.obtener_catalogo(nombre, construir)
+        if request.query_params.get(nombre, '').strip('"') == etag.strip('"'):
+            seccion = b'{"etag":' + json.dumps(etag).encode() + b',"sin_cambios":true}'
+        else:
+            # El cuerpo cacheado ya es JSON: se inserta sin volver a serializar
+            seccion = b'{"etag":' + json.dumps(etag).encode() + b',"datos":' + cuerpo + b'}'
+        partes.append((nombre, seccion))
+
+    cuerpo = b'{' + b','.join(json.dumps(nombre).encode() + b':' + valor for nombre, valor in partes) + b'}'
+    return HttpResponse(cuerpo, content_type='application/json')
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def listar_cartas_tarot(request):
     """Listar todas las cartas de tarot disponibles"""
-    cartas = CartaTarot.objects.all()
-    serializer = CartaTarotSerializer(cartas, many=True)
-    return Response(serializer.data)
+    return catalog.respuesta_catalogo(request, 'cartas', datos_cartas)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def detalle_carta_tarot(request, carta_id):
     """Ver detalle de una carta específica"""
-    try:
-        carta = CartaTarot.objects.get(id=carta_id)
-        serializer = CartaTarotSerializer(carta)
-        return Response(serializer.data)
-    except CartaTarot.DoesNotExist:
+    carta = obtener_carta(carta_id)
+    if carta is None:
         return Response({"error": "Carta no encontrada"}, status=404)
+    serializer = CartaTarotSerializer(carta)
+    return Response(serializer.data)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def listar_tipos_tirada(request):
     """Listar todos los tipos de tirada disponibles"""
-    tiradas = TipoTirada.objects.all()
-    serializer = TipoTiradaSerializer(tiradas, many=True)
-    return Response(serializer.data)
+    return catalog.respuesta_catalogo(request, 'tipos_tirada', datos_tipos_tirada)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -350,10 +435,61 @@ def detalle_tipo_tirada(request, tirada_id):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def historial_tiradas(request):
-    """Ver historial de tiradas del usuario"""
-    tiradas = TiradaRealizada.objects.filter(user=request.user).order_by('-fecha')
-    serializer = TiradaRealizadaSerializer(tiradas, many=True)
-    return Response(serializer.data)
+    """
+    Ver historial de tiradas del usuario, de la más reciente a la más antigua.
+
+    Paginación por cursor sobre (fecha, id): `?cursor=` con el valor `siguiente`
+    de la página anterior y `?limite=` (máximo HISTORIAL_LIMITE_MAXIMO).
+    Cada tirada trae solo el resumen; `?fields=interpretacion,cartas` añade detalles.
+    """
+    try:
+        limite = min(max(int(request.query_params.get('limite', HISTORIAL_LIMITE)), 1), HISTORIAL_LIMITE_MAXIMO)
+    except ValueError:
+        return Response({"error": "Límite inválido"}, status=400)
+
+    campos = [c for c in request.query_params.get('fields', '').split(',') if c]
+    invalidos = set(campos) - set(HistorialTiradaSerializer.CAMPOS_DETALLE)
+    if invalidos:
+        return Response({"error": f"Campos no válidos: {', '.join(sorted(invalidos))}"}, status=400)
+
+    tiradas = TiradaRealizada.objects.filter(user=request.user).select_related('tipo_tirada').order_by('-fecha', '-id')
+    if 'interpretacion' not in campos:
+        tiradas = tiradas.defer('interpretacion')
+    if 'cartas' in campos:
+        # Los datos de cada carta salen del mazo en memoria
+        tiradas = tiradas.prefetch_related('cartas')
+
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        posicion = decodificar_cursor(cursor)
+        if posicion is None:
+            return Response({"error": "Cursor inválido"}, status=400)
+        fecha, tirada_id = posicion
+        tiradas = tiradas.filter(Q(fecha__lt=fecha) | Q(fecha=fecha, id__lt=tirada_id))
+
+    pagina = list(tiradas[:limite + 1])
+    siguiente = None
+    if len(pagina) > limite:
+        pagina = pagina[:limite]
+        siguiente = codificar_cursor(pagina[-1])
+
+    serializer = HistorialTiradaSerializer(pagina, many=True, campos=campos)
+    return Response({"resultados": serializer.data, "siguiente": siguiente})
+
+
+def codificar_cursor(tirada):
+    """Cursor opaco con la posición (fecha, id) de la última tirada de la página"""
+    return base64.urlsafe_b64encode(f"{tirada.fecha.isoformat()}|{tirada.id}".encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    """Retorna (fecha, id) o None si el cursor no es válido"""
+    try:
+        fecha, tirada_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        fecha = parse_datetime(fecha)
+        return (fecha, int(tirada_id)) if fecha else None
+    except ValueError:
+        return None
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -366,169 +502,53 @@ def detalle_tirada(request, tirada_id):
     except TiradaRealizada.DoesNotExist:
         return Response({"error": "Tirada no encontrada"}, status=404)
 
-def validar_puede_hacer_tirada(user, tipo_tirada):
+def obtener_interpretacion_tirada(tirada, cartas_en_tirada, usar_cache=True, backend=None):
     """
-    Verifica si el usuario puede realizar una tirada:
-    1. Si tiene suscripción, verifica los límites mensuales
-    2. Si no tiene suscripción, descuenta gemas
-    
-    Retorna (puede_hacer_tirada, mensaje, costo_gemas)
+    Genera la interpretación con el backend configurado (INTERPRETACION_BACKEND).
+    Con usar_cache=True reutiliza la interpretación de una tirada equivalente si existe.
+    Si el backend falla se usa la interpretación de respaldo.
     """
-    profile = user.profile
-    profile.reset_tiradas_mensuales()  # Resetear contadores si cambió el mes
-    
-    # Determinar límites según tipo de tirada
-    if tipo_tirada.tipo == 'basica':
-        tiradas_usadas = profile.tiradas_basicas_usadas
-        campo_actualizar = 'tiradas_basicas_usadas'
-    elif tipo_tirada.tipo == 'claridad':
-        tiradas_usadas = profile.tiradas_claridad_usadas
-        campo_actualizar = 'tiradas_claridad_usadas'
-    elif tipo_tirada.tipo == 'profunda':
-        tiradas_usadas = profile.tiradas_profundas_usadas
-        campo_actualizar = 'tiradas_profundas_usadas'
-    else:
-        return False, "Tipo de tirada no válido", 0
+    if usar_cache:
+        interpretacion = interpretation_cache.obtener_interpretacion_cacheada(tirada, cartas_en_tirada)
+        if interpretacion:
+            return interpretacion
     
-    # Si tiene suscripción y no ha excedido límites mensuales
-    if profile.tiene_suscripcion and tiradas_usadas < tipo_tirada.limite_mensual:
-        setattr(profile, campo_actualizar, tiradas_usadas + 1)
-        profile.save()
-        return True, "Tirada incluida en suscripción", 0
-    
-    # Si no tiene suscripción o ha excedido límites, verificar gemas
-    costo_gemas = tipo_tirada.costo_gemas
-    if profile.gemas >= costo_gemas:
-        profile.gemas -= costo_gemas
-        profile.save()
-        return True, f"Tirada realizada (costo: {costo_gemas} gemas)", costo_gemas
-    
-    return False, f"No tienes suficientes gemas para esta tirada. Necesitas {costo_gemas} gemas.", 0
-
-def obtener_interpretacion_tirada(tirada, cartas_en_tirada):
-    """
-    Genera interpretación usando Anthropic API con manejo de errores mejorado
-    """
+    backend = backend or interpretation_backends.obtener_backend()
     try:
-        # Obtener API key directamente de las variables de entorno
-        api_key = os.environ.get('ANTHROPIC_API_KEY')
-        
-        if not api_key:
-            logger.error("API key no encontrada en variables de entorno")
-            return generar_interpretacion_fallback(tirada)
-            
-        # Preparar los datos de las cartas
-        cartas_texto = []
-        for carta in cartas_en_tirada:
-            estado = "invertida" if carta.invertida else "normal"
-            significado = carta.carta.significado_invertido if carta.invertida else carta.carta.significado_normal
-            cartas_texto.append(f"Carta {carta.posicion}: {carta.carta.nombre} ({estado}) - {significado[:150]}...")
-        
-        cartas_info = "\n".join(cartas_texto)
-        
-        # Usar requests directamente para mayor control (más estable que el SDK en algunos entornos)
-        import requests
-        
-        headers = {
-            "x-api-key": api_key,
-            "content-type": "application/json",
-            "anthropic-version": "2023-06-01"
-        }
-        
-        data = {
-            "model": "claude-3-5-sonnet-20240620",
-            "max_tokens": 1000,
-            "temperature": 0.7,
-            "system": "Eres un experto tarotista que proporciona interpretaciones místicas pero prácticas.",
-            "messages": [
-                {
-                    "role": "user", 
-                    "content": f"""Interpreta esta tirada de tarot para la pregunta: "{tirada.pregunta}"
-                    
-                    Tipo de tirada: {tirada.tipo_tirada.nombre}
-                    
-                    Cartas:
-                    {cartas_info}
-                    
-                    Da una interpretación completa, esotérica y mística pero práctica, relacionando las cartas entre sí y respondiendo a la pregunta. Usa genere neutral para referirte al consultante ya que no sabemos si es hombre o mujer"""
-                }
-            ]
-        }
-        
-        # Hacer la solicitud con un timeout generoso
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=data,
-            timeout=30  # 30 segundos de timeout
-        )
-        
-        # Verificar si la respuesta fue exitosa
-        if response.status_code == 200:
-            resultado = response.json()
-            interpretacion = resultado.get("content", [{}])[0].get("text", "")
-            if interpretacion:
-                return interpretacion
-                
-        # Si llegamos aquí, hubo algún problema con la respuesta
-        logger.error(f"Error API Anthropic: {response.status_code} - {response.text}")
-        return generar_interpretacion_fallback(tirada)
-        
+        interpretacion = backend.interpretar(tirada, cartas_en_tirada)
     except Exception as e:
         # Capturar y registrar cualquier excepción
-        logger.error(f"Error en obtener_interpretacion_tirada: {str(e)}")
+        logger.error(f"Error en obtener_interpretacion_tirada ({backend.nombre}): {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
+        interpretacion = None
+    
+    if not interpretacion:
         return generar_interpretacion_fallback(tirada)
+    if backend.cacheable:
+        interpretation_cache.guardar_interpretacion(tirada, cartas_en_tirada, interpretacion)
+    return interpretacion
 
-def generar_interpretacion_fallback(tirada):
+def responder_tirada_asincrona(tirada, cartas_en_tirada, mensaje, costo, usar_cache=True):
     """
-    Genera una interpretación de respaldo cuando hay problemas con la API.
-    Esta función proporciona una respuesta mística general que parece una interpretación real.
-    
-    Args:
-        tirada: Objeto TiradaRealizada
-    
-    Returns:
-        str: Interpretación de respaldo
+    Responde 202 con las cartas de una tirada 'pendiente' sin esperar a la API.
+    El worker procesar_interpretaciones completará la interpretación.
+    Si la caché ya tiene la interpretación, la tirada se completa en el acto (200).
     """
-    nombre_tirada = tirada.tipo_tirada.nombre if hasattr(tirada, 'tipo_tirada') and tirada.tipo_tirada else "del tarot"
-    pregunta = tirada.pregunta if tirada.pregunta else "tu consulta"
-    
-    interpretacion = f"""
-    Al contemplar tu tirada {nombre_tirada} sobre "{pregunta}", 
-    percibo energías entrelazadas que revelan aspectos importantes de tu situación actual.
-    
-    Las cartas han acudido a ti en este momento específico por una razón. No es casualidad, 
-    sino causalidad mística que conecta tu esencia con los arquetipos universales representados en el tarot.
-    
-    La disposición actual sugiere que te encuentras en un punto de transición, donde el pasado 
-    ejerce su influencia sobre tu presente, mientras que el futuro se despliega según las energías 
-    que estás cultivando ahora.
-    
-    Veo un patrón de elementos contrastantes: luces y sombras, desafíos y oportunidades, 
-    que te invitan a encontrar el equilibrio en medio de las polaridades de la existencia.
+    interpretacion = interpretation_cache.obtener_interpretacion_cacheada(tirada, cartas_en_tirada) if usar_cache else None
+    if interpretacion:
+        guardar_interpretacion_tirada(tirada, interpretacion)
     
-    Las cartas revelan que parte de la respuesta que buscas ya está en tu interior, 
-    pero quizás no has reconocido plenamente su presencia o significado. 
-    La sabiduría del tarot te anima a conectar con tu intuición y escuchar esa voz interior.
-    
-    El consejo principal que emerge de esta tirada es permanecer centrado mientras 
-    navegas por los cambios que se presentan. La adaptabilidad y la consciencia 
-    serán tus mejores aliadas en el camino que se despliega ante ti.
-    
-    Recuerda que las cartas no determinan un destino inmutable, sino que iluminan 
-    potenciales y tendencias energéticas que pueden ser transformadas mediante 
-    tus decisiones y tu nivel de consciencia.
-    
-    Este es un momento para confiar en el proceso de la vida, sabiendo que cada experiencia, 
-    sea desafiante o placentera, contribuye a tu crecimiento y evolución espiritual.
-    """
-    
-    return interpretacion
+    serializer = TiradaRealizadaSerializer(tirada)
+    return Response({
+        "mensaje": mensaje,
+        "costo_gemas": costo,
+        "tirada": serializer.data
+    }, status=status.HTTP_200_OK if interpretacion else status.HTTP_202_ACCEPTED)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LimiteTiradas])
 def realizar_tirada(request):
     """Realizar una nueva tirada de tarot"""
     serializer = CrearTiradaSerializer(data=request.data)
@@ -538,46 +558,25 @@ def realizar_tirada(request):
     
     tipo_tirada = serializer.validated_data['tipo_tirada']
     pregunta = serializer.validated_data['pregunta']
+    asincrona = serializer.validated_data['asincrona']
+    usar_cache = serializer.validated_data['usar_cache']
     
-    # Verificar si el usuario puede realizar esta tirada
-    puede_hacer_tirada, mensaje, costo = validar_puede_hacer_tirada(request.user, tipo_tirada)
+    # Cobrar la tirada y guardar sus cartas
+    tirada, cartas_en_tirada, mensaje, costo = registrar_tirada(
+        request.user, tipo_tirada, pregunta,
+        estado='pendiente' if asincrona else 'procesando'
+    )
     
-    if not puede_hacer_tirada:
+    if tirada is None:
         return Response({"error": mensaje}, status=400)
     
-    # Seleccionar cartas aleatorias
-    cartas = list(CartaTarot.objects.all())
-    if len(cartas) < tipo_tirada.num_cartas:
-        return Response({"error": "No hay suficientes cartas registradas para este tipo de tirada"}, status=400)
-    
-    cartas_seleccionadas = random.sample(cartas, tipo_tirada.num_cartas)
-    
-    # Crear la tirada
-    tirada = TiradaRealizada.objects.create(
-        user=request.user,
-        tipo_tirada=tipo_tirada,
-        pregunta=pregunta,
-        interpretacion=""  # La interpretación se añadirá después
-    )
-    
-    # Crear las cartas en la tirada
-    cartas_en_tirada = []
-    for i, carta in enumerate(cartas_seleccionadas):
-        # 50% de probabilidad de que la carta esté invertida
-        invertida = random.choice([True, False])
-        
-        carta_tirada = CartaEnTirada.objects.create(
-            tirada=tirada,
-            carta=carta,
-            posicion=i+1,
-            invertida=invertida
-        )
-        cartas_en_tirada.append(carta_tirada)
+    # En modo asíncrono la interpretación se genera en segundo plano
+    if asincrona:
+        return responder_tirada_asincrona(tirada, cartas_en_tirada, mensaje, costo, usar_cache)
     
     # Obtener interpretación usando la función mejorada con Anthropic
-    interpretacion = obtener_interpretacion_tirada(tirada, cartas_en_tirada)
-    tirada.interpretacion = interpretacion
-    tirada.save()
+    interpretacion = obtener_interpretacion_tirada(tirada, cartas_en_tirada, usar_cache)
+    guardar_interpretacion_tirada(tirada, interpretacion)
     
     # Devolver resultado
     serializer = TiradaRealizadaSerializer(tirada)
@@ -589,6 +588,30 @@ def realizar_tirada(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LimiteTiradas])
+def crear_tirada(request):
+    """Realizar una tirada en modo asíncrono: devuelve las cartas y encola la interpretación"""
+    serializer = CrearTiradaSerializer(data=request.data)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=400)
+    
+    tipo_tirada = serializer.validated_data['tipo_tirada']
+    pregunta = serializer.validated_data['pregunta']
+    
+    tirada, cartas_en_tirada, mensaje, costo = registrar_tirada(
+        request.user, tipo_tirada, pregunta, estado='pendiente'
+    )
+    
+    if tirada is None:
+        return Response({"error": mensaje}, status=400)
+    
+    return responder_tirada_asincrona(tirada, cartas_en_tirada, mensaje, costo,
+                                      serializer.validated_data['usar_cache'])
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([LimiteCompras])
 def create_paypal_payment(request):
     try:
         amount = request.data.get('amount')
@@ -621,8 +644,8 @@ def create_paypal_payment(request):
             }
         }
         
-        response = requests.post(
-            f'{PAYPAL_API_BASE}/v2/checkout/orders',
+        response = http_client.post(
+            f'{get_paypal_config()["api_base"]}/v2/checkout/orders',
             headers=headers,
             json=order_data
         )
@@ -658,76 +681,88 @@ def create_paypal_payment(request):
             'error': str(e)
         }, status=status.HTTP_400_BAD_REQUEST)
 
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def paypal_payment_webhook(request):
+def verificar_webhook_paypal(request):
+    """Verifica localmente la firma de un webhook de PayPal (cuerpo sin parsear)"""
+    return paypal_signature.verificar_firma(request.headers, request.body, settings.PAYPAL_WEBHOOK_ID)
+
+def recibir_webhook_paypal(request):
+    """
+    Verifica el webhook y lo guarda en la bandeja de eventos.
+    Los reintentos de PayPal con el mismo id de evento no hacen nada.
+    """
     try:
-        # Verify webhook signature
-        webhook_id = settings.PAYPAL_WEBHOOK_ID
-        headers = {
-            'Authorization': f'Bearer {get_paypal_access_token()}',
-            'Content-Type': 'application/json'
-        }
-        
-        verification_data = {
-            'auth_algo': request.headers.get('PAYPAL-AUTH-ALGO'),
-            'cert_url': request.headers.get('PAYPAL-CERT-URL'),
-            'transmission_id': request.headers.get('PAYPAL-TRANSMISSION-ID'),
-            'transmission_sig': request.headers.get('PAYPAL-TRANSMISSION-SIG'),
-            'transmission_time': request.headers.get('PAYPAL-TRANSMISSION-TIME'),
-            'webhook_id': webhook_id,
-            'webhook_event': request.data
-        }
-        
-        verify_response = requests.post(
-            f'{PAYPAL_API_BASE}/v1/notifications/verify-webhook-signature',
-            headers=headers,
-            json=verification_data
-        )
-        
-        if verify_response.status_code != 200 or verify_response.json()['verification_status'] != 'SUCCESS':
+        if not verificar_webhook_paypal(request):
             return Response({
                 'error': 'Invalid webhook signature'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Process webhook
-        event_type = request.data.get('event_type')
-        resource = request.data.get('resource', {})
-        order_id = resource.get('id')
-        
-        if not order_id:
+        event_id = request.data.get('id')
+        if not event_id or not request.data.get('resource', {}).get('id'):
             return Response({
-                'error': 'Order ID not found in webhook'
+                'error': 'Event or resource ID not found in webhook'
             }, status=status.HTTP_400_BAD_REQUEST)
-            
-        payment = PayPalPayment.objects.get(order_id=order_id)
-        
-        if event_type == 'CHECKOUT.ORDER.APPROVED':
-            payment.status = 'COMPLETED'
-            payment.save()
-            
-            # Add gems to user's account
-            user_profile = UserProfile.objects.get(user=payment.user)
-            user_profile.gemas += payment.gems_amount
-            user_profile.save()
-            
-            logger.info(f'Added {payment.gems_amount} gems to user {payment.user.id}')
         
-        serializer = PayPalPaymentSerializer(payment)
-        return Response(serializer.data)
+        webhook_inbox.registrar_evento('paypal', event_id, request.data.get('event_type', ''), request.data)
+        return Response({'status': 'recibido'})
         
-    except PayPalPayment.DoesNotExist:
-        return Response({
-            'error': 'Payment not found'
-        }, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
-        logger.error(f'Error processing PayPal webhook: {str(e)}')
+        logger.error(f'Error receiving PayPal webhook: {str(e)}')
         return Response({
             'error': str(e)
         }, status=status.HTTP_400_BAD_REQUEST)
 
+def procesar_evento_paypal(event_type, event):
+    """Aplica un evento de PayPal guardado en la bandeja de webhooks"""
+    resource_id = event['resource']['id']
+    
+    if event_type == 'CHECKOUT.ORDER.APPROVED':
+        try:
+            payment = PayPalPayment.objects.get(order_id=resource_id)
+        except PayPalPayment.DoesNotExist:
+            logger.warning(f'PayPal payment not found: {resource_id}')
+            return
+        
+        payment.status = 'COMPLETED'
+        payment.save()
+        
+        # Add gems to user's account
+        ledger.acreditar_gemas(payment.user_id, payment.gems_amount, 'compra_gemas', resource_id)
+        
+        logger.info(f'Added {payment.gems_amount} gems to user {payment.user_id}')
+    
+    elif event_type in ('BILLING.SUBSCRIPTION.ACTIVATED', 'BILLING.SUBSCRIPTION.CANCELLED'):
+        try:
+            subscription = PayPalSubscription.objects.get(subscription_id=resource_id)
+        except PayPalSubscription.DoesNotExist:
+            logger.warning(f'PayPal subscription not found: {resource_id}')
+            return
+        
+        if event_type == 'BILLING.SUBSCRIPTION.ACTIVATED':
+            subscription.status = 'ACTIVE'
+            subscription.save()
+            
+            # Update user's premium status, resetting tiradas and adding
+            # bonus gemas only when the user was not subscribed yet
+            ledger.activar_suscripcion(subscription.user_id)
+            
+            logger.info(f'Activated premium subscription for user {subscription.user_id}')
+        else:
+            subscription.status = 'CANCELLED'
+            subscription.save()
+            
+            # Update user's premium status
+            ledger.cancelar_suscripcion(subscription.user_id)
+            
+            logger.info(f'Cancelled premium subscription for user {subscription.user_id}')
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def paypal_payment_webhook(request):
+    return recibir_webhook_paypal(request)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LimiteCompras])
 def create_paypal_subscription(request):
     try:
         # Create PayPal subscription
@@ -747,8 +782,8 @@ def create_paypal_subscription(request):
             }
         }
         
-        response = requests.post(
-            f'{PAYPAL_API_BASE}/v1/billing/subscriptions',
+        response = http_client.post(
+            f'{get_paypal_config()["api_base"]}/v1/billing/subscriptions',
             headers=headers,
             json=subscription_data
         )
@@ -782,84 +817,4 @@ def create_paypal_subscription(request):
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def paypal_subscription_webhook(request):
-    try:
-        # Verify webhook signature
-        webhook_id = settings.PAYPAL_WEBHOOK_ID
-        headers = {
-            'Authorization': f'Bearer {get_paypal_access_token()}',
-            'Content-Type': 'application/json'
-        }
-        
-        verification_data = {
-            'auth_algo': request.headers.get('PAYPAL-AUTH-ALGO'),
-            'cert_url': request.headers.get('PAYPAL-CERT-URL'),
-            'transmission_id': request.headers.get('PAYPAL-TRANSMISSION-ID'),
-            'transmission_sig': request.headers.get('PAYPAL-TRANSMISSION-SIG'),
-            'transmission_time': request.headers.get('PAYPAL-TRANSMISSION-TIME'),
-            'webhook_id': webhook_id,
-            'webhook_event': request.data
-        }
-        
-        verify_response = requests.post(
-            f'{PAYPAL_API_BASE}/v1/notifications/verify-webhook-signature',
-            headers=headers,
-            json=verification_data
-        )
-        
-        if verify_response.status_code != 200 or verify_response.json()['verification_status'] != 'SUCCESS':
-            return Response({
-                'error': 'Invalid webhook signature'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Process webhook
-        event_type = request.data.get('event_type')
-        resource = request.data.get('resource', {})
-        subscription_id = resource.get('id')
-        
-        if not subscription_id:
-            return Response({
-                'error': 'Subscription ID not found in webhook'
-            }, status=status.HTTP_400_BAD_REQUEST)
-            
-        subscription = PayPalSubscription.objects.get(subscription_id=subscription_id)
-        
-        if event_type == 'BILLING.SUBSCRIPTION.ACTIVATED':
-            subscription.status = 'ACTIVE'
-            subscription.save()
-            
-            # Update user's premium status
-            user_profile = UserProfile.objects.get(user=subscription.user)
-            was_subscribed = user_profile.tiene_suscripcion
-            user_profile.tiene_suscripcion = True
-            
-            # Reset tiradas and add bonus gemas when subscribing
-            if not was_subscribed:
-                user_profile = reset_subscription_benefits(user_profile)
-            else:
-                user_profile.save()
-                
-            logger.info(f'Activated premium subscription for user {subscription.user.id}')
-            
-        elif event_type == 'BILLING.SUBSCRIPTION.CANCELLED':
-            subscription.status = 'CANCELLED'
-            subscription.save()
-            
-            # Update user's premium status
-            user_profile = UserProfile.objects.get(user=subscription.user)
-            user_profile.tiene_suscripcion = False
-            user_profile.save()
-            
-            logger.info(f'Cancelled premium subscription for user {subscription.user.id}')
-        
-        serializer = PayPalSubscriptionSerializer(subscription)
-        return Response(serializer.data)
-        
-    except PayPalSubscription.DoesNotExist:
-        return Response({
-            'error': 'Subscription not found'
-        }, status=status.HTTP_404_NOT_FOUND)
-    except Exception as e:
-        logger.error(f'Error processing PayPal subscription webhook: {str(e)}')
-        return Response({
-            'error': str(e)
-        }, status=status.HTTP_400_BAD_REQUEST)
+    return recibir_webhook_paypal(request)
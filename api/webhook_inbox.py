@@ -0,0 +1,111 @@
+"""
+Webhook inbox module for TarotNautica
+
+Los webhooks de Stripe y PayPal no se procesan en la petición: tras verificar
+la firma, el evento se inserta en WebhookEvent (ignorando el conflicto si el
+proveedor lo reintenta) y se responde 200 de inmediato. Un worker
+(`python manage.py procesar_webhooks`) aplica los eventos pendientes en orden
+de llegada, reclamando cada uno con un UPDATE condicional. Si el worker cae
+con un evento reclamado, el evento vuelve a 'pendiente' cuando vence su
+reclamo (RECLAMO_VENCIMIENTO) y otro ciclo lo reintenta.
+"""
+import logging
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+# Intentos antes de dejar un evento en estado 'error'
+MAX_INTENTOS = 5
+
+# Tiempo tras el que un evento 'procesando' sin terminar se da por abandonado
+RECLAMO_VENCIMIENTO = timedelta(minutes=5)
+
+
+def registrar_evento(provider, event_id, event_type, payload):
+    """Guarda el evento si no existe ya (INSERT ... ON CONFLICT DO NOTHING)"""
+    WebhookEvent.objects.bulk_create([
+        WebhookEvent(provider=provider, event_id=event_id, event_type=event_type, payload=payload)
+    ], ignore_conflicts=True)
+
+
+def reclamar_evento(evento_id):
+    """
+    Marca un evento pendiente como 'procesando'.
+
+    Returns:
+        bool: True si este worker obtuvo el evento
+    """
+    actualizados = WebhookEvent.objects.filter(
+        id=evento_id, estado='pendiente'
+    ).update(estado='procesando', intentos=F('intentos') + 1, reclamado=timezone.now())
+    return actualizados == 1
+
+
+def reintentar_vencidos():
+    """
+    Devuelve a 'pendiente' los eventos cuyo reclamo venció, o los deja en
+    'error' si ya agotaron sus intentos.
+
+    Returns:
+        int: Número de eventos liberados
+    """
+    vencidos = WebhookEvent.objects.filter(
+        Q(reclamado__lt=timezone.now() - RECLAMO_VENCIMIENTO) | Q(reclamado__isnull=True),
+        estado='procesando'
+    )
+    agotados = vencidos.filter(intentos__gte=MAX_INTENTOS).update(
+        estado='error', reclamado=None, error='Reclamo vencido'
+    )
+    return agotados + vencidos.update(estado='pendiente', reclamado=None)
+
+
+def aplicar_evento(evento):
+    """Ejecuta el manejador del proveedor del evento"""
+    if evento.provider == 'stripe':
+        from .stripe_views import procesar_evento_stripe
+        procesar_evento_stripe(evento.event_type, evento.payload)
+    else:
+        from .views import procesar_evento_paypal
+        procesar_evento_paypal(evento.event_type, evento.payload)
+
+
+def procesar_eventos(limite=50):
+    """
+    Aplica hasta `limite` eventos pendientes, del más antiguo al más reciente.
+
+    Returns:
+        int: Número de eventos procesados
+    """
+    vencidos = reintentar_vencidos()
+    if vencidos:
+        logger.warning(f"Webhooks con el reclamo vencido liberados: {vencidos}")
+
+    pendientes = WebhookEvent.objects.filter(estado='pendiente').order_by('id')
+    evento_ids = list(pendientes.values_list('id', flat=True)[:limite])
+
+    procesados = 0
+    for evento_id in evento_ids:
+        if not reclamar_evento(evento_id):
+            continue
+
+        evento = WebhookEvent.objects.get(id=evento_id)
+        try:
+            # El evento y sus efectos se confirman juntos
+            with transaction.atomic():
+                aplicar_evento(evento)
+                WebhookEvent.objects.filter(id=evento_id).update(
+                    estado='procesado', procesado=timezone.now(), error=''
+                )
+            procesados += 1
+        except Exception as e:
+            logger.error(f"Error procesando webhook {evento.provider} {evento.event_id}: {str(e)}")
+            WebhookEvent.objects.filter(id=evento_id).update(
+                estado='error' if evento.intentos >= MAX_INTENTOS else 'pendiente',
+                reclamado=None, error=str(e)
+            )
+
+    return procesados
@@ -11,6 +11,11 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Las vistas asíncronas (p. ej. realizar-tirada/stream/) deben servirse por ASGI,
+# por ejemplo: uvicorn core.asgi:application
+is_production = os.environ.get('DJANGO_PRODUCTION', '') == 'True'
+settings_module = 'core.settings_production' if is_production else 'core.settings'
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
 
 application = get_asgi_application()
@@ -83,6 +83,11 @@ DATABASES = {
     'default': {
         'ENGINE': os.getenv('DATABASE_ENGINE', 'django.db.backends.sqlite3'),
         'NAME': BASE_DIR / os.getenv('DATABASE_NAME', 'db.sqlite3'),
+        # Base de tests en archivo: la base en memoria compartida bloquea tablas
+        # en vez de esperar, y los tests de concurrencia usan varios hilos
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -130,7 +135,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Construye request.user a partir de los claims del token (ver api/authentication.py)
+        'api.authentication.JWTClaimsAuthentication',
     )
 }
 
@@ -148,6 +154,34 @@ AUTH_USER_MODEL = 'api.CustomUser'
 
 # Configuración para APIs externas
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', '')
+ANTHROPIC_API_URL = os.getenv('ANTHROPIC_API_URL', 'https://api.anthropic.com')
+ANTHROPIC_MODEL = os.getenv('ANTHROPIC_MODEL', 'claude-3-5-sonnet-20240620')
+
+# Backend de interpretaciones: 'messages', 'lotes', 'local' o 'fallback'
+# (ver api/interpretation_backends.py). Las tiradas no urgentes usan INTERPRETACION_BACKEND_LOTES.
+INTERPRETACION_BACKEND = os.getenv('INTERPRETACION_BACKEND', 'messages')
+INTERPRETACION_BACKEND_LOTES = os.getenv('INTERPRETACION_BACKEND_LOTES', 'lotes')
+INTERPRETACION_LOTE_MAXIMO = int(os.getenv('INTERPRETACION_LOTE_MAXIMO', 100))
+
+# Prompt de interpretación: presupuesto de tokens del significado de cada carta
+# y caracteres por token usados para estimarlos (ver api/prompt_builder.py)
+PROMPT_TOKENS_POR_CARTA = int(os.getenv('PROMPT_TOKENS_POR_CARTA', 60))
+PROMPT_CARACTERES_POR_TOKEN = float(os.getenv('PROMPT_CARACTERES_POR_TOKEN', 3.5))
+
+# Circuito de la API de Anthropic (estado compartido en la caché por defecto)
+LLM_CIRCUITO_VENTANA = int(os.getenv('LLM_CIRCUITO_VENTANA', 30))
+LLM_CIRCUITO_MIN_SOLICITUDES = int(os.getenv('LLM_CIRCUITO_MIN_SOLICITUDES', 10))
+LLM_CIRCUITO_UMBRAL_ERRORES = float(os.getenv('LLM_CIRCUITO_UMBRAL_ERRORES', 0.5))
+LLM_CIRCUITO_LATENCIA_LENTA = float(os.getenv('LLM_CIRCUITO_LATENCIA_LENTA', 15))
+LLM_CIRCUITO_UMBRAL_LENTAS = float(os.getenv('LLM_CIRCUITO_UMBRAL_LENTAS', 0.5))
+LLM_CIRCUITO_APERTURA = int(os.getenv('LLM_CIRCUITO_APERTURA', 30))
+
+# Límite adaptativo de llamadas a Anthropic en curso por proceso
+LLM_CONCURRENCIA_INICIAL = int(os.getenv('LLM_CONCURRENCIA_INICIAL', 8))
+LLM_CONCURRENCIA_MINIMA = int(os.getenv('LLM_CONCURRENCIA_MINIMA', 1))
+LLM_CONCURRENCIA_MAXIMA = int(os.getenv('LLM_CONCURRENCIA_MAXIMA', 32))
+LLM_LATENCIA_OBJETIVO = float(os.getenv('LLM_LATENCIA_OBJETIVO', 10))
+LLM_CONCURRENCIA_ESPERA = float(os.getenv('LLM_CONCURRENCIA_ESPERA', 1))
 
 # Asegurarse de que la clave API esté configurada en entorno de producción
 if not ANTHROPIC_API_KEY and not DEBUG:
@@ -157,6 +191,78 @@ if not ANTHROPIC_API_KEY and not DEBUG:
         "usarán respuestas genéricas."
     )
 
+# Caché por defecto: con CACHE_URL (redis://host:6379/0, que requiere el paquete
+# redis, o memcached://host:11211, que requiere pymemcache) la comparten todos los
+# procesos; sin ella es una LocMemCache local a cada proceso
+CACHE_URL = os.getenv('CACHE_URL', '')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHE_DEFAULT = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}
+elif CACHE_URL.startswith('memcached://'):
+    CACHE_DEFAULT = {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': CACHE_URL.removeprefix('memcached://'),
+    }
+else:
+    CACHE_DEFAULT = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+
+# Si la caché por defecto la ven todos los workers, webhooks y comandos. Las
+# instantáneas de perfil y de ítems poseídos solo se cachean con una caché
+# compartida; con una local leen la base (ver api/profile_cache.py)
+CACHE_COMPARTIDA = os.getenv('CACHE_COMPARTIDA', str(bool(CACHE_URL))) == 'True'
+
+# Cachés: 'interpretaciones' guarda textos de la API por composición de tirada
+# (TTL configurable; al llenarse descarta las entradas menos usadas recientemente)
+CACHES = {
+    'default': CACHE_DEFAULT,
+    'interpretaciones': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'interpretaciones',
+        'TIMEOUT': int(os.getenv('CACHE_INTERPRETACIONES_TTL', 60 * 60 * 24 * 7)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_INTERPRETACIONES_MAX_ENTRADAS', 5000)),
+        },
+    },
+}
+
+# Cliente HTTP saliente (Anthropic, PayPal, Stripe): pools keep-alive por host
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 10))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 10))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 15))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 2))
+HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', 0.3))
+
+# Tiradas asíncronas: espera máxima del long-poll en tiradas/<id>/
+TIRADA_LONG_POLL_MAX_SEGUNDOS = int(os.getenv('TIRADA_LONG_POLL_MAX_SEGUNDOS', 20))
+TIRADA_LONG_POLL_INTERVALO = float(os.getenv('TIRADA_LONG_POLL_INTERVALO', 0.5))
+# Segundos tras los que una tirada reclamada ('procesando') y sin terminar vuelve a la cola
+INTERPRETACION_RECLAMO_SEGUNDOS = int(os.getenv('INTERPRETACION_RECLAMO_SEGUNDOS', 300))
+
+# Respuestas cacheadas de los catálogos (ver api/catalog.py). Solo el contador de
+# versión es permanente; las versiones sustituidas caducan tras este tiempo
+CACHE_CATALOGO_TTL = int(os.getenv('CACHE_CATALOGO_TTL', 60 * 60 * 24))
+
+# Hechizos y pociones comprados por usuario (bitmap en la caché por defecto)
+CACHE_POSEIDOS_TTL = int(os.getenv('CACHE_POSEIDOS_TTL', 60 * 60 * 24))
+
+# Instantáneas del perfil por usuario (ver api/profile_cache.py)
+CACHE_PERFIL_TTL = int(os.getenv('CACHE_PERFIL_TTL', 60 * 60))
+
+# Límites de peticiones por clase de endpoint (ver api/rate_limit.py):
+# ámbito -> (capacidad del token bucket, segundos en rellenarlo por completo)
+LIMITES_PETICIONES_ACTIVOS = os.getenv('LIMITES_PETICIONES_ACTIVOS', 'True') == 'True'
+LIMITES_PETICIONES = {
+    'tiradas': {
+        'usuario': (int(os.getenv('LIMITE_TIRADAS_USUARIO', 10)), 60),
+        'ip': (int(os.getenv('LIMITE_TIRADAS_IP', 30)), 60),
+        'global': (int(os.getenv('LIMITE_TIRADAS_GLOBAL', 600)), 60),
+    },
+    'compras': {
+        'usuario': (int(os.getenv('LIMITE_COMPRAS_USUARIO', 20)), 60),
+        'ip': (int(os.getenv('LIMITE_COMPRAS_IP', 60)), 60),
+        'global': (int(os.getenv('LIMITE_COMPRAS_GLOBAL', 1200)), 60),
+    },
+}
+
 # Configuración de logging mejorada para registro de errores API
 LOGGING = {
     'version': 1,
@@ -205,6 +311,14 @@ PAYPAL_RETURN_URL = os.getenv('PAYPAL_RETURN_URL')
 PAYPAL_CANCEL_URL = os.getenv('PAYPAL_CANCEL_URL')
 PAYPAL_SUBSCRIPTION_RETURN_URL = os.getenv('PAYPAL_SUBSCRIPTION_RETURN_URL')
 PAYPAL_SUBSCRIPTION_CANCEL_URL = os.getenv('PAYPAL_SUBSCRIPTION_CANCEL_URL')
+PAYPAL_WEBHOOK_ID = os.getenv('PAYPAL_WEBHOOK_ID')
+# Verificación local de webhooks: hosts de los que se aceptan certificados y TTL de su caché
+PAYPAL_CERT_HOSTS = os.getenv(
+    'PAYPAL_CERT_HOSTS', 'api.paypal.com,api-m.paypal.com,api.sandbox.paypal.com,api-m.sandbox.paypal.com'
+).split(',')
+PAYPAL_CERT_CACHE_TTL = int(os.getenv('PAYPAL_CERT_CACHE_TTL', 60 * 60 * 24))
+# Segundos antes de la expiración del token OAuth en que se pide el siguiente
+PAYPAL_TOKEN_MARGEN_REFRESCO = int(os.getenv('PAYPAL_TOKEN_MARGEN_REFRESCO', 300))
 
 
 